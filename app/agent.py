@@ -3,15 +3,21 @@
 Agente con Gemini + Tools (Gmail, Calendar) + Memoria por sesión.
 Usa langgraph para el loop de tool-calling.
 """
+import json
 import os
-from typing import Dict, List
+import threading
+from typing import AsyncIterator, Dict, List, Optional
 
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
-from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import MemorySaver
 
-from .agent_tools import TOOLS, pdf_storage  # Tools de Gmail y Calendar + PDF storage
+from .checkpointer import SUMMARY_ID, create_checkpointer
+from .context_budget import budget_stats, make_pre_model_hook
+from .metrics import MetricsCallbackHandler, current_timings
+from .agent_tools import TOOLS, pdf_query_cache_stats, tool_fanout_config  # Tools de Gmail, Calendar y PDF
+from .doc_store import doc_store
+from .response_cache import TTLCache, cache_key, normalize_text
+from .scheduler import GatedChatModel, scheduler
+from .state_store import state_store
 
 
 # ---------- System prompt para el agente ----------
@@ -36,10 +42,13 @@ FECHA Y HORA ACTUAL: Hoy es {day_es}, {today}. La zona horaria es America/Mazatl
 CAPACIDADES:
 - Puedes enviar correos electrónicos usando la herramienta 'gmail_send'
 - Puedes crear eventos en el calendario usando 'calendar_create_event'
-- Puedes consultar el contenido de un PDF cargado usando 'pdf_query'
+- Puedes consultar la agenda con 'calendar_list_events' y buscar huecos libres con 'calendar_find_free_slots'
+- Para varios correos o varios eventos a la vez usa 'gmail_send_batch' / 'calendar_create_events_batch' (una sola llamada con la lista completa)
+- Puedes consultar el contenido de un PDF cargado usando 'pdf_query' y resumirlo completo con 'pdf_summarize'
 
 INSTRUCCIONES PARA CORREOS:
 - Usa gmail_send con to, subject y body
+- Para adjuntar un PDF que el usuario subió, pasa su id en attach_doc_ids (el id de [DOCUMENTO ADJUNTO id=...])
 
 INSTRUCCIONES PARA EVENTOS:
 - Usa calendar_create_event con summary, start_datetime, end_datetime
@@ -50,9 +59,13 @@ INSTRUCCIONES PARA EVENTOS:
 - Siempre usa la zona horaria America/Mazatlan (-07:00)
 - Si el usuario dice "10:00 AM", conviértelo a "10:00:00-07:00"
 - Si dice "11:30 AM", conviértelo a "11:30:00-07:00"
+- Antes de crear un evento, revisa con calendar_list_events si choca con otro; si choca, avisa al usuario y propone un hueco libre
+- Para "¿estoy libre el jueves?" o "¿cuándo puedo agendar...?" usa calendar_find_free_slots
 
 INSTRUCCIONES PARA PDFs:
-- Cuando el usuario pregunte sobre un documento, PDF, archivo, o quiera que analices/resumas algo, usa pdf_query
+- Cuando el usuario pregunte sobre un documento, PDF, archivo, o quiera que analices/busques algo, usa pdf_query
+- Si pide un resumen general del documento, usa pdf_summarize (cubre todas las páginas, no solo las relevantes)
+- Los documentos adjuntos se anuncian una sola vez con [DOCUMENTO ADJUNTO id=...]; su texto NO está en la conversación, consúltalo siempre con pdf_query
 - Si no hay PDF cargado, indica que deben subir uno primero
 
 COMPORTAMIENTO:
@@ -65,74 +78,276 @@ COMPORTAMIENTO:
 
 # ---------- Estado del módulo ----------
 _agent = None
-_memory = MemorySaver()  # Memoria persistente por thread_id
+_memory = None  # Memoria por thread_id (SQLite en disco, con desalojo); se crea con el agente
+_chat_model = None  # modelo de chat en uso (Gemini por defecto; inyectable para benchmarks)
+# El warm-up del lifespan construye el agente en un hilo mientras llegan los primeros requests:
+# un solo agente y un solo checkpointer por proceso (_saved_state lee el mismo _memory que escribe el agente)
+_init_lock = threading.RLock()
 
 
-def _get_agent():
-    """Lazy init del agente."""
-    global _agent
-    if _agent is None:
+def set_chat_model(llm) -> None:
+    """Sustituye el modelo de chat (p. ej. un modelo falso en benchmarks) y reconstruye el agente."""
+    global _chat_model, _agent
+    with _init_lock:
+        _chat_model = llm
+        _agent = None
+
+
+def get_chat_model():
+    """Lazy init del modelo de chat."""
+    global _chat_model
+    if _chat_model is not None:
+        return _chat_model
+    with _init_lock:
+        if _chat_model is not None:
+            return _chat_model
         api_key = os.getenv("GOOGLE_API_KEY")
         if not api_key:
             raise ValueError("Falta GOOGLE_API_KEY")
         model_name = os.getenv("MODEL_NAME", "gemini-2.0-flash")
 
-        llm = ChatGoogleGenerativeAI(
+        from langchain_google_genai import ChatGoogleGenerativeAI  # import pesado: solo al crear el modelo
+        _chat_model = ChatGoogleGenerativeAI(
             model=model_name,
             temperature=0.7,
             max_retries=2,
         )
+    return _chat_model
+
+
+def _model_name(llm) -> str:
+    return getattr(llm, "model", None) or getattr(llm, "_llm_type", "llm")
+
+
+def _drop_sessions(session_ids: List[str]) -> None:
+    """
+    El checkpointer desalojó estas sesiones (TTL/LRU): su registro de documentos y lo anunciado
+    se borran del estado compartido, junto con los leases de sesión vencidos.
+    """
+    for session_id in session_ids:
+        doc_store.drop_session(session_id)
+        state_store.delete(ANNOUNCED_NAMESPACE, session_id)
+    scheduler.prune_leases()
 
+
+def _get_agent():
+    """Lazy init del agente."""
+    global _agent, _memory
+    if _agent is not None:
+        return _agent
+    with _init_lock:
+        if _agent is not None:
+            return _agent
+        from langchain_core.utils.function_calling import convert_to_openai_tool
+        from langgraph.prebuilt import create_react_agent
+        if _memory is None:
+            _memory = create_checkpointer(on_evict=_drop_sessions)
+        llm = get_chat_model()
+        prompt = get_system_prompt()  # Prompt dinámico con fecha actual
+        # System prompt y schemas de tools van en cada llamada: se descuentan del presupuesto
+        tool_schemas = json.dumps([convert_to_openai_tool(t) for t in TOOLS], ensure_ascii=False)
         _agent = create_react_agent(
-            model=llm,
+            model=GatedChatModel(inner=llm),  # limita las llamadas al modelo en vuelo
             tools=TOOLS,
-            prompt=get_system_prompt(),  # Prompt dinámico con fecha actual
+            prompt=prompt,
             checkpointer=_memory,
+            # últimos N turnos + resumen de los anteriores, ajustado al presupuesto de tokens del modelo
+            pre_model_hook=make_pre_model_hook(prompt + tool_schemas, _model_name(llm)),
         )
     return _agent
 
 
+def warm_up() -> None:
+    """Construye el agente y los schemas de las tools antes del primer request."""
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+    for tool in TOOLS:
+        convert_to_openai_tool(tool)
+    _get_agent()
+
+
+def _run_config(session_id: str) -> dict:
+    """Config de una invocación: thread de la sesión, límite de tools en paralelo y callbacks de métricas."""
+    model_name = _model_name(get_chat_model())
+    fanout = tool_fanout_config()
+    return {
+        **fanout,
+        "configurable": {"thread_id": session_id, **fanout["configurable"]},
+        "callbacks": [MetricsCallbackHandler(model_name, session_id, current_timings())],
+    }
+
+
+def _content_text(content) -> str:
+    """Texto de un content de mensaje: puede ser string o lista de partes."""
+    if isinstance(content, str):
+        return content
+    # Extraer solo las partes de texto
+    text_parts = []
+    for part in content or []:
+        if isinstance(part, str):
+            text_parts.append(part)
+        elif isinstance(part, dict) and part.get("type") == "text":
+            text_parts.append(part.get("text", ""))
+    return " ".join(text_parts)
+
+
+def _thread_config(session_id: str) -> dict:
+    return {"configurable": {"thread_id": session_id, "checkpoint_ns": ""}}
+
+
+def _saved_state(session_id: str):
+    """Último checkpoint de la sesión (None si no tiene historial)."""
+    return _memory.get_tuple(_thread_config(session_id))
+
+
+async def _asaved_state(session_id: str):
+    return await _memory.aget_tuple(_thread_config(session_id))
+
+
 def _extract_response(result: dict) -> str:
     """Extrae el texto de respuesta del resultado del agente."""
     messages = result.get("messages", [])
     # Buscar el último mensaje AI que tenga contenido de texto
     for msg in reversed(messages):
         if isinstance(msg, AIMessage) and msg.content:
-            content = msg.content
-            # msg.content puede ser string o lista de partes
-            if isinstance(content, list):
-                # Extraer solo las partes de texto
-                text_parts = []
-                for part in content:
-                    if isinstance(part, str):
-                        text_parts.append(part)
-                    elif isinstance(part, dict) and part.get("type") == "text":
-                        text_parts.append(part.get("text", ""))
-                content = " ".join(text_parts)
-            
-            if isinstance(content, str) and content.strip():
+            content = _content_text(msg.content)
+            if content.strip():
                 return content.strip()
     return "[Sin contenido del modelo]"
 
 
-def _build_message_with_context(user_input: str) -> str:
-    """Construye el mensaje del usuario, incluyendo contexto del PDF si está cargado."""
-    # Si hay un PDF cargado, incluir su contenido en el contexto
-    if pdf_storage.get("content"):
-        pdf_data = pdf_storage["content"]
-        pdf_text = pdf_data.get("text", "")[:12000]  # Limitar a 12k caracteres
-        filename = pdf_data.get("filename", "documento.pdf")
-        pages = pdf_data.get("pages", 0)
-        
-        return f"""[CONTEXTO: El usuario tiene cargado el PDF "{filename}" ({pages} páginas). Contenido del documento:]
+# ---------- Documentos adjuntos por sesión ----------
+# doc_ids ya anunciados a cada sesión (en el estado compartido): el bloque de contexto
+# se envía una sola vez aunque el siguiente turno lo atienda otro worker
+ANNOUNCED_NAMESPACE = "announced_docs"
+# Métrica: caracteres de prompt ahorrados frente a reinyectar el PDF en cada turno
+_context_stats = {"turns": 0, "chars_saved_total": 0, "chars_saved_last": 0}
 
-{pdf_text}
+LEGACY_CONTEXT_CHARS = 12000  # lo que antes se reinyectaba en cada turno
 
-[FIN DEL DOCUMENTO]
 
-Pregunta del usuario: {user_input}"""
-    
-    return user_input
+def _legacy_context_chars(doc: dict) -> int:
+    """Caracteres que el modelo anterior agregaba al mensaje en cada turno."""
+    text_chars = min(doc.get("text_bytes", 0), LEGACY_CONTEXT_CHARS)
+    return text_chars + len(doc.get("filename", "")) + 150  # encabezado y pie del bloque
+
+
+def _build_message_with_context(session_id: str, user_input: str, new_thread: bool = False) -> str:
+    """
+    Construye el mensaje del usuario. Por cada documento de la sesión que el agente aún
+    no conoce se agrega una única vez un bloque que lo referencia por id; el contenido
+    solo llega al modelo a través de pdf_query.
+    new_thread: la sesión no tiene historial (nueva o desalojada por TTL/LRU); lo anunciado
+    antes ya no está en la conversación y se vuelve a anunciar.
+    """
+    docs = doc_store.list(session_id)
+    if new_thread:
+        state_store.delete(ANNOUNCED_NAMESPACE, session_id)
+    announced = set() if new_thread else set(state_store.get(ANNOUNCED_NAMESPACE, session_id) or [])
+    blocks = []
+    for doc in docs:
+        if doc["doc_id"] not in announced:
+            announced.add(doc["doc_id"])
+            blocks.append(
+                f'[DOCUMENTO ADJUNTO id={doc["doc_id"]}: "{doc["filename"]}" ({doc["pages"]} páginas). '
+                f"Su contenido no está en la conversación; consúltalo con pdf_query.]"
+            )
+    message = user_input
+    if blocks:
+        state_store.put(ANNOUNCED_NAMESPACE, session_id, sorted(announced))
+        message = "\n".join(blocks) + f"\n\nPregunta del usuario: {user_input}"
+    saved = (_legacy_context_chars(docs[-1]) - (len(message) - len(user_input))) if docs else 0
+
+    _context_stats["turns"] += 1
+    _context_stats["chars_saved_last"] = saved
+    _context_stats["chars_saved_total"] += saved
+    return message
+
+
+def get_context_stats() -> dict:
+    """Métrica de caracteres de prompt ahorrados por turno."""
+    turns = _context_stats["turns"]
+    return {
+        **_context_stats,
+        "chars_saved_per_turn": (_context_stats["chars_saved_total"] / turns) if turns else 0.0,
+        "token_budget": budget_stats(),
+    }
+
+
+# ---------- Caché de respuestas (opt-in) ----------
+# Una pregunta repetida sobre los mismos documentos se responde sin pasar por el modelo.
+# Solo se guardan turnos cuyas tools solo leen documentos: un turno que envió un correo
+# o creó un evento nunca se reproduce, ni uno que leyó el calendario (cambia con el tiempo).
+# La caché es por proceso.
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "0") == "1"
+RESPONSE_CACHE_MAX = int(os.getenv("RESPONSE_CACHE_MAX", "1024"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+# Turnos anteriores de la sesión (pregunta y respuesta, del checkpoint) que forman parte de
+# la clave; con 0 solo se cachea el primer turno de una sesión
+RESPONSE_CACHE_HISTORY_TURNS = int(os.getenv("RESPONSE_CACHE_HISTORY_TURNS", "2"))
+READ_ONLY_TOOLS = {"pdf_query", "pdf_summarize"}
+
+_response_cache = TTLCache("agent_response", RESPONSE_CACHE_MAX, RESPONSE_CACHE_TTL_SECONDS)
+
+
+def _history_turns(saved) -> List[List[str]]:
+    """Turnos del checkpoint: por cada uno, la entrada del usuario y los textos de respuesta."""
+    messages = saved.checkpoint["channel_values"].get("messages", []) if saved else []
+    turns: List[List[str]] = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage) and msg.id != SUMMARY_ID:
+            turns.append([normalize_text(_content_text(msg.content))])
+        elif isinstance(msg, AIMessage) and turns:
+            text = _content_text(msg.content).strip()
+            if text:
+                turns[-1].append(normalize_text(text))
+    return turns
+
+
+def _response_key(session_id: str, user_input: str, saved) -> Optional[str]:
+    """
+    Clave de la respuesta: entrada normalizada + documentos de la sesión (doc_id es el hash
+    del contenido) + los últimos turnos completos de la conversación (saved: checkpoint de
+    la sesión). None si el turno no es cacheable.
+    """
+    if not RESPONSE_CACHE:
+        return None
+    docs = doc_store.list(session_id)
+    if not docs:
+        return None  # sin documentos no hay nada de solo lectura que consultar
+    turns = _history_turns(saved)
+    if turns and RESPONSE_CACHE_HISTORY_TURNS <= 0:
+        return None  # la respuesta puede depender de la conversación anterior
+    history = [part for turn in turns[-RESPONSE_CACHE_HISTORY_TURNS:] for part in (*turn, "\x1f")]
+    return cache_key(normalize_text(user_input), *sorted(d["doc_id"] for d in docs), "\x1e", *history)
+
+
+def _turn_tools(messages: List) -> List[str]:
+    """Tools que llamó el modelo en el último turno."""
+    names = []
+    for msg in reversed(messages):
+        if isinstance(msg, HumanMessage) and msg.id != SUMMARY_ID:
+            break
+        names += [call["name"] for call in getattr(msg, "tool_calls", None) or []]
+    return names
+
+
+def _store_response(key: Optional[str], tools: List[str], answer: str) -> None:
+    if key is not None and tools and set(tools) <= READ_ONLY_TOOLS:
+        _response_cache.put(key, answer)
+
+
+def _replay_messages(message_content: str, answer: str) -> Dict:
+    """Turno servido desde la caché: se agrega al historial como si lo hubiera respondido el modelo."""
+    return {"messages": [HumanMessage(content=message_content), AIMessage(content=answer)]}
+
+
+def get_cache_stats() -> dict:
+    """Aciertos de la caché de respuestas y de la memoización de pdf_query."""
+    return {
+        "response_cache_enabled": RESPONSE_CACHE,
+        "response": _response_cache.stats(),
+        "pdf_query": pdf_query_cache_stats(),
+    }
 
 
 def answer_sync(session_id: str, user_input: str) -> str:
@@ -141,12 +356,21 @@ def answer_sync(session_id: str, user_input: str) -> str:
     El agente puede usar tools automáticamente.
     """
     agent = _get_agent()
-    message_content = _build_message_with_context(user_input)
+    saved = _saved_state(session_id)
+    key = _response_key(session_id, user_input, saved)
+    message_content = _build_message_with_context(session_id, user_input, new_thread=saved is None)
+    config = _run_config(session_id)
+    cached = _response_cache.get(key) if key else None
+    if cached is not None:
+        agent.update_state(config, _replay_messages(message_content, cached), as_node="agent")
+        return cached
     result = agent.invoke(
         {"messages": [HumanMessage(content=message_content)]},
-        config={"configurable": {"thread_id": session_id}},
+        config=config,
     )
-    return _extract_response(result)
+    answer = _extract_response(result)
+    _store_response(key, _turn_tools(result["messages"]), answer)
+    return answer
 
 
 async def answer_async(session_id: str, user_input: str) -> str:
@@ -154,9 +378,63 @@ async def answer_async(session_id: str, user_input: str) -> str:
     Invocación asíncrona con memoria por sesión.
     """
     agent = _get_agent()
-    message_content = _build_message_with_context(user_input)
+    saved = await _asaved_state(session_id)
+    key = _response_key(session_id, user_input, saved)
+    message_content = _build_message_with_context(session_id, user_input, new_thread=saved is None)
+    config = _run_config(session_id)
+    cached = _response_cache.get(key) if key else None
+    if cached is not None:
+        await agent.aupdate_state(config, _replay_messages(message_content, cached), as_node="agent")
+        return cached
     result = await agent.ainvoke(
         {"messages": [HumanMessage(content=message_content)]},
-        config={"configurable": {"thread_id": session_id}},
+        config=config,
     )
-    return _extract_response(result)
\ No newline at end of file
+    answer = _extract_response(result)
+    _store_response(key, _turn_tools(result["messages"]), answer)
+    return answer
+
+
+async def answer_stream(session_id: str, user_input: str) -> AsyncIterator[Dict]:
+    """
+    Invocación en streaming con memoria por sesión.
+    Emite eventos {"event": ..., "data": {...}} conforme ocurren:
+    token (texto del modelo), tool_start, tool_end y, al final, final con la respuesta completa.
+    """
+    agent = _get_agent()
+    saved = await _asaved_state(session_id)
+    key = _response_key(session_id, user_input, saved)
+    message_content = _build_message_with_context(session_id, user_input, new_thread=saved is None)
+    config = _run_config(session_id)
+    cached = _response_cache.get(key) if key else None
+    if cached is not None:
+        await agent.aupdate_state(config, _replay_messages(message_content, cached), as_node="agent")
+        yield {"event": "token", "data": {"text": cached}}
+        yield {"event": "final", "data": {"output": cached}}
+        return
+
+    tools = []
+    async for ev in agent.astream_events(
+        {"messages": [HumanMessage(content=message_content)]},
+        config=config,
+        version="v2",
+    ):
+        kind = ev["event"]
+        if kind == "on_chat_model_stream":
+            text = _content_text(ev["data"]["chunk"].content)
+            if text:
+                yield {"event": "token", "data": {"text": text}}
+        elif kind == "on_tool_start":
+            tools.append(ev["name"])
+            yield {"event": "tool_start", "data": {"name": ev["name"], "input": ev["data"].get("input")}}
+        elif kind == "on_tool_end":
+            output = ev["data"].get("output")
+            yield {
+                "event": "tool_end",
+                "data": {"name": ev["name"], "output": _content_text(getattr(output, "content", output))},
+            }
+
+    state = await agent.aget_state(config)
+    answer = _extract_response(state.values)
+    _store_response(key, tools, answer)
+    yield {"event": "final", "data": {"output": answer}}
\ No newline at end of file
@@ -1,15 +1,32 @@
 # app/agent_tools.py
 """
 Tools que Gemini puede invocar automáticamente.
-Usan httpx para llamar a los endpoints de google_actions.
+Llaman a la capa de servicio de google_actions en proceso, o a sus endpoints
+con httpx si TOOLS_DISPATCH=http.
 """
+import asyncio
+import inspect
 import os
 import httpx
 from pydantic import BaseModel, Field, EmailStr
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import StructuredTool
-from typing import Optional, List
+from typing import Callable, Dict, Optional, List
 
-# URL base del backend (se llama a sí mismo)
+from .google_actions import (
+    CalendarEvent, CalendarEventsBatch, CalendarRange, CredentialsError, FreeSlotsQuery, GmailBatch, GmailMessage,
+    create_calendar_event, create_calendar_events_batch, find_free_slots, list_calendar_events, send_gmail,
+    send_gmail_batch,
+)
+from .google_oauth import get_credentials
+
+from .context_budget import PDF_CONTEXT_TOKENS, chunk_tokens, trim_text
+from .doc_store import doc_store
+from .pdf_summarize import summarize_document, summarize_document_sync
+from .response_cache import TTLCache, cache_key, normalize_text
+from .pdf_index import TOP_K as PDF_TOP_K, search, head_chunks, format_chunks
+
+# URL base del backend (se llama a sí mismo en modo http)
 API_BASE = os.getenv("API_BASE", "http://localhost:8000")
 
 
@@ -21,6 +38,12 @@ class GmailSendArgs(BaseModel):
     from_email: Optional[str] = Field(None, description="Alias remitente (opcional)")
 
 
+class GmailSendWithAttachmentsArgs(GmailSendArgs):
+    attach_doc_ids: Optional[List[str]] = Field(
+        None, description="Ids de PDFs subidos en la sesión para adjuntar (los de [DOCUMENTO ADJUNTO id=...], opcional)"
+    )
+
+
 class CalendarEventArgs(BaseModel):
     summary: str = Field(..., description="Título del evento")
     start_datetime: str = Field(..., description="Inicio en formato RFC3339, ej: 2025-12-10T10:00:00-07:00")
@@ -31,41 +54,194 @@ class CalendarEventArgs(BaseModel):
     attendees: Optional[List[str]] = Field(None, description="Lista de correos de asistentes (opcional)")
 
 
+class CalendarRangeArgs(BaseModel):
+    time_min: str = Field(..., description="Inicio del rango en RFC3339, ej: 2025-12-11T00:00:00-07:00")
+    time_max: str = Field(..., description="Fin del rango en RFC3339, ej: 2025-12-12T00:00:00-07:00")
+
+
+class FreeSlotsArgs(CalendarRangeArgs):
+    duration_minutes: int = Field(30, description="Duración mínima del hueco en minutos")
+    workday_start: Optional[str] = Field(None, description="Inicio del horario laboral HH:MM (opcional, por defecto 09:00)")
+    workday_end: Optional[str] = Field(None, description="Fin del horario laboral HH:MM (opcional, por defecto 18:00)")
+
+
+class GmailSendBatchArgs(BaseModel):
+    messages: List[GmailSendArgs] = Field(..., description="Lista de correos a enviar, uno por destinatario")
+
+
+class CalendarEventsBatchArgs(BaseModel):
+    events: List[CalendarEventArgs] = Field(..., description="Lista de eventos a crear")
+
+
+# ---------- Despacho ----------
+# "direct": las tools llaman a la capa de servicio de google_actions en proceso.
+# "http": pasan por los endpoints de la API con un cliente compartido (pool de conexiones).
+TOOLS_DISPATCH = os.getenv("TOOLS_DISPATCH", "direct")
+
+# Tools de un mismo paso que se ejecutan a la vez (el agente las lanza en paralelo)
+TOOL_FANOUT_LIMIT = int(os.getenv("TOOL_FANOUT_LIMIT", "4"))
+
+NO_CREDS_MSG = "❌ Error: No hay credenciales de Google. El usuario debe conectarse primero en /auth/google"
+
+_HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+_http_client: Optional[httpx.Client] = None
+_async_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.Client:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(base_url=API_BASE, timeout=30, limits=_HTTP_LIMITS)
+    return _http_client
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(base_url=API_BASE, timeout=30, limits=_HTTP_LIMITS)
+    return _async_client
+
+
+async def aclose_http_clients() -> None:
+    """Cierra los clientes compartidos (shutdown de la app)."""
+    global _http_client, _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+
+
+def _http_result(res: httpx.Response, what: str, ok: Callable[[dict], str]) -> str:
+    if res.status_code == 401:
+        return NO_CREDS_MSG
+    if res.status_code >= 400:
+        return f"❌ Error al {what}: {res.text}"
+    return ok(res.json())
+
+
+def _direct(service_fn, model_cls, payload: dict, what: str, ok: Callable[[dict], str]) -> str:
+    try:
+        data = service_fn(get_credentials(), model_cls(**payload))
+    except CredentialsError:
+        return NO_CREDS_MSG
+    except Exception as e:
+        return f"❌ Error al {what}: {str(e)}"
+    return ok(data)
+
+
+def _dispatch(path: str, service_fn, model_cls, payload: dict, what: str, ok: Callable[[dict], str]) -> str:
+    if TOOLS_DISPATCH == "direct":
+        return _direct(service_fn, model_cls, payload, what, ok)
+    try:
+        res = _get_http_client().post(path, json=payload)
+    except Exception as e:
+        return f"❌ Error de conexión: {str(e)}"
+    return _http_result(res, what, ok)
+
+
+async def _adispatch(path: str, service_fn, model_cls, payload: dict, what: str, ok: Callable[[dict], str]) -> str:
+    if TOOLS_DISPATCH == "direct":
+        # El cliente de Google es síncrono: se ejecuta en un hilo para no bloquear el event loop
+        return await asyncio.to_thread(_direct, service_fn, model_cls, payload, what, ok)
+    try:
+        res = await _get_async_client().post(path, json=payload)
+    except Exception as e:
+        return f"❌ Error de conexión: {str(e)}"
+    return _http_result(res, what, ok)
+
+
+def tool_fanout_config() -> dict:
+    """
+    Claves de config de un turno que acotan las tools simultáneas de un mismo paso:
+    max_concurrency para el camino síncrono (pool de hilos del ToolNode) y un semáforo
+    propio del turno para el asíncrono (el ToolNode las lanza todas con gather).
+    """
+    return {
+        "max_concurrency": TOOL_FANOUT_LIMIT,
+        "configurable": {"tool_fanout": asyncio.Semaphore(TOOL_FANOUT_LIMIT)},
+    }
+
+
+def _fanout_limited(coro_fn):
+    """Implementación async de una tool que respeta el semáforo de fan-out del turno."""
+    wants_config = "config" in inspect.signature(coro_fn).parameters
+
+    async def run(*args, config: RunnableConfig = None, **kwargs):
+        if wants_config:
+            kwargs["config"] = config
+        sem = ((config or {}).get("configurable") or {}).get("tool_fanout")
+        if sem is None:
+            return await coro_fn(*args, **kwargs)
+        async with sem:
+            return await coro_fn(*args, **kwargs)
+
+    # Sin functools.wraps: la firma debe exponer `config` para que LangChain la inyecte
+    run.__name__, run.__doc__ = coro_fn.__name__, coro_fn.__doc__
+    return run
+
+
 # ---------- Implementaciones ----------
-def gmail_send_impl(
+def _gmail_payload(
     to: str,
     subject: str,
     body: str,
-    from_email: Optional[str] = None
-) -> str:
-    """Envía un correo via el endpoint /gmail/send"""
+    from_email: Optional[str],
+    attach_doc_ids: Optional[List[str]] = None,
+    session_id: Optional[str] = None,
+) -> dict:
     payload = {"to": to, "subject": subject, "body": body}
     if from_email:
         payload["from_email"] = from_email
-    
-    try:
-        with httpx.Client(timeout=30) as client:
-            res = client.post(f"{API_BASE}/gmail/send", json=payload)
-            if res.status_code == 401:
-                return "❌ Error: No hay credenciales de Google. El usuario debe conectarse primero en /auth/google"
-            if res.status_code >= 400:
-                return f"❌ Error al enviar correo: {res.text}"
-            data = res.json()
-            return f"✅ Correo enviado exitosamente a {to}. ID: {data.get('messageId', 'N/A')}"
-    except Exception as e:
-        return f"❌ Error de conexión: {str(e)}"
+    if attach_doc_ids:
+        payload["attach_doc_ids"] = attach_doc_ids
+        payload["session_id"] = session_id
+    return payload
 
 
-def calendar_event_impl(
+def _gmail_ok(to: str) -> Callable[[dict], str]:
+    def ok(data: dict) -> str:
+        attached = data.get("attachments")
+        suffix = f". Adjuntos: {', '.join(attached)}" if attached else ""
+        return f"✅ Correo enviado exitosamente a {to}. ID: {data.get('messageId', 'N/A')}{suffix}"
+    return ok
+
+
+def gmail_send_impl(
+    to: str,
+    subject: str,
+    body: str,
+    from_email: Optional[str] = None,
+    attach_doc_ids: Optional[List[str]] = None,
+    config: RunnableConfig = None
+) -> str:
+    """Envía un correo (en proceso o via el endpoint /gmail/send)"""
+    payload = _gmail_payload(to, subject, body, from_email, attach_doc_ids, session_id_from_config(config))
+    return _dispatch("/gmail/send", send_gmail, GmailMessage, payload, "enviar correo", _gmail_ok(to))
+
+
+async def gmail_send_aimpl(
+    to: str,
+    subject: str,
+    body: str,
+    from_email: Optional[str] = None,
+    attach_doc_ids: Optional[List[str]] = None,
+    config: RunnableConfig = None
+) -> str:
+    payload = _gmail_payload(to, subject, body, from_email, attach_doc_ids, session_id_from_config(config))
+    return await _adispatch("/gmail/send", send_gmail, GmailMessage, payload, "enviar correo", _gmail_ok(to))
+
+
+def _calendar_payload(
     summary: str,
     start_datetime: str,
     end_datetime: str,
-    description: Optional[str] = None,
-    location: Optional[str] = None,
-    timezone: Optional[str] = "America/Mazatlan",
-    attendees: Optional[List[str]] = None
-) -> str:
-    """Crea un evento via el endpoint /calendar/event"""
+    description: Optional[str],
+    location: Optional[str],
+    timezone: Optional[str],
+    attendees: Optional[List[str]],
+) -> dict:
     payload = {
         "summary": summary,
         "start_datetime": start_datetime,
@@ -78,19 +254,185 @@ def calendar_event_impl(
         payload["location"] = location
     if attendees:
         payload["attendees"] = attendees
-    
-    try:
-        with httpx.Client(timeout=30) as client:
-            res = client.post(f"{API_BASE}/calendar/event", json=payload)
-            if res.status_code == 401:
-                return "❌ Error: No hay credenciales de Google. El usuario debe conectarse primero en /auth/google"
-            if res.status_code >= 400:
-                return f"❌ Error al crear evento: {res.text}"
-            data = res.json()
-            link = data.get("htmlLink", "")
-            return f"✅ Evento '{summary}' creado exitosamente. Link: {link}"
-    except Exception as e:
-        return f"❌ Error de conexión: {str(e)}"
+    return payload
+
+
+def _calendar_ok(summary: str) -> Callable[[dict], str]:
+    return lambda data: f"✅ Evento '{summary}' creado exitosamente. Link: {data.get('htmlLink', '')}"
+
+
+def calendar_event_impl(
+    summary: str,
+    start_datetime: str,
+    end_datetime: str,
+    description: Optional[str] = None,
+    location: Optional[str] = None,
+    timezone: Optional[str] = "America/Mazatlan",
+    attendees: Optional[List[str]] = None
+) -> str:
+    """Crea un evento (en proceso o via el endpoint /calendar/event)"""
+    payload = _calendar_payload(summary, start_datetime, end_datetime, description, location, timezone, attendees)
+    return _dispatch(
+        "/calendar/event", create_calendar_event, CalendarEvent, payload, "crear evento", _calendar_ok(summary)
+    )
+
+
+async def calendar_event_aimpl(
+    summary: str,
+    start_datetime: str,
+    end_datetime: str,
+    description: Optional[str] = None,
+    location: Optional[str] = None,
+    timezone: Optional[str] = "America/Mazatlan",
+    attendees: Optional[List[str]] = None
+) -> str:
+    payload = _calendar_payload(summary, start_datetime, end_datetime, description, location, timezone, attendees)
+    return await _adispatch(
+        "/calendar/event", create_calendar_event, CalendarEvent, payload, "crear evento", _calendar_ok(summary)
+    )
+
+
+def _free_slots_payload(
+    time_min: str,
+    time_max: str,
+    duration_minutes: int,
+    workday_start: Optional[str],
+    workday_end: Optional[str],
+) -> dict:
+    payload = {"time_min": time_min, "time_max": time_max, "duration_minutes": duration_minutes}
+    if workday_start:
+        payload["workday_start"] = workday_start
+    if workday_end:
+        payload["workday_end"] = workday_end
+    return payload
+
+
+def _events_ok(data: dict) -> str:
+    events = data.get("events", [])
+    if not events:
+        return "📅 No hay eventos en ese rango."
+    lines = [f"📅 {len(events)} evento(s):"]
+    for ev in events:
+        when = f"{ev['start'][:10]} (todo el día)" if ev.get("all_day") else f"{ev['start']} – {ev['end']}"
+        free = "" if ev.get("busy", True) else " [disponible]"
+        lines.append(f"- {when}: {ev['summary']}{free}")
+    return "\n".join(lines)
+
+
+def _slots_ok(duration_minutes: int) -> Callable[[dict], str]:
+    def ok(data: dict) -> str:
+        slots = data.get("slots", [])
+        if not slots:
+            return f"🔴 No hay huecos libres de {duration_minutes} min en ese rango."
+        lines = [f"🟢 Huecos libres de al menos {duration_minutes} min:"]
+        lines += [f"- {s['start']} – {s['end']} ({s['minutes']} min)" for s in slots]
+        return "\n".join(lines)
+    return ok
+
+
+def calendar_list_events_impl(time_min: str, time_max: str) -> str:
+    """Eventos de un rango (en proceso o via /calendar/events/list)"""
+    payload = {"time_min": time_min, "time_max": time_max}
+    return _dispatch("/calendar/events/list", list_calendar_events, CalendarRange, payload, "consultar eventos", _events_ok)
+
+
+async def calendar_list_events_aimpl(time_min: str, time_max: str) -> str:
+    payload = {"time_min": time_min, "time_max": time_max}
+    return await _adispatch(
+        "/calendar/events/list", list_calendar_events, CalendarRange, payload, "consultar eventos", _events_ok
+    )
+
+
+def calendar_free_slots_impl(
+    time_min: str,
+    time_max: str,
+    duration_minutes: int = 30,
+    workday_start: Optional[str] = None,
+    workday_end: Optional[str] = None
+) -> str:
+    """Huecos libres de un rango (en proceso o via /calendar/free_slots)"""
+    payload = _free_slots_payload(time_min, time_max, duration_minutes, workday_start, workday_end)
+    return _dispatch(
+        "/calendar/free_slots", find_free_slots, FreeSlotsQuery, payload, "buscar huecos", _slots_ok(duration_minutes)
+    )
+
+
+async def calendar_free_slots_aimpl(
+    time_min: str,
+    time_max: str,
+    duration_minutes: int = 30,
+    workday_start: Optional[str] = None,
+    workday_end: Optional[str] = None
+) -> str:
+    payload = _free_slots_payload(time_min, time_max, duration_minutes, workday_start, workday_end)
+    return await _adispatch(
+        "/calendar/free_slots", find_free_slots, FreeSlotsQuery, payload, "buscar huecos", _slots_ok(duration_minutes)
+    )
+
+
+def _as_dict(item) -> dict:
+    """Los elementos de una lista pueden llegar como dict o como modelo ya validado."""
+    return item.model_dump() if isinstance(item, BaseModel) else dict(item)
+
+
+def _batch_ok(what: str, label: str) -> Callable[[dict], str]:
+    def ok(data: dict) -> str:
+        results = data.get("results", [])
+        done = [r for r in results if r.get("ok")]
+        lines = [f"✅ {len(done)}/{len(results)} {what} correctamente."]
+        for r in results:
+            if not r.get("ok"):
+                lines.append(f"❌ #{r['index'] + 1} ({r.get(label, '')}): {r.get('error')}")
+        return "\n".join(lines)
+    return ok
+
+
+def _gmail_batch_payload(messages: List) -> dict:
+    items = [_as_dict(m) for m in messages]
+    return {"messages": [
+        _gmail_payload(m["to"], m["subject"], m["body"], m.get("from_email")) for m in items
+    ]}
+
+
+def _calendar_batch_payload(events: List) -> dict:
+    items = [_as_dict(e) for e in events]
+    return {"events": [
+        _calendar_payload(
+            e["summary"], e["start_datetime"], e["end_datetime"], e.get("description"),
+            e.get("location"), e.get("timezone"), e.get("attendees"),
+        )
+        for e in items
+    ]}
+
+
+def gmail_send_batch_impl(messages: List) -> str:
+    """Envía varios correos en un solo lote (en proceso o via /gmail/send_batch)"""
+    return _dispatch(
+        "/gmail/send_batch", send_gmail_batch, GmailBatch, _gmail_batch_payload(messages),
+        "enviar correos", _batch_ok("correos enviados", "to"),
+    )
+
+
+async def gmail_send_batch_aimpl(messages: List) -> str:
+    return await _adispatch(
+        "/gmail/send_batch", send_gmail_batch, GmailBatch, _gmail_batch_payload(messages),
+        "enviar correos", _batch_ok("correos enviados", "to"),
+    )
+
+
+def calendar_events_batch_impl(events: List) -> str:
+    """Crea varios eventos en un solo lote (en proceso o via /calendar/events_batch)"""
+    return _dispatch(
+        "/calendar/events_batch", create_calendar_events_batch, CalendarEventsBatch, _calendar_batch_payload(events),
+        "crear eventos", _batch_ok("eventos creados", "summary"),
+    )
+
+
+async def calendar_events_batch_aimpl(events: List) -> str:
+    return await _adispatch(
+        "/calendar/events_batch", create_calendar_events_batch, CalendarEventsBatch, _calendar_batch_payload(events),
+        "crear eventos", _batch_ok("eventos creados", "summary"),
+    )
 
 
 # ---------- Tools para LangChain ----------
@@ -100,10 +442,11 @@ gmail_send_tool = StructuredTool.from_function(
         "Envía un correo electrónico usando Gmail. "
         "Usa esta herramienta cuando el usuario pida enviar un email/correo. "
         "Requiere: to (email destino), subject (asunto), body (contenido). "
-        "Opcional: from_email (remitente alias)."
+        "Opcional: from_email (remitente alias), attach_doc_ids (ids de PDFs subidos en la sesión para adjuntarlos)."
     ),
     func=gmail_send_impl,
-    args_schema=GmailSendArgs,
+    coroutine=_fanout_limited(gmail_send_aimpl),
+    args_schema=GmailSendWithAttachmentsArgs,
 )
 
 calendar_create_tool = StructuredTool.from_function(
@@ -115,36 +458,146 @@ calendar_create_tool = StructuredTool.from_function(
         "Opcional: description, location, timezone, attendees (lista de emails)."
     ),
     func=calendar_event_impl,
+    coroutine=_fanout_limited(calendar_event_aimpl),
     args_schema=CalendarEventArgs,
 )
 
-# ---------- PDF Storage (compartido con main.py) ----------
-# Este diccionario se actualiza desde main.py cuando se sube un PDF
-pdf_storage = {
-    "content": None  # {"filename": str, "text": str, "pages": int}
-}
+gmail_send_batch_tool = StructuredTool.from_function(
+    name="gmail_send_batch",
+    description=(
+        "Envía varios correos en una sola llamada. "
+        "Usa esta herramienta en lugar de llamar gmail_send varias veces cuando haya que enviar "
+        "2 o más correos (p. ej. invitar a varias personas de forma individual). "
+        "Requiere: messages (lista de {to, subject, body, from_email opcional}). "
+        "Devuelve el resultado de cada correo."
+    ),
+    func=gmail_send_batch_impl,
+    coroutine=_fanout_limited(gmail_send_batch_aimpl),
+    args_schema=GmailSendBatchArgs,
+)
+
+calendar_events_batch_tool = StructuredTool.from_function(
+    name="calendar_create_events_batch",
+    description=(
+        "Crea varios eventos en Google Calendar en una sola llamada. "
+        "Usa esta herramienta en lugar de llamar calendar_create_event varias veces cuando haya que "
+        "crear 2 o más eventos (p. ej. una agenda o calendario de sprint completo). "
+        "Requiere: events (lista de {summary, start_datetime, end_datetime, ...} con el mismo formato que calendar_create_event). "
+        "Devuelve el resultado de cada evento."
+    ),
+    func=calendar_events_batch_impl,
+    coroutine=_fanout_limited(calendar_events_batch_aimpl),
+    args_schema=CalendarEventsBatchArgs,
+)
 
+calendar_list_events_tool = StructuredTool.from_function(
+    name="calendar_list_events",
+    description=(
+        "Lista los eventos de Google Calendar que caen en un rango de fechas. "
+        "Usa esta herramienta cuando el usuario pregunte qué tiene agendado, o antes de crear un evento "
+        "para revisar si choca con otro. "
+        "Requiere: time_min y time_max (formato RFC3339 como 2025-12-10T00:00:00-07:00)."
+    ),
+    func=calendar_list_events_impl,
+    coroutine=_fanout_limited(calendar_list_events_aimpl),
+    args_schema=CalendarRangeArgs,
+)
+
+calendar_free_slots_tool = StructuredTool.from_function(
+    name="calendar_find_free_slots",
+    description=(
+        "Busca huecos libres en Google Calendar dentro de un rango, en horario laboral. "
+        "Usa esta herramienta cuando el usuario pregunte si está libre o cuándo puede agendar algo. "
+        "Requiere: time_min y time_max (RFC3339). "
+        "Opcional: duration_minutes (por defecto 30), workday_start y workday_end (HH:MM)."
+    ),
+    func=calendar_free_slots_impl,
+    coroutine=_fanout_limited(calendar_free_slots_aimpl),
+    args_schema=FreeSlotsArgs,
+)
 
 # ---------- PDF Query Tool ----------
 class PdfQueryArgs(BaseModel):
     question: str = Field(..., description="Pregunta sobre el contenido del PDF")
+    doc_id: Optional[str] = Field(None, description="Id del documento a consultar (opcional; por defecto todos los de la sesión)")
+
+
+PDF_QUERY_CACHE_MAX = int(os.getenv("PDF_QUERY_CACHE_MAX", "512"))  # 0 desactiva la memoización
+_pdf_query_cache = TTLCache("pdf_query", PDF_QUERY_CACHE_MAX, ttl_seconds=3600)
+
+NO_PDF_MSG = "❌ No hay ningún PDF cargado. El usuario debe subir un PDF primero usando el botón '📄 Subir PDF'."
+PDF_GONE_MSG = "❌ El PDF ya no está disponible en el servidor. El usuario debe volver a subirlo."
+
 
+def session_id_from_config(config: Optional[RunnableConfig]) -> str:
+    """El thread_id del agente es el session_id del usuario."""
+    return ((config or {}).get("configurable") or {}).get("thread_id", "")
 
-def pdf_query_impl(question: str) -> str:
-    """Consulta el contenido del PDF cargado."""
-    if not pdf_storage["content"]:
-        return "❌ No hay ningún PDF cargado. El usuario debe subir un PDF primero usando el botón '📄 Subir PDF'."
-    
-    data = pdf_storage["content"]
-    filename = data.get("filename", "documento")
-    text = data.get("text", "")
-    pages = data.get("pages", 0)
-    
-    if not text.strip():
-        return f"❌ El PDF '{filename}' no tiene texto extraíble (puede ser un PDF escaneado o con imágenes)."
-    
-    # Retornar el contenido para que Gemini lo analice
-    return f"📄 Contenido del PDF '{filename}' ({pages} páginas):\n\n{text[:15000]}"  # Limitar a 15k chars
+
+def pdf_query_cache_stats() -> Dict:
+    return _pdf_query_cache.stats()
+
+
+def pdf_query_impl(question: str, doc_id: Optional[str] = None, config: RunnableConfig = None) -> str:
+    """Consulta los PDFs cargados en la sesión."""
+    docs = doc_store.list(session_id_from_config(config))
+    if doc_id:
+        docs = [d for d in docs if d["doc_id"] == doc_id]
+    if not docs:
+        return NO_PDF_MSG
+
+    # Los documentos son inmutables (id = hash del contenido): mismo texto, mismos fragmentos
+    key = cache_key(normalize_text(question), *(d["doc_id"] for d in docs))
+    cached = _pdf_query_cache.get(key)
+    if cached is not None:
+        return cached
+    result = _pdf_query(question, docs)
+    if not result.startswith("❌"):
+        _pdf_query_cache.put(key, result)
+    return result
+
+
+def _pdf_query(question: str, docs: List[Dict]) -> str:
+    # Solo los fragmentos relevantes (con su página) en lugar del documento completo
+    hits = []
+    try:
+        for doc in docs:
+            hits += [(chunk["score"], doc, chunk) for chunk in search(doc["index_path"], question, PDF_TOP_K * 2)]
+        if not hits:
+            latest = docs[-1]
+            hits = [(0.0, latest, chunk) for chunk in head_chunks(latest["index_path"], PDF_TOP_K * 2)]
+    except FileNotFoundError:
+        return PDF_GONE_MSG
+    if not hits:
+        return f"❌ El PDF '{docs[-1]['filename']}' no tiene texto extraíble (puede ser un PDF escaneado o con imágenes)."
+
+    # Por relevancia, mientras quepan en el presupuesto de tokens (al menos uno, recortado si hace falta)
+    hits.sort(key=lambda h: h[0], reverse=True)
+    by_doc: Dict[str, List[Dict]] = {}
+    used = 0
+    for _, doc, chunk in hits:
+        text = doc_store.chunk_text(doc, chunk)
+        tokens = chunk_tokens(doc, chunk, text)
+        if used + tokens > PDF_CONTEXT_TOKENS:
+            if used:
+                continue  # uno más chico todavía puede caber
+            text, tokens = trim_text(text, PDF_CONTEXT_TOKENS), PDF_CONTEXT_TOKENS
+        by_doc.setdefault(doc["doc_id"], []).append(dict(chunk, text=text))
+        used += tokens
+
+    sections = []
+    for doc in docs:
+        if doc["doc_id"] in by_doc:
+            sections.append(
+                f"📄 Fragmentos relevantes del PDF '{doc['filename']}' (id={doc['doc_id']}, {doc['pages']} páginas):\n\n"
+                f"{format_chunks(by_doc[doc['doc_id']])}"
+            )
+    return "Cita la página al responder.\n\n" + "\n\n".join(sections)
+
+
+async def pdf_query_aimpl(question: str, doc_id: Optional[str] = None, config: RunnableConfig = None) -> str:
+    # Búsqueda y lectura de páginas tocan disco y CPU: fuera del event loop
+    return await asyncio.to_thread(pdf_query_impl, question, doc_id, config)
 
 
 pdf_query_tool = StructuredTool.from_function(
@@ -153,12 +606,74 @@ pdf_query_tool = StructuredTool.from_function(
         "Consulta el contenido del PDF que el usuario ha subido. "
         "Usa esta herramienta cuando el usuario pregunte sobre un PDF, documento, archivo, "
         "o quiera que analices/resumas/busques algo en el documento cargado. "
-        "Requiere: question (la pregunta del usuario sobre el PDF)."
+        "Requiere: question (la pregunta del usuario sobre el PDF). "
+        "Opcional: doc_id (si la sesión tiene varios documentos y la pregunta es sobre uno)."
     ),
     func=pdf_query_impl,
+    coroutine=_fanout_limited(pdf_query_aimpl),
     args_schema=PdfQueryArgs,
 )
 
 
+class PdfSummarizeArgs(BaseModel):
+    doc_id: Optional[str] = Field(None, description="Id del documento a resumir (opcional; por defecto el último subido)")
+
+
+def _summary_message(doc: Dict, result: Dict) -> str:
+    if not result["summary"]:
+        return f"❌ El PDF '{doc['filename']}' no tiene texto extraíble (puede ser un PDF escaneado o con imágenes)."
+    return (
+        f"📄 Resumen del PDF completo '{doc['filename']}' (id={doc['doc_id']}, {doc['pages']} páginas):\n\n"
+        f"{trim_text(result['summary'], PDF_CONTEXT_TOKENS)}"
+    )
+
+
+async def pdf_summarize_aimpl(doc_id: Optional[str] = None, config: RunnableConfig = None) -> str:
+    """Resumen map-reduce del documento completo (ver pdf_summarize)."""
+    doc = doc_store.get(session_id_from_config(config), doc_id)
+    if not doc:
+        return NO_PDF_MSG
+    try:
+        result = await summarize_document(doc)
+    except FileNotFoundError:
+        return PDF_GONE_MSG
+    return _summary_message(doc, result)
+
+
+def pdf_summarize_impl(doc_id: Optional[str] = None, config: RunnableConfig = None) -> str:
+    """Versión síncrona: sin event loop propio, las llamadas usan el límite síncrono de LLM_MAX_CONCURRENCY."""
+    doc = doc_store.get(session_id_from_config(config), doc_id)
+    if not doc:
+        return NO_PDF_MSG
+    try:
+        result = summarize_document_sync(doc)
+    except FileNotFoundError:
+        return PDF_GONE_MSG
+    return _summary_message(doc, result)
+
+
+pdf_summarize_tool = StructuredTool.from_function(
+    name="pdf_summarize",
+    description=(
+        "Resume un PDF completo, por largo que sea (cubre todas sus páginas). "
+        "Usa esta herramienta cuando el usuario pida un resumen general del documento; "
+        "para preguntas concretas usa pdf_query. "
+        "Opcional: doc_id (por defecto el último documento subido)."
+    ),
+    func=pdf_summarize_impl,
+    coroutine=_fanout_limited(pdf_summarize_aimpl),
+    args_schema=PdfSummarizeArgs,
+)
+
+
 # Lista de tools disponibles para el agente
-TOOLS = [gmail_send_tool, calendar_create_tool, pdf_query_tool]
+TOOLS = [
+    gmail_send_tool,
+    gmail_send_batch_tool,
+    calendar_create_tool,
+    calendar_events_batch_tool,
+    calendar_list_events_tool,
+    calendar_free_slots_tool,
+    pdf_query_tool,
+    pdf_summarize_tool,
+]
@@ -0,0 +1,320 @@
+# app/calendar_cache.py
+"""
+Lectura de Google Calendar con caché local por usuario.
+- La primera consulta lista una ventana acotada del calendario (events.list con singleEvents,
+  timeMin/timeMax): desde un día antes de la consulta hasta CALENDAR_HORIZON_DAYS después. Sin
+  cota, una serie recurrente sin fin se expandiría en infinitas instancias.
+- Las siguientes piden solo lo que cambió en la ventana (updatedMin con el "updated" de la
+  respuesta anterior y showDeleted; los sync tokens no se pueden combinar con timeMin/timeMax).
+  Si Google rechaza el updatedMin por viejo (410 Gone) se vuelve a listar la ventana.
+- Una consulta fuera de la ventana vuelve a listar con una ventana que la cubre; una vez al día
+  se lista de nuevo aunque no haga falta, para soltar los eventos que se movieron fuera de ella.
+- Entre sincronizaciones (CALENDAR_SYNC_SECONDS) las consultas se resuelven en memoria sobre un
+  índice de intervalos (inicios ordenados + máximo acumulado de los fines): eventos de un rango,
+  ocupado/libre y conflictos en O(log n + k), sin llamar a Google.
+- Crear eventos desde la app marca la caché como vencida: la siguiente consulta ya los ve.
+La caché es por proceso: cada worker sincroniza la suya.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from .metrics import span
+
+CALENDAR_ID = "primary"
+CALENDAR_TZ = os.getenv("TZ", "America/Mazatlan")  # la misma zona por defecto que CalendarEvent
+CALENDAR_SYNC_SECONDS = float(os.getenv("CALENDAR_SYNC_SECONDS", "30"))
+CALENDAR_HORIZON_DAYS = float(os.getenv("CALENDAR_HORIZON_DAYS", "90"))
+WORKDAY = os.getenv("CALENDAR_WORKDAY", "09:00-18:00")  # horario en el que se buscan huecos libres
+LIST_PAGE_SIZE = 2500  # máximo que acepta events.list
+WINDOW_MARGIN_SECONDS = 86400  # la ventana empieza un día antes de la consulta que la fija
+WINDOW_MAX_AGE_SECONDS = 86400  # pasado este tiempo se vuelve a listar la ventana completa
+
+Interval = Tuple[float, float]  # (inicio, fin) en epoch
+
+
+# ---------- Fechas ----------
+def _tz() -> ZoneInfo:
+    return ZoneInfo(CALENDAR_TZ)
+
+
+def parse_datetime(value: str) -> datetime:
+    """RFC3339 a datetime con zona; sin offset se asume CALENDAR_TZ."""
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo else dt.replace(tzinfo=_tz())
+
+
+def format_ts(ts: float) -> str:
+    return datetime.fromtimestamp(ts, _tz()).isoformat(timespec="seconds")
+
+
+def parse_hhmm(value: str) -> int:
+    """"09:30" -> minutos desde medianoche."""
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def _event_bounds(event: Dict) -> Optional[Interval]:
+    start, end = event.get("start") or {}, event.get("end") or {}
+    if "dateTime" in start and "dateTime" in end:
+        return parse_datetime(start["dateTime"]).timestamp(), parse_datetime(end["dateTime"]).timestamp()
+    if "date" in start and "date" in end:  # todo el día: medianoche a medianoche en la zona del calendario
+        tz = _tz()
+        return (
+            datetime.combine(date.fromisoformat(start["date"]), datetime.min.time(), tz).timestamp(),
+            datetime.combine(date.fromisoformat(end["date"]), datetime.min.time(), tz).timestamp(),
+        )
+    return None
+
+
+def blocks_time(event: Dict) -> bool:
+    """Ocupa el horario salvo que esté marcado como disponible o que el usuario lo haya rechazado."""
+    if event.get("transparency") == "transparent":
+        return False
+    return not any(a.get("self") and a.get("responseStatus") == "declined" for a in event.get("attendees") or [])
+
+
+def event_summary(event: Dict, bounds: Interval) -> Dict:
+    return {
+        "id": event.get("id"),
+        "summary": event.get("summary") or "(sin título)",
+        "start": format_ts(bounds[0]),
+        "end": format_ts(bounds[1]),
+        "all_day": "date" in (event.get("start") or {}),
+        "location": event.get("location"),
+        "busy": blocks_time(event),
+    }
+
+
+# ---------- Índice de intervalos ----------
+class IntervalIndex:
+    """
+    Eventos ordenados por inicio con el máximo acumulado de los fines: los que se superponen
+    con [t0, t1) están antes de bisect(inicios, t1) y se recorren hacia atrás mientras el máximo
+    acumulado siga pasando t0. Los intervalos ocupados se fusionan una sola vez al construirlo.
+    Inmutable: una sincronización construye uno nuevo. window es el rango que se listó de Google:
+    fuera de él el índice no sabe nada.
+    """
+
+    def __init__(self, events: Iterable[Dict] = (), window: Optional[Interval] = None):
+        self.window = window
+        entries = sorted(
+            ((bounds, ev) for ev in events if (bounds := _event_bounds(ev)) is not None),
+            key=lambda entry: entry[0],
+        )
+        self.starts = [bounds[0] for bounds, _ in entries]
+        self.ends = [bounds[1] for bounds, _ in entries]
+        self.events = [ev for _, ev in entries]
+        self.max_end = list(accumulate(self.ends, max))
+        self._summaries: Dict[int, Dict] = {}
+        # Ocupado: intervalos disjuntos y ordenados (fines también crecientes)
+        merged: List[List[float]] = []
+        for (start, end), ev in entries:
+            if not blocks_time(ev):
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.busy_starts = [s for s, _ in merged]
+        self.busy_ends = [e for _, e in merged]
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def _overlapping_positions(self, t0: float, t1: float) -> List[int]:
+        found = []
+        i = bisect_left(self.starts, t1) - 1
+        while i >= 0 and self.max_end[i] > t0:
+            if self.ends[i] > t0:
+                found.append(i)
+            i -= 1
+        found.reverse()
+        return found
+
+    def overlapping(self, t0: float, t1: float) -> List[Tuple[Interval, Dict]]:
+        """Eventos que se superponen con [t0, t1), por orden de inicio."""
+        return [((self.starts[i], self.ends[i]), self.events[i]) for i in self._overlapping_positions(t0, t1)]
+
+    def summaries(self, t0: float, t1: float) -> List[Dict]:
+        """event_summary de los eventos del rango, formateados una vez por índice."""
+        out = []
+        for i in self._overlapping_positions(t0, t1):
+            summary = self._summaries.get(i)
+            if summary is None:
+                summary = self._summaries[i] = event_summary(self.events[i], (self.starts[i], self.ends[i]))
+            out.append(summary)
+        return out
+
+    def busy(self, t0: float, t1: float) -> List[Interval]:
+        """Intervalos ocupados dentro de [t0, t1), fusionados."""
+        lo = bisect_right(self.busy_ends, t0)
+        hi = bisect_left(self.busy_starts, t1)
+        return [(max(self.busy_starts[i], t0), min(self.busy_ends[i], t1)) for i in range(lo, hi)]
+
+    def free_slots(
+        self,
+        t0: float,
+        t1: float,
+        duration_s: float,
+        workday: Tuple[int, int],
+        max_slots: int,
+    ) -> List[Interval]:
+        """Huecos libres de al menos duration_s dentro del horario laboral de cada día."""
+        tz = _tz()
+        slots: List[Interval] = []
+        day = datetime.fromtimestamp(t0, tz).date()
+        last_day = datetime.fromtimestamp(t1, tz).date()
+        while day <= last_day and len(slots) < max_slots:
+            midnight = datetime.combine(day, datetime.min.time(), tz)
+            lo = max(t0, (midnight + timedelta(minutes=workday[0])).timestamp())
+            hi = min(t1, (midnight + timedelta(minutes=workday[1])).timestamp())
+            cursor = lo
+            for start, end in self.busy(lo, hi) + [(hi, hi)]:
+                if start - cursor >= duration_s:
+                    slots.append((cursor, start))
+                cursor = max(cursor, end)
+            day += timedelta(days=1)
+        return slots[:max_slots]
+
+
+# ---------- Sincronización ----------
+class CalendarCache:
+    """Eventos de un usuario en una ventana acotada, sincronizados por updatedMin e indexados."""
+
+    def __init__(
+        self,
+        calendar_id: str = CALENDAR_ID,
+        sync_seconds: float = CALENDAR_SYNC_SECONDS,
+        horizon_days: float = CALENDAR_HORIZON_DAYS,
+    ):
+        self.calendar_id = calendar_id
+        self.sync_seconds = sync_seconds
+        self.horizon_s = horizon_days * 86400
+        self._lock = threading.Lock()  # una sincronización a la vez
+        self._events: Dict[str, Dict] = {}
+        self._updated: Optional[str] = None  # "updated" de la última respuesta: updatedMin de la siguiente
+        self._listed_at = float("-inf")  # último listado completo de la ventana
+        self._synced_at = float("-inf")
+        self._invalidated_at = float("-inf")
+        self._index = IntervalIndex()
+        self._stats = {"full_syncs": 0, "incremental_syncs": 0, "expired_updates": 0, "items_fetched": 0}
+
+    def invalidate(self) -> None:
+        """La próxima consulta sincroniza (incremental si la ventana la cubre)."""
+        self._invalidated_at = time.monotonic()
+        self._synced_at = float("-inf")
+
+    def _fresh(self) -> bool:
+        return time.monotonic() - self._synced_at < self.sync_seconds
+
+    def _covers(self, index: IntervalIndex, t0: float, t1: float) -> bool:
+        window = index.window
+        return (
+            window is not None and window[0] <= t0 and t1 <= window[1]
+            and time.monotonic() - self._listed_at < WINDOW_MAX_AGE_SECONDS
+        )
+
+    def index(self, service_factory: Callable[[], object], t0: float, t1: float) -> IntervalIndex:
+        """
+        Índice vigente que cubre [t0, t1); sincroniza antes si pasó CALENDAR_SYNC_SECONDS desde
+        la última vez o si el rango cae fuera de la ventana listada.
+        """
+        index = self._index
+        if not (self._fresh() and self._covers(index, t0, t1)):
+            with self._lock:
+                if not (self._fresh() and self._covers(self._index, t0, t1)):
+                    self._sync(service_factory(), t0, t1)
+                index = self._index
+        return index
+
+    def _list(self, service, window: Interval, **params) -> Tuple[List[Dict], Optional[str]]:
+        items, page_token, updated = [], None, None
+        while True:
+            with span("google", api="calendar", method="events.list"):
+                page = service.events().list(
+                    calendarId=self.calendar_id,
+                    singleEvents=True,
+                    timeMin=format_ts(window[0]),
+                    timeMax=format_ts(window[1]),
+                    maxResults=LIST_PAGE_SIZE,
+                    pageToken=page_token,
+                    **params,
+                ).execute()
+            items += page.get("items", [])
+            # El de la primera página: lo que cambie mientras se pagina vuelve a venir en la siguiente
+            updated = updated or page.get("updated")
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return items, updated
+
+    def _sync(self, service, t0: float, t1: float) -> None:
+        from googleapiclient.errors import HttpError
+        started = time.monotonic()
+        window = self._index.window
+        items = None
+        if self._updated and self._covers(self._index, t0, t1):
+            try:
+                items, updated = self._list(service, window, updatedMin=self._updated, showDeleted=True)
+                self._stats["incremental_syncs"] += 1
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                self._stats["expired_updates"] += 1  # updatedMin demasiado viejo: Google pide listar de nuevo
+        full = items is None
+        if full:
+            window = (t0 - WINDOW_MARGIN_SECONDS, max(t1, t0 + self.horizon_s))
+            items, updated = self._list(service, window)
+            self._events = {}
+            self._listed_at = started
+            self._stats["full_syncs"] += 1
+        for item in items:
+            if item.get("status") == "cancelled":
+                self._events.pop(item["id"], None)
+            else:
+                self._events[item["id"]] = item
+        if full or items:
+            self._index = IntervalIndex(self._events.values(), window)
+        self._stats["items_fetched"] += len(items)
+        self._updated = updated
+        # Un evento creado mientras se listaba puede no venir en esta respuesta
+        self._synced_at = started if self._invalidated_at < started else float("-inf")
+
+    def stats(self) -> Dict:
+        window = self._index.window
+        return {
+            **self._stats,
+            "events": len(self._index),
+            "window": [format_ts(window[0]), format_ts(window[1])] if window else None,
+        }
+
+
+_caches: Dict[str, CalendarCache] = {}
+_caches_lock = threading.Lock()
+
+
+def cache_for(identity: str) -> CalendarCache:
+    """Caché del usuario (identidad estable de la credencial, ver google_actions)."""
+    with _caches_lock:
+        cache = _caches.get(identity)
+        if cache is None:
+            cache = _caches[identity] = CalendarCache()
+        return cache
+
+
+def invalidate(identity: str) -> None:
+    with _caches_lock:
+        cache = _caches.get(identity)
+    if cache is not None:
+        cache.invalidate()
+
+
+def stats() -> Dict:
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {"users": len(caches), "caches": [c.stats() for c in caches]}
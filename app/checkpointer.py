@@ -0,0 +1,295 @@
+# app/checkpointer.py
+"""
+Checkpointer de conversaciones acotado y persistente.
+- CHECKPOINTER=sqlite (por defecto): SQLite en disco, sobrevive a reinicios.
+- CHECKPOINTER=memory: en memoria (desarrollo).
+Por defecto sigue a STATE_BACKEND: con sqlite, varios workers comparten las conversaciones.
+Ambos desalojan sesiones inactivas (TTL) y las menos recientes por encima de SESSION_MAX,
+y de cada sesión conservan solo los últimos CHECKPOINT_KEEP checkpoints (con sus writes y
+blobs): el almacenamiento por sesión no crece con los turnos. on_evict recibe las sesiones
+desalojadas, para limpiar el estado que vive fuera del checkpointer.
+La política de historial (compact_history) conserva los últimos N turnos y
+pliega los anteriores en un mensaje de resumen, así el prompt y el estado no crecen.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, RemoveMessage, ToolMessage
+
+CHECKPOINTER = os.getenv("CHECKPOINTER", os.getenv("STATE_BACKEND", "sqlite"))
+CHECKPOINT_DB = os.getenv("CHECKPOINT_DB", os.path.join(os.getenv("DATA_DIR", "data"), "checkpoints.sqlite"))
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+SWEEP_EVERY = 200  # puts entre barridos de desalojo
+# Checkpoints que se conservan por sesión; el historial vive en el último (ver compact_history)
+CHECKPOINT_KEEP = max(int(os.getenv("CHECKPOINT_KEEP", "2")), 1)
+
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "6"))
+SUMMARY_MAX_CHARS = int(os.getenv("HISTORY_SUMMARY_MAX_CHARS", "4000"))
+SUMMARY_LINE_CHARS = 240
+SUMMARY_ID = "history_summary"
+SUMMARY_HEADER = "[RESUMEN DE LA CONVERSACIÓN ANTERIOR]"
+ANNOUNCEMENT_LINE = "Sistema: [DOCUMENTO ADJUNTO"
+
+
+# ---------- Desalojo ----------
+class _EvictionMixin(ABC):
+    """
+    Registra la actividad por thread_id en cada put y desaloja sesiones inactivas.
+    Cada put poda además los checkpoints anteriores del mismo thread.
+    Cada backend implementa dónde guarda la actividad y cómo poda.
+    """
+
+    def _init_eviction(self, on_evict: Optional[Callable[[List[str]], None]] = None) -> None:
+        self._puts = 0
+        self._puts_lock = threading.Lock()
+        self._on_evict = on_evict
+
+    @abstractmethod
+    def _touch(self, thread_id: str) -> None:
+        """Marca el thread como usado ahora."""
+
+    @abstractmethod
+    def _expired_threads(self, now: float) -> List[str]:
+        """Threads inactivos más de SESSION_TTL_SECONDS y los menos recientes por encima de SESSION_MAX."""
+
+    @abstractmethod
+    def _forget(self, thread_ids: List[str]) -> None:
+        """Olvida la actividad de threads ya eliminados."""
+
+    @abstractmethod
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        """Deja solo los últimos CHECKPOINT_KEEP checkpoints del thread, con sus writes y blobs."""
+
+    def evict(self) -> int:
+        """Elimina sesiones inactivas o por encima del máximo. Devuelve cuántas eliminó."""
+        expired = self._expired_threads(time.time())
+        for thread_id in expired:
+            self.delete_thread(thread_id)
+        self._forget(expired)
+        if self._on_evict is not None:
+            self._on_evict(expired)
+        return len(expired)
+
+    def _after_put(self, config) -> None:
+        self._touch(config["configurable"]["thread_id"])
+        with self._puts_lock:
+            self._puts += 1
+            sweep = self._puts % SWEEP_EVERY == 0
+        if sweep:
+            self.evict()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._prune(config["configurable"]["thread_id"], config["configurable"].get("checkpoint_ns", ""))
+        self._after_put(config)
+        return result
+
+
+def _memory_saver_cls():
+    from langgraph.checkpoint.memory import MemorySaver
+
+    class BoundedMemorySaver(_EvictionMixin, MemorySaver):
+        """MemorySaver con desalojo LRU/TTL de sesiones."""
+
+        def __init__(self, on_evict=None):
+            super().__init__()
+            self._init_eviction(on_evict)
+            self._activity: "OrderedDict[str, float]" = OrderedDict()
+            self._activity_lock = threading.Lock()
+
+        def _touch(self, thread_id: str) -> None:
+            with self._activity_lock:
+                self._activity[thread_id] = time.time()
+                self._activity.move_to_end(thread_id)
+
+        def _expired_threads(self, now: float) -> List[str]:
+            with self._activity_lock:
+                items = list(self._activity.items())
+            overflow = max(len(items) - SESSION_MAX, 0)
+            return [t for i, (t, last) in enumerate(items) if i < overflow or now - last > SESSION_TTL_SECONDS]
+
+        def _forget(self, thread_ids: List[str]) -> None:
+            with self._activity_lock:
+                for thread_id in thread_ids:
+                    self._activity.pop(thread_id, None)
+
+        def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+            saved = self.storage[thread_id][checkpoint_ns]
+            if len(saved) <= CHECKPOINT_KEEP:
+                return
+            ids = sorted(saved)  # los ids de checkpoint crecen con el tiempo
+            kept_versions = set()
+            for checkpoint_id in ids[-CHECKPOINT_KEEP:]:
+                kept_versions.update(self.serde.loads_typed(saved[checkpoint_id][0])["channel_versions"].items())
+            for checkpoint_id in ids[:-CHECKPOINT_KEEP]:
+                checkpoint = self.serde.loads_typed(saved.pop(checkpoint_id)[0])
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+                # Un blob se escribe con el checkpoint que lo versiona: se borra si ya no lo usa ninguno
+                for channel, version in checkpoint["channel_versions"].items():
+                    if (channel, version) not in kept_versions:
+                        self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+
+    return BoundedMemorySaver
+
+
+def _sqlite_saver_cls():
+    from langgraph.checkpoint.sqlite import SqliteSaver
+
+    class BoundedSqliteSaver(_EvictionMixin, SqliteSaver):
+        """
+        SqliteSaver con desalojo LRU/TTL. Los métodos async delegan en los síncronos
+        en un hilo aparte (SqliteSaver solo implementa la API síncrona).
+        """
+
+        def __init__(self, path: str, on_evict=None):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            # timeout: con varios workers, espera el lock de escritura de otro proceso
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            super().__init__(conn)
+            self.setup()
+            self._init_eviction(on_evict)
+            with self.lock:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS session_activity (thread_id TEXT PRIMARY KEY, last_used REAL NOT NULL)"
+                )
+                conn.commit()
+
+        def _touch(self, thread_id: str) -> None:
+            with self.lock:
+                self.conn.execute(
+                    "INSERT INTO session_activity (thread_id, last_used) VALUES (?, ?) "
+                    "ON CONFLICT(thread_id) DO UPDATE SET last_used = excluded.last_used",
+                    (thread_id, time.time()),
+                )
+                self.conn.commit()
+
+        def _expired_threads(self, now: float) -> List[str]:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT thread_id FROM session_activity WHERE last_used < ? OR thread_id IN ("
+                    "SELECT thread_id FROM session_activity ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (now - SESSION_TTL_SECONDS, SESSION_MAX),
+                ).fetchall()
+            return [r[0] for r in rows]
+
+        def _forget(self, thread_ids: List[str]) -> None:
+            with self.lock:
+                self.conn.executemany("DELETE FROM session_activity WHERE thread_id = ?", [(t,) for t in thread_ids])
+                self.conn.commit()
+
+        def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+            # SqliteSaver guarda los valores dentro de cada checkpoint: no hay blobs aparte
+            with self.lock:
+                self.conn.execute(
+                    "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ("
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns, CHECKPOINT_KEEP),
+                )
+                self.conn.execute(
+                    "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id NOT IN ("
+                    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?)",
+                    (thread_id, checkpoint_ns, thread_id, checkpoint_ns),
+                )
+                self.conn.commit()
+
+        async def aget_tuple(self, config):
+            return await asyncio.to_thread(self.get_tuple, config)
+
+        async def alist(self, config, *, filter=None, before=None, limit=None):
+            items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+            for item in items:
+                yield item
+
+        async def aput(self, config, checkpoint, metadata, new_versions):
+            return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+        async def aput_writes(self, config, writes, task_id, task_path=""):
+            return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+        async def adelete_thread(self, thread_id):
+            return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    return BoundedSqliteSaver
+
+
+def create_checkpointer(kind: Optional[str] = None, on_evict: Optional[Callable[[List[str]], None]] = None):
+    """Fábrica del checkpointer según CHECKPOINTER (sqlite | memory). on_evict: ver el docstring del módulo."""
+    kind = kind or CHECKPOINTER
+    if kind == "memory":
+        return _memory_saver_cls()(on_evict)
+    if kind == "sqlite":
+        return _sqlite_saver_cls()(CHECKPOINT_DB, on_evict)
+    raise ValueError(f"CHECKPOINTER desconocido: {kind}")
+
+
+# ---------- Política de historial ----------
+def _summary_line(msg: BaseMessage) -> Optional[str]:
+    text = msg.content if isinstance(msg.content, str) else " ".join(
+        p.get("text", "") if isinstance(p, dict) else str(p) for p in msg.content
+    )
+    text = " ".join(text.split())
+    if isinstance(msg, HumanMessage):
+        # Los anuncios de documentos se conservan completos: son cortos y el agente los necesita
+        if text.startswith("[DOCUMENTO ADJUNTO"):
+            blocks, _, question = text.partition("Pregunta del usuario:")
+            return f"Sistema: {blocks.strip()}\nUsuario: {question.strip()[:SUMMARY_LINE_CHARS]}"
+        return f"Usuario: {text[:SUMMARY_LINE_CHARS]}"
+    if isinstance(msg, AIMessage):
+        calls = ", ".join(c["name"] for c in getattr(msg, "tool_calls", None) or [])
+        if calls:
+            return f"Asistente usó: {calls}"
+        return f"Asistente: {text[:SUMMARY_LINE_CHARS]}" if text else None
+    if isinstance(msg, ToolMessage):
+        return f"Resultado {msg.name or 'tool'}: {text[:SUMMARY_LINE_CHARS // 2]}"
+    return None
+
+
+def _pinned(line: str) -> bool:
+    return line.startswith(ANNOUNCEMENT_LINE)
+
+
+def _fold(previous: str, folded: List[BaseMessage]) -> str:
+    lines = [l for l in previous.splitlines() if l and l != SUMMARY_HEADER]
+    for line in (_summary_line(m) for m in folded):
+        if line:
+            lines += line.splitlines()
+    # Si se pasa del límite, se descartan las líneas más antiguas salvo los anuncios de
+    # documentos: el anuncio no se repite y sin él el agente pierde el doc_id
+    size = sum(len(l) + 1 for l in lines)
+    i = 0
+    while size > SUMMARY_MAX_CHARS and i < len(lines):
+        if _pinned(lines[i]):
+            i += 1
+            continue
+        size -= len(lines.pop(i)) + 1
+    return "\n".join([SUMMARY_HEADER, *lines])
+
+
+def compact_history(state: Dict) -> Dict:
+    """
+    pre_model_hook del agente: si hay más de HISTORY_KEEP_TURNS turnos, pliega los
+    anteriores en un único mensaje de resumen y reemplaza el historial en el estado.
+    """
+    messages: List[BaseMessage] = state["messages"]
+    summary = ""
+    if messages and messages[0].id == SUMMARY_ID:
+        summary, messages = messages[0].content, messages[1:]
+
+    turn_starts = [i for i, m in enumerate(messages) if isinstance(m, HumanMessage)]
+    if len(turn_starts) <= HISTORY_KEEP_TURNS:
+        return {}
+
+    from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+    cut = turn_starts[-HISTORY_KEEP_TURNS]
+    summary_msg = HumanMessage(content=_fold(summary, messages[:cut]), id=SUMMARY_ID)
+    return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), summary_msg, *messages[cut:]]}
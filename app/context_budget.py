@@ -0,0 +1,181 @@
+# app/context_budget.py
+"""
+Presupuesto de tokens del prompt.
+Se cuenta todo lo que llega al modelo: system prompt y schemas de las tools (fijos),
+resumen e historial, resultados de tools (contenido de documentos) y el turno del usuario,
+contra un presupuesto por modelo. Si no cabe, se recorta de forma determinista:
+1) se omiten los turnos completos más antiguos (nunca el turno en curso),
+2) se acortan los mensajes más grandes (resultados de tools, resumen, turno del usuario).
+El recorte solo afecta a la entrada de esa llamada (llm_input_messages): el historial
+guardado no cambia. Los conteos son una estimación local rápida, memoizada por texto
+y por fragmento de documento.
+"""
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage
+
+from .checkpointer import SUMMARY_ID, compact_history
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "32000"))
+# Presupuestos por modelo, p. ej. '{"gemini-2.5-pro": 64000}'; el resto usa CONTEXT_TOKEN_BUDGET
+MODEL_TOKEN_BUDGETS: Dict[str, int] = json.loads(os.getenv("CONTEXT_TOKEN_BUDGETS", "{}"))
+OUTPUT_RESERVE_TOKENS = int(os.getenv("CONTEXT_OUTPUT_RESERVE", "2048"))
+PDF_CONTEXT_TOKENS = int(os.getenv("PDF_CONTEXT_TOKENS", "1600"))  # contenido de documentos por pdf_query
+
+MESSAGE_OVERHEAD_TOKENS = 4  # rol y separadores de cada mensaje
+MIN_KEEP_TOKENS = 64  # un mensaje recortado conserva al menos esto
+TRIM_MARKER = "\n[… recortado por presupuesto de contexto]"
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+
+# ---------- Estimación ----------
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """
+    Aproximación a un tokenizador de subpalabras: cada signo cuenta uno y cada palabra,
+    uno por cada 4 caracteres. Tiende a sobrestimar, que es el lado seguro.
+    """
+    return sum((len(tok) + 3) // 4 for tok in _TOKEN_RE.findall(text))
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return " ".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in content or [])
+
+
+def message_tokens(msg: BaseMessage) -> int:
+    tokens = estimate_tokens(_text(msg.content)) + MESSAGE_OVERHEAD_TOKENS
+    for call in getattr(msg, "tool_calls", None) or []:
+        tokens += estimate_tokens(call["name"] + json.dumps(call["args"], ensure_ascii=False, sort_keys=True))
+    return tokens
+
+
+_chunk_tokens: "OrderedDict[tuple, int]" = OrderedDict()
+_chunk_lock = threading.Lock()
+
+
+def chunk_tokens(doc: Dict, chunk: Dict, text: str) -> int:
+    """Tokens de un fragmento del índice, memoizados por (documento, posición)."""
+    key = (doc["txt_path"], chunk["page"], chunk["start"], chunk["end"])
+    with _chunk_lock:
+        cached = _chunk_tokens.get(key)
+        if cached is not None:
+            _chunk_tokens.move_to_end(key)
+            return cached
+    tokens = estimate_tokens(text)
+    with _chunk_lock:
+        _chunk_tokens[key] = tokens
+        while len(_chunk_tokens) > 65536:
+            _chunk_tokens.popitem(last=False)
+    return tokens
+
+
+def budget_for(model_name: Optional[str]) -> int:
+    name = (model_name or "").split("/")[-1]  # "models/gemini-2.0-flash" -> "gemini-2.0-flash"
+    return MODEL_TOKEN_BUDGETS.get(name, CONTEXT_TOKEN_BUDGET)
+
+
+# ---------- Recorte ----------
+def trim_text(text: str, max_tokens: int) -> str:
+    """Corta el texto (en un límite de palabra) para que quepa en max_tokens, con una marca al final."""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = max(max_tokens - estimate_tokens(TRIM_MARKER), 1)
+    cut = max(int(len(text) * keep / tokens), 1)
+    while cut > 1 and estimate_tokens(text[:cut]) > keep:
+        cut = int(cut * 0.9)
+    space = text.rfind(" ", 0, cut)
+    if space > cut // 2:
+        cut = space
+    return text[:cut].rstrip() + TRIM_MARKER
+
+
+def _is_turn_start(msg: BaseMessage) -> bool:
+    return isinstance(msg, HumanMessage) and msg.id != SUMMARY_ID
+
+
+def fit_messages(messages: List[BaseMessage], budget: int) -> Tuple[List[BaseMessage], int]:
+    """Ajusta los mensajes al presupuesto. Devuelve (mensajes, tokens recortados)."""
+    costs = [message_tokens(m) for m in messages]
+    total = sum(costs)
+    if total <= budget:
+        return messages, 0
+    original = total
+    msgs, costs = list(messages), list(costs)
+
+    # 1) Turnos completos más antiguos (se conserva el resumen y el turno en curso)
+    starts = [i for i, m in enumerate(msgs) if _is_turn_start(m)]
+    drop_end = None
+    for nxt in starts[1:]:
+        if total <= budget:
+            break
+        total -= sum(costs[(drop_end or starts[0]):nxt])
+        drop_end = nxt
+    if drop_end is not None:
+        del msgs[starts[0]:drop_end]
+        del costs[starts[0]:drop_end]
+
+    # 2) Acortar el mensaje más grande que se pueda recortar, hasta caber
+    while total > budget:
+        candidates = [
+            i for i, m in enumerate(msgs)
+            if isinstance(m, (ToolMessage, HumanMessage)) and costs[i] > MIN_KEEP_TOKENS
+        ]
+        if not candidates:
+            break
+        i = max(candidates, key=lambda j: (costs[j], -j))  # empate: el más antiguo
+        target = max(costs[i] - (total - budget), MIN_KEEP_TOKENS)
+        text = trim_text(_text(msgs[i].content), target - MESSAGE_OVERHEAD_TOKENS)
+        msgs[i] = msgs[i].model_copy(update={"content": text})
+        new_cost = message_tokens(msgs[i])
+        if new_cost >= costs[i]:
+            break
+        total -= costs[i] - new_cost
+        costs[i] = new_cost
+    return msgs, original - total
+
+
+# ---------- Hook del agente ----------
+_stats = {"prompts": 0, "trimmed_prompts": 0, "tokens_trimmed_total": 0, "last_prompt_tokens": 0, "budget": 0}
+_stats_lock = threading.Lock()
+
+
+def make_pre_model_hook(fixed_text: str, model_name: Optional[str]):
+    """
+    pre_model_hook del agente: compacta el historial (compact_history) y ajusta la entrada
+    del modelo al presupuesto. fixed_text es lo que se envía siempre (system prompt + tools).
+    """
+    fixed_tokens = estimate_tokens(fixed_text)
+    available = max(budget_for(model_name) - OUTPUT_RESERVE_TOKENS - fixed_tokens, MIN_KEEP_TOKENS)
+
+    def hook(state: Dict) -> Dict:
+        update = compact_history(state)
+        # Con compactación, update["messages"] = [RemoveMessage(todos), *mensajes nuevos]
+        messages = update["messages"][1:] if update else state["messages"]
+        fitted, trimmed = fit_messages(messages, available)
+        with _stats_lock:
+            _stats["prompts"] += 1
+            _stats["budget"] = available + fixed_tokens
+            _stats["last_prompt_tokens"] = fixed_tokens + sum(message_tokens(m) for m in fitted)
+            if trimmed:
+                _stats["trimmed_prompts"] += 1
+                _stats["tokens_trimmed_total"] += trimmed
+        if trimmed:
+            update = {**update, "llm_input_messages": fitted}
+        return update
+
+    return hook
+
+
+def budget_stats() -> Dict:
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,209 @@
+# app/credentials.py
+"""
+Gestor de credenciales de Google.
+- Persiste los tokens (incluido el refresh token) en el almacén de estado compartido
+  (SQLite en DATA_DIR): sobreviven a reinicios y los ven todos los workers.
+- Un refresco en segundo plano renueva el access token REFRESH_MARGIN_SECONDS antes de que
+  expire, así las tools reciben credenciales válidas sin esperar al token endpoint.
+- Single-flight: un solo refresco a la vez por proceso (lock) y entre procesos (lease en el
+  almacén); los demás adoptan el token que guardó quien refrescó.
+GOOGLE_TOKEN_URI permite apuntar a un token endpoint local (ver bench/bench_credentials.py).
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from .metrics import Counter, _register
+from .state_store import state_store
+
+logger = logging.getLogger("app.credentials")
+
+TOKEN_URI = os.getenv("GOOGLE_TOKEN_URI", "https://oauth2.googleapis.com/token")
+# Debe superar el margen con el que google-auth da un token por vencido (3 min 45 s):
+# si no, el transporte de googleapiclient refrescaría por su cuenta en cada request
+REFRESH_MARGIN_SECONDS = int(os.getenv("GOOGLE_TOKEN_REFRESH_MARGIN", "300"))
+SYNC_SECONDS = 1.0  # cada cuánto se relee el almacén (cambios hechos por otro worker)
+REFRESH_CHECK_SECONDS = 60.0  # espera máxima del refresco en segundo plano entre revisiones
+REFRESH_RETRY_SECONDS = 30.0  # tras un refresco fallido no se reintenta antes de esto
+LEASE_SECONDS = 30.0
+
+NAMESPACE = "credentials"
+KEY = "google"
+LEASE_KEY = "google_refresh_lease"
+_FIELDS = ("token", "refresh_token", "token_uri", "client_id", "client_secret", "scopes")
+
+TOKEN_REFRESHES = _register(Counter("google_token_refresh_total", "Refrescos del access token de Google", ["status"]))
+
+
+def creds_to_dict(creds) -> dict:
+    data = {f: getattr(creds, f, None) for f in _FIELDS}
+    data["scopes"] = list(data["scopes"]) if data["scopes"] else None
+    expiry = getattr(creds, "expiry", None)
+    data["expiry"] = expiry.isoformat() if expiry else None
+    return data
+
+
+def creds_from_dict(data: dict):
+    from google.oauth2.credentials import Credentials
+    creds = Credentials(**{f: data.get(f) for f in _FIELDS})
+    if data.get("expiry"):
+        creds.expiry = datetime.fromisoformat(data["expiry"])  # naive UTC, como google-auth
+    return creds
+
+
+def _seconds_left(creds) -> Optional[float]:
+    """Segundos hasta que expira el access token (None si no tiene expiración conocida)."""
+    expiry = getattr(creds, "expiry", None)
+    if expiry is None:
+        return None
+    return (expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds()
+
+
+class CredentialManager:
+    def __init__(self, state=None, margin: float = REFRESH_MARGIN_SECONDS):
+        self._state = state or state_store
+        self.margin = margin
+        self._lock = threading.Lock()          # protege el caché local
+        self._refresh_lock = threading.Lock()  # single-flight del refresco en este proceso
+        self._data: Optional[dict] = None
+        self._creds = None
+        self._synced_at = 0.0
+        self._failed_at = float("-inf")
+        self._owner = uuid.uuid4().hex
+
+    # ---------- Lectura ----------
+    def _sync(self, force: bool = False):
+        """Credenciales del caché local, releyendo el almacén como mucho cada SYNC_SECONDS."""
+        now = time.monotonic()
+        if not force and now - self._synced_at < SYNC_SECONDS:
+            return self._creds
+        data = self._state.get(NAMESPACE, KEY)
+        with self._lock:
+            self._synced_at = now
+            if data != self._data:
+                self._creds = creds_from_dict(data) if data else None
+                self._data = data
+            return self._creds
+
+    def _due(self, creds) -> bool:
+        left = _seconds_left(creds)
+        return bool(creds.refresh_token) and (not creds.token or (left is not None and left <= self.margin))
+
+    def get(self):
+        """
+        Credenciales actuales. Normalmente ya vienen refrescadas por el proceso en segundo plano;
+        si el token expiró igualmente (p. ej. sin refresco activo), se refresca aquí una sola vez.
+        """
+        creds = self._sync()
+        if creds is not None and not creds.valid and creds.refresh_token:
+            creds = self.refresh()
+        return creds
+
+    # ---------- Escritura ----------
+    def set(self, creds) -> None:
+        from .google_actions import invalidate_services
+        data = creds_to_dict(creds) if creds is not None else None
+        with self._lock:
+            previous = self._creds
+            self._data, self._creds, self._synced_at = data, creds, time.monotonic()
+        if previous is not None and previous is not creds:
+            invalidate_services(previous)
+        if data is None:
+            self._state.delete(NAMESPACE, KEY)
+        else:
+            self._state.put(NAMESPACE, KEY, data)
+
+    # ---------- Refresco ----------
+    def _take_lease(self) -> bool:
+        now = time.time()
+
+        def take(lease):
+            if lease and lease["owner"] != self._owner and lease["until"] > now:
+                return lease
+            return {"owner": self._owner, "until": now + LEASE_SECONDS}
+
+        return self._state.update(NAMESPACE, LEASE_KEY, take)["owner"] == self._owner
+
+    def _release_lease(self) -> None:
+        """Libera el lease solo si sigue siendo nuestro (pudo vencer y tomarlo otro worker)."""
+        self._state.update(NAMESPACE, LEASE_KEY, lambda lease: lease if lease and lease["owner"] != self._owner else None)
+
+    def _wait_for_other(self, stale_token: Optional[str]) -> bool:
+        """
+        Otro worker está refrescando: espera a que guarde el token nuevo (o se borren las
+        credenciales). True si en cambio el lease expiró sin token nuevo y lo tomamos nosotros.
+        """
+        deadline = time.monotonic() + LEASE_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            creds = self._sync(force=True)
+            if creds is None or creds.token != stale_token:
+                return False
+            if self._take_lease():
+                return True
+        return False
+
+    def refresh(self, force: bool = False):
+        """Refresca el access token si está por expirar (o siempre con force). Single-flight."""
+        from google.auth.exceptions import RefreshError
+        from google.auth.transport.requests import Request
+
+        with self._refresh_lock:
+            # Quien esperaba el lock adopta el token que acaba de guardar otro hilo o worker
+            creds = self._sync(force=True)
+            if creds is None or not creds.refresh_token or not (force or self._due(creds)):
+                return creds
+            if not force and time.monotonic() - self._failed_at < REFRESH_RETRY_SECONDS:
+                return creds  # falló hace poco (p. ej. token revocado): no martillar el endpoint
+            if not self._take_lease() and not self._wait_for_other(creds.token):
+                return self._creds  # lo refrescó otro worker, o las credenciales se borraron
+            try:
+                with self._lock:
+                    data = self._data
+                if data is None:
+                    return None  # se borraron mientras esperábamos el lease
+                fresh = creds_from_dict(data)  # se refresca una copia: el objeto en uso no cambia a medias
+                try:
+                    fresh.refresh(Request())
+                except RefreshError as e:
+                    self._failed_at = time.monotonic()
+                    TOKEN_REFRESHES.inc(status="error")
+                    logger.warning("refresco del token de Google falló: %s", e)
+                    return creds
+                TOKEN_REFRESHES.inc(status="ok")
+                self.set(fresh)
+                return fresh
+            finally:
+                self._release_lease()
+
+    def seconds_until_due(self) -> Optional[float]:
+        creds = self._sync()
+        if creds is None or not creds.refresh_token:
+            return None
+        if not creds.token:
+            return 0.0
+        left = _seconds_left(creds)
+        return None if left is None else max(left - self.margin, 0.0)
+
+    async def run_refresher(self) -> None:
+        """Tarea del lifespan: refresca antes de la expiración, hasta que la cancelen."""
+        while True:
+            due = self.seconds_until_due()
+            if due == 0.0:
+                try:
+                    await asyncio.to_thread(self.refresh)
+                except Exception as e:  # red caída, etc.
+                    self._failed_at = time.monotonic()
+                    logger.warning("refresco en segundo plano falló: %s", e)
+                if self.seconds_until_due() == 0.0:
+                    await asyncio.sleep(REFRESH_RETRY_SECONDS)
+                continue
+            await asyncio.sleep(min(due if due is not None else REFRESH_CHECK_SECONDS, REFRESH_CHECK_SECONDS))
+
+
+credential_manager = CredentialManager()
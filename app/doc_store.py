@@ -0,0 +1,149 @@
+# app/doc_store.py
+"""
+Almacén de documentos por sesión.
+Cada sesión puede tener varios documentos; el texto se queda en disco (DATA_DIR/objects)
+y se lee por rango de páginas con mmap. Solo las páginas consultadas pasan a memoria,
+en una caché LRU con un presupuesto global (DOC_MEMORY_BUDGET_BYTES).
+El registro sesión -> documentos vive en el almacén de estado compartido (state_store),
+así cualquier worker ve los documentos subidos a otro; las cachés de páginas son por proceso.
+"""
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .state_store import state_store as default_state_store
+
+MEMORY_BUDGET_BYTES = int(os.getenv("DOC_MEMORY_BUDGET_BYTES", str(64 * 1024 * 1024)))
+
+_PAGE_MARK_RE = re.compile("^\\[Página (\\d+)\\]\\n".encode("utf-8"), re.MULTILINE)
+
+
+NAMESPACE = "documents"
+
+
+class DocumentStore:
+    def __init__(self, memory_budget: int = MEMORY_BUDGET_BYTES, state=None):
+        self.memory_budget = memory_budget
+        self._lock = threading.Lock()
+        # Documentos por sesión (grupo = session_id), en orden de registro
+        self._state = state or default_state_store
+        # {txt_path: [(página, inicio, fin), ...]} offsets en bytes del cuerpo de cada página
+        self._offsets: "OrderedDict[str, List[tuple]]" = OrderedDict()
+        # {(txt_path, página): texto} páginas ya leídas
+        self._pages: "OrderedDict[tuple, str]" = OrderedDict()
+        self._cached_bytes = 0
+        self._stats = {"page_hits": 0, "page_misses": 0, "page_evictions": 0}
+
+    # ---------- Registro ----------
+    def register(self, session_id: str, filename: str, result: Dict) -> Dict:
+        """Asocia un documento ya ingerido (resultado de pdf_ingest) a la sesión."""
+        doc = {
+            "doc_id": result["doc_id"],
+            "filename": filename,
+            "pages": result["pages"],
+            "txt_path": result["txt_path"],
+            "index_path": result["index_path"],
+            "pdf_path": result["pdf_path"],
+            "text_bytes": os.path.getsize(result["txt_path"]),
+        }
+        # Reescribirlo lo deja al final: el último registrado es el "actual" de la sesión
+        self._state.put(NAMESPACE, f"{session_id}:{doc['doc_id']}", doc, group=session_id)
+        return doc
+
+    def list(self, session_id: str) -> List[Dict]:
+        return [doc for _, doc in self._state.items(NAMESPACE, session_id)]
+
+    def get(self, session_id: str, doc_id: Optional[str] = None) -> Optional[Dict]:
+        """Documento por id, o el último subido en la sesión si no se indica."""
+        if doc_id is not None:
+            return self._state.get(NAMESPACE, f"{session_id}:{doc_id}")
+        docs = self.list(session_id)
+        return docs[-1] if docs else None
+
+    def drop_session(self, session_id: str) -> None:
+        self._state.delete_group(NAMESPACE, session_id)
+
+    # ---------- Lectura perezosa ----------
+    def _page_offsets(self, txt_path: str) -> List[tuple]:
+        with self._lock:
+            offsets = self._offsets.get(txt_path)
+            if offsets is not None:
+                self._offsets.move_to_end(txt_path)
+                return offsets
+        with open(txt_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            marks = [(int(m.group(1)), m.start(), m.end()) for m in _PAGE_MARK_RE.finditer(mm)]
+            size = len(mm)
+        offsets = [
+            (page, body, marks[i + 1][1] if i + 1 < len(marks) else size)
+            for i, (page, _, body) in enumerate(marks)
+        ]
+        with self._lock:
+            self._offsets[txt_path] = offsets
+            while len(self._offsets) > 256:
+                self._offsets.popitem(last=False)
+        return offsets
+
+    def _remember(self, key: tuple, text: str) -> None:
+        size = len(text.encode("utf-8"))
+        with self._lock:
+            if key in self._pages:
+                return
+            self._pages[key] = text
+            self._cached_bytes += size
+            while self._cached_bytes > self.memory_budget and len(self._pages) > 1:
+                (_, _), old = self._pages.popitem(last=False)
+                self._cached_bytes -= len(old.encode("utf-8"))
+                self._stats["page_evictions"] += 1
+
+    def read_pages(self, doc: Dict, start: int, end: Optional[int] = None) -> Dict[int, str]:
+        """Texto de las páginas [start, end] (1-based, inclusivo) sin cargar el documento entero."""
+        end = end or start
+        txt_path = doc["txt_path"]
+        result: Dict[int, str] = {}
+        missing = []
+        with self._lock:
+            for page in range(start, end + 1):
+                text = self._pages.get((txt_path, page))
+                if text is None:
+                    missing.append(page)
+                else:
+                    self._pages.move_to_end((txt_path, page))
+                    self._stats["page_hits"] += 1
+                    result[page] = text
+        if not missing:
+            return result
+
+        wanted = set(missing)
+        offsets = [o for o in self._page_offsets(txt_path) if o[0] in wanted]
+        with open(txt_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for page, begin, finish in offsets:
+                text = mm[begin:finish].decode("utf-8", errors="replace").strip()
+                self._remember((txt_path, page), text)
+                result[page] = text
+        with self._lock:
+            self._stats["page_misses"] += len(missing)
+        return result
+
+    def chunk_text(self, doc: Dict, chunk: Dict) -> str:
+        """Texto de un fragmento del índice (página + offsets dentro de la página)."""
+        page_text = self.read_pages(doc, chunk["page"]).get(chunk["page"], "")
+        return page_text[chunk["start"]:chunk["end"]].strip()
+
+    def stats(self) -> Dict:
+        registered = self._state.count(NAMESPACE)
+        with self._lock:
+            return {
+                **self._stats,
+                "sessions": registered["groups"],
+                "documents": registered["entries"],
+                "cached_pages": len(self._pages),
+                "cached_bytes": self._cached_bytes,
+                "memory_budget_bytes": self.memory_budget,
+            }
+
+
+# Instancia compartida por main.py, el agente y las tools
+doc_store = DocumentStore()
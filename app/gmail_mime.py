@@ -0,0 +1,118 @@
+# app/gmail_mime.py
+"""
+Construcción de correos MIME para Gmail.
+- Encabezados en UTF-8 (RFC 2047) y nombres de adjunto con RFC 2231.
+- Cuerpo de texto y adjuntos en multipart/mixed; los adjuntos se codifican en base64 por bloques
+  desde su archivo en disco hacia el archivo del mensaje, así la memoria no depende de su tamaño.
+El envío (raw en JSON o subida reanudable según el tamaño) está en google_actions.send_gmail.
+"""
+import base64
+import os
+import uuid
+from email.header import Header
+from email.utils import encode_rfc2231, formatdate
+from typing import BinaryIO, List, NamedTuple, Optional
+
+from . import pdf_cache
+
+LINE_BYTES = 57  # bytes por línea de base64 (76 caracteres)
+READ_BYTES = LINE_BYTES * 4096  # ~228 KiB por lectura; múltiplo de 3: sin relleno a mitad del flujo
+
+
+class Attachment(NamedTuple):
+    path: str
+    filename: str
+    mimetype: str = "application/octet-stream"
+
+
+def _clean(value: str) -> str:
+    return " ".join(value.splitlines())  # sin saltos de línea: evita inyectar encabezados
+
+
+def _header(name: str, value: str) -> bytes:
+    value = _clean(value)
+    try:
+        value.encode("ascii")
+    except UnicodeEncodeError:
+        value = Header(value, "utf-8").encode()
+    return f"{name}: {value}\r\n".encode("ascii")
+
+
+def _filename_params(filename: str) -> str:
+    filename = _clean(filename).replace('"', "")
+    try:
+        filename.encode("ascii")
+        return f'filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"filename*={encode_rfc2231(filename, 'utf-8')}"
+
+
+def _write_base64(fp: BinaryIO, data: bytes) -> None:
+    encoded = base64.b64encode(data)
+    for i in range(0, len(encoded), 76):
+        fp.write(encoded[i:i + 76] + b"\r\n")
+
+
+def _write_base64_file(fp: BinaryIO, path: str) -> None:
+    with open(path, "rb") as src:
+        for block in iter(lambda: src.read(READ_BYTES), b""):
+            _write_base64(fp, block)
+
+
+def write_message(
+    fp: BinaryIO,
+    to: str,
+    subject: str,
+    body: str,
+    from_email: Optional[str] = None,
+    attachments: Optional[List[Attachment]] = None,
+) -> None:
+    """Escribe el mensaje RFC 822 en fp (binario, CRLF)."""
+    if from_email:
+        fp.write(_header("From", from_email))
+    fp.write(_header("To", to))
+    fp.write(_header("Subject", subject))
+    fp.write(_header("Date", formatdate(localtime=True)))
+    fp.write(b"MIME-Version: 1.0\r\n")
+    text_headers = b'Content-Type: text/plain; charset="utf-8"\r\nContent-Transfer-Encoding: base64\r\n\r\n'
+    if not attachments:
+        fp.write(text_headers)
+        _write_base64(fp, body.encode("utf-8"))
+        return
+
+    boundary = f"=_{uuid.uuid4().hex}".encode("ascii")
+    fp.write(b'Content-Type: multipart/mixed; boundary="' + boundary + b'"\r\n\r\n')
+    fp.write(b"--" + boundary + b"\r\n" + text_headers)
+    _write_base64(fp, body.encode("utf-8"))
+    for att in attachments:
+        fp.write(b"--" + boundary + b"\r\n")
+        fp.write(f"Content-Type: {att.mimetype}\r\n".encode("ascii"))
+        fp.write(f"Content-Disposition: attachment; {_filename_params(att.filename)}\r\n".encode("ascii"))
+        fp.write(b"Content-Transfer-Encoding: base64\r\n\r\n")
+        _write_base64_file(fp, att.path)
+    fp.write(b"--" + boundary + b"--\r\n")
+
+
+def message_size_estimate(body: str, attachments: List[Attachment]) -> int:
+    """Tamaño aproximado del mensaje codificado (base64 + CRLF), sin construirlo."""
+    payload = len(body.encode("utf-8")) + sum(os.path.getsize(a.path) for a in attachments)
+    return payload * 78 // 57 + 1024 * (len(attachments) + 1)
+
+
+def build_message_file(
+    to: str,
+    subject: str,
+    body: str,
+    from_email: Optional[str],
+    attachments: List[Attachment],
+) -> str:
+    """Escribe el mensaje en un archivo temporal de DATA_DIR y devuelve su ruta (la borra quien envía)."""
+    os.makedirs(pdf_cache.TMP_DIR, exist_ok=True)
+    path = os.path.join(pdf_cache.TMP_DIR, f"mail-{uuid.uuid4().hex}.eml")
+    try:
+        with open(path, "wb") as fp:
+            write_message(fp, to, subject, body, from_email, attachments)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
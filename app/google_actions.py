@@ -1,36 +1,260 @@
-
 # app/google_actions.py
 import base64
+import hashlib
+import io
+import json
 import os
-from typing import List, Optional
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from fastapi import APIRouter, Request, HTTPException
 from pydantic import BaseModel, EmailStr
-from googleapiclient.discovery import build
+
+from . import calendar_cache, gmail_mime
+from .doc_store import doc_store
+from .google_oauth import get_credentials
+from .metrics import span
 
 router = APIRouter()
 
+
+# -------- Caché de servicios --------
+# Los documentos de discovery vienen empaquetados con google-api-python-client:
+# se parsean una sola vez por API y nunca se descargan en el camino caliente.
+_discovery_docs: Dict[Tuple[str, str], dict] = {}
+_discovery_lock = threading.Lock()
+# Servicios ya construidos por (api, versión, identidad de credencial), LRU acotado.
+# httplib2 no es thread-safe: el servicio se comparte entre hilos y cada hilo usa su propio
+# transporte (ver _ThreadLocalHttp).
+SERVICE_CACHE_MAX = int(os.getenv("GOOGLE_SERVICE_CACHE_MAX", "64"))
+_services: "OrderedDict[tuple, tuple]" = OrderedDict()
+_services_lock = threading.Lock()
+_build_lock = threading.Lock()
+# Transporte alternativo: factory(creds) -> objeto tipo httplib2.Http (stubs locales en benchmarks)
+_http_factory = None
+
+
+def get_discovery_doc(api: str, version: str) -> dict:
+    key = (api, version)
+    doc = _discovery_docs.get(key)
+    if doc is None:
+        with _discovery_lock:
+            doc = _discovery_docs.get(key)
+            if doc is None:
+                from googleapiclient.discovery_cache import get_static_doc
+                raw = get_static_doc(api, version)
+                if raw is None:
+                    raise RuntimeError(f"No hay documento de discovery empaquetado para {api} {version}")
+                doc = _discovery_docs[key] = json.loads(raw)
+    return doc
+
+
+def preload_discovery_docs() -> None:
+    """Carga por adelantado los documentos de las APIs que usamos."""
+    get_discovery_doc("gmail", "v1")
+    get_discovery_doc("calendar", "v3")
+
+
+def warm_up() -> None:
+    """Importa el cliente de Google y parsea los discovery por adelantado (arranque de la app)."""
+    import googleapiclient.discovery  # noqa: F401
+    preload_discovery_docs()
+
+
+def _creds_identity(creds) -> str:
+    """Identidad estable de una credencial (mismo usuario/cliente aunque se refresque el token)."""
+    refresh_token = getattr(creds, "refresh_token", None) or ""
+    client_id = getattr(creds, "client_id", None) or ""
+    if not refresh_token:
+        return f"obj:{id(creds)}"
+    return hashlib.sha256(f"{client_id}:{refresh_token}".encode("utf-8")).hexdigest()
+
+
+class _ThreadLocalHttp:
+    """Transporte tipo httplib2 que delega en uno propio de cada hilo, creado con make()."""
+
+    def __init__(self, make):
+        self._make = make
+        self._local = threading.local()
+
+    def _http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = self._local.http = self._make()
+        return http
+
+    def request(self, *args, **kwargs):
+        return self._http().request(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._http(), name)
+
+
+def _authorized_http(creds):
+    import google_auth_httplib2
+    from googleapiclient.http import build_http
+    return google_auth_httplib2.AuthorizedHttp(creds, http=build_http())
+
+
+def get_service(api: str, version: str, creds):
+    """
+    Servicio de googleapiclient cacheado por API y credencial, compartido entre hilos.
+    Se reconstruye cuando cambia el objeto de credenciales o su access token (refresh).
+    """
+    key = (api, version, _creds_identity(creds))
+    token = getattr(creds, "token", None)
+
+    def lookup():
+        with _services_lock:
+            cached = _services.get(key)
+            if cached and cached[0] is creds and cached[1] == token:
+                _services.move_to_end(key)
+                return cached[2]
+        return None
+
+    service = lookup()
+    if service is not None:
+        return service
+    with _build_lock:  # los hilos que llegan a la vez esperan el mismo build
+        service = lookup()
+        if service is not None:
+            return service
+        from googleapiclient.discovery import build_from_document
+        doc = get_discovery_doc(api, version)
+        factory = _http_factory or _authorized_http
+        service = build_from_document(doc, http=_ThreadLocalHttp(lambda: factory(creds)))
+        with _services_lock:
+            _services[key] = (creds, token, service)
+            _services.move_to_end(key)
+            while len(_services) > SERVICE_CACHE_MAX:
+                _services.popitem(last=False)
+    return service
+
+
+def set_http_factory(factory) -> None:
+    """Usa factory(creds) como transporte HTTP de los servicios (None = transporte autorizado normal)."""
+    global _http_factory
+    _http_factory = factory
+    invalidate_services()
+
+
+def invalidate_services(creds=None) -> None:
+    """Descarta los servicios cacheados (de una credencial o todos)."""
+    with _services_lock:
+        if creds is None:
+            _services.clear()
+            return
+        identity = _creds_identity(creds)
+        for key in [k for k in _services if k[2] == identity]:
+            del _services[key]
+
+
+class CredentialsError(Exception):
+    """No hay credenciales de Google válidas."""
+
+
+def _require_creds(creds):
+    if not creds or not creds.valid:
+        raise CredentialsError("No hay credenciales Google válidas. Conecta en /auth/google.")
+    return creds
+
+
+def _request_creds(request: Request):
+    try:
+        return _require_creds(get_credentials())
+    except CredentialsError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+
+
 # -------- Gmail --------
+# Mensajes con adjuntos de hasta GMAIL_RESUMABLE_THRESHOLD van como raw en el JSON de
+# messages.send; los más grandes se suben como message/rfc822 con subida reanudable, por
+# bloques de GMAIL_UPLOAD_CHUNK_BYTES: la memoria por envío no depende del tamaño del adjunto.
+GMAIL_MAX_MESSAGE_BYTES = 35 * 1024 * 1024  # límite de Gmail para mensajes subidos
+GMAIL_RESUMABLE_THRESHOLD = int(os.getenv("GMAIL_RESUMABLE_THRESHOLD", str(2 * 1024 * 1024)))
+_UPLOAD_CHUNK_UNIT = 256 * 1024  # la subida reanudable exige múltiplos de 256 KiB
+GMAIL_UPLOAD_CHUNK_BYTES = max(
+    int(os.getenv("GMAIL_UPLOAD_CHUNK_BYTES", str(2 * 1024 * 1024))) // _UPLOAD_CHUNK_UNIT, 1
+) * _UPLOAD_CHUNK_UNIT
+
+
 class GmailMessage(BaseModel):
     to: EmailStr
     subject: str
     body: str
     from_email: Optional[EmailStr] = None  # opcional: alias remitente
+    attach_doc_ids: Optional[List[str]] = None  # PDFs subidos a la sesión que se adjuntan
+    session_id: Optional[str] = None  # requerido con attach_doc_ids
 
-@router.post("/gmail/send")
-def gmail_send(msg: GmailMessage, request: Request):
-    creds = getattr(request.app.state, "google_creds", None)
-    if not creds or not creds.valid:
-        raise HTTPException(status_code=401, detail="No hay credenciales Google válidas. Conecta en /auth/google.")
 
-    service = build("gmail", "v1", credentials=creds)
-    # Construye MIME simple
-    raw_msg = f"From: {msg.from_email or 'me'}\nTo: {msg.to}\nSubject: {msg.subject}\n\n{msg.body}"
-    encoded = base64.urlsafe_b64encode(raw_msg.encode("utf-8")).decode("utf-8")
-    create_body = {"raw": encoded}
+def _gmail_body(msg: GmailMessage) -> Dict:
+    """Mensaje de solo texto como raw (cabe en memoria: no tiene adjuntos)."""
+    buffer = io.BytesIO()
+    gmail_mime.write_message(buffer, msg.to, msg.subject, msg.body, msg.from_email)
+    return {"raw": base64.urlsafe_b64encode(buffer.getvalue()).decode("ascii")}
+
+
+def _gmail_attachments(msg: GmailMessage) -> List[gmail_mime.Attachment]:
+    """Resuelve los doc_id de la sesión a los PDFs guardados en DATA_DIR."""
+    if not msg.attach_doc_ids:
+        return []
+    if not msg.session_id:
+        raise ValueError("Para adjuntar documentos hace falta session_id")
+    attachments = []
+    for doc_id in msg.attach_doc_ids:
+        doc = doc_store.get(msg.session_id, doc_id)
+        if not doc or not os.path.exists(doc["pdf_path"]):
+            raise ValueError(f"El documento {doc_id} no está disponible en la sesión")
+        attachments.append(gmail_mime.Attachment(doc["pdf_path"], doc["filename"], "application/pdf"))
+    return attachments
+
+
+def _send_message_file(service, path: str) -> Dict:
+    size = os.path.getsize(path)
+    messages = service.users().messages()
+    if size <= GMAIL_RESUMABLE_THRESHOLD:
+        with open(path, "rb") as f:
+            raw = base64.urlsafe_b64encode(f.read()).decode("ascii")
+        with span("google", api="gmail", method="messages.send"):
+            return messages.send(userId="me", body={"raw": raw}).execute()
+
+    from googleapiclient.http import MediaFileUpload
+    media = MediaFileUpload(path, mimetype="message/rfc822", chunksize=GMAIL_UPLOAD_CHUNK_BYTES, resumable=True)
+    request = messages.send(userId="me", body={}, media_body=media)
+    sent = None
+    with span("google", api="gmail", method="messages.send.upload"):
+        while sent is None:
+            _, sent = request.next_chunk()
+    return sent
+
+
+def send_gmail(creds, msg: GmailMessage) -> Dict:
+    """Capa de servicio: envía el correo con las credenciales dadas (sin pasar por HTTP)."""
+    service = get_service("gmail", "v1", _require_creds(creds))
+    attachments = _gmail_attachments(msg)
+    if not attachments:
+        # users.messages.send (userId='me' indica el usuario autenticado) [8](https://developers.google.com/workspace/gmail/api/reference/rest/v1/users.messages/send)
+        with span("google", api="gmail", method="messages.send"):
+            sent = service.users().messages().send(userId="me", body=_gmail_body(msg)).execute()
+        return {"messageId": sent.get("id")}
+
+    if gmail_mime.message_size_estimate(msg.body, attachments) > GMAIL_MAX_MESSAGE_BYTES:
+        raise ValueError(f"El correo con adjuntos supera el límite de Gmail ({GMAIL_MAX_MESSAGE_BYTES // (1024 * 1024)} MB)")
+    path = gmail_mime.build_message_file(msg.to, msg.subject, msg.body, msg.from_email, attachments)
+    try:
+        sent = _send_message_file(service, path)
+    finally:
+        os.remove(path)
+    return {"messageId": sent.get("id"), "attachments": [a.filename for a in attachments]}
 
-    # users.messages.send (userId='me' indica el usuario autenticado) [8](https://developers.google.com/workspace/gmail/api/reference/rest/v1/users.messages/send)
-    sent = service.users().messages().send(userId="me", body=create_body).execute()
-    return {"messageId": sent.get("id")}
+
+@router.post("/gmail/send")
+def gmail_send(msg: GmailMessage, request: Request):
+    creds = _request_creds(request)
+    try:
+        return send_gmail(creds, msg)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 
 # -------- Calendar --------
@@ -43,14 +267,9 @@ class CalendarEvent(BaseModel):
     timezone: Optional[str] = os.getenv("TZ", "America/Mazatlan")
     attendees: Optional[List[EmailStr]] = None
 
-@router.post("/calendar/event")
-def calendar_event(ev: CalendarEvent, request: Request):
-    creds = getattr(request.app.state, "google_creds", None)
-    if not creds or not creds.valid:
-        raise HTTPException(status_code=401, detail="No hay credenciales Google válidas. Conecta en /auth/google.")
 
-    service = build("calendar", "v3", credentials=creds)
-    body = {
+def _event_body(ev: CalendarEvent) -> Dict:
+    return {
         "summary": ev.summary,
         "description": ev.description,
         "location": ev.location,
@@ -58,7 +277,170 @@ def calendar_event(ev: CalendarEvent, request: Request):
         "end": {"dateTime": ev.end_datetime, "timeZone": ev.timezone},
         "attendees": [{"email": a} for a in (ev.attendees or [])],
     }
+
+
+def create_calendar_event(creds, ev: CalendarEvent) -> Dict:
+    """Capa de servicio: crea el evento con las credenciales dadas (sin pasar por HTTP)."""
+    service = get_service("calendar", "v3", _require_creds(creds))
     # events.insert sobre el calendarId 'primary' requiere el scope de Calendar. [2](https://developers.google.com/workspace/calendar/api/guides/create-events)
-    created = service.events().insert(calendarId="primary", body=body).execute()
+    with span("google", api="calendar", method="events.insert"):
+        created = service.events().insert(calendarId="primary", body=_event_body(ev)).execute()
+    calendar_cache.invalidate(_creds_identity(creds))
     return {"eventId": created.get("id"), "htmlLink": created.get("htmlLink")}
 
+
+@router.post("/calendar/event")
+def calendar_event(ev: CalendarEvent, request: Request):
+    return create_calendar_event(_request_creds(request), ev)
+
+
+# -------- Calendar: lectura y disponibilidad (caché local, ver calendar_cache) --------
+_WORKDAY_START, _WORKDAY_END = calendar_cache.WORKDAY.split("-")
+
+
+class CalendarRange(BaseModel):
+    time_min: str  # RFC3339
+    time_max: str  # RFC3339
+
+
+class FreeSlotsQuery(CalendarRange):
+    duration_minutes: int = 30
+    workday_start: str = _WORKDAY_START  # "HH:MM" en la zona del calendario
+    workday_end: str = _WORKDAY_END
+    max_slots: int = 10
+
+
+def _calendar_index(creds, t0: float, t1: float) -> calendar_cache.IntervalIndex:
+    creds = _require_creds(creds)
+    cache = calendar_cache.cache_for(_creds_identity(creds))
+    return cache.index(lambda: get_service("calendar", "v3", creds), t0, t1)
+
+
+def _range_bounds(q: CalendarRange) -> Tuple[float, float]:
+    t0 = calendar_cache.parse_datetime(q.time_min).timestamp()
+    t1 = calendar_cache.parse_datetime(q.time_max).timestamp()
+    if t1 <= t0:
+        raise ValueError("time_max debe ser posterior a time_min")
+    return t0, t1
+
+
+def list_calendar_events(creds, q: CalendarRange) -> Dict:
+    """Capa de servicio: eventos que se superponen con el rango, desde la caché local."""
+    t0, t1 = _range_bounds(q)
+    index = _calendar_index(creds, t0, t1)
+    return {"events": index.summaries(t0, t1)}
+
+
+def find_free_slots(creds, q: FreeSlotsQuery) -> Dict:
+    """Capa de servicio: huecos libres de al menos duration_minutes en el horario laboral."""
+    t0, t1 = _range_bounds(q)
+    workday = (calendar_cache.parse_hhmm(q.workday_start), calendar_cache.parse_hhmm(q.workday_end))
+    index = _calendar_index(creds, t0, t1)
+    slots = index.free_slots(t0, t1, q.duration_minutes * 60, workday, q.max_slots)
+    return {"slots": [
+        {"start": calendar_cache.format_ts(s), "end": calendar_cache.format_ts(e), "minutes": int((e - s) // 60)}
+        for s, e in slots
+    ]}
+
+
+@router.post("/calendar/events/list")
+def calendar_list_events(q: CalendarRange, request: Request):
+    try:
+        return list_calendar_events(_request_creds(request), q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/calendar/free_slots")
+def calendar_free_slots(q: FreeSlotsQuery, request: Request):
+    try:
+        return find_free_slots(_request_creds(request), q)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/calendar/cache/stats")
+def calendar_cache_stats():
+    """Sincronizaciones completas e incrementales, ventana listada y eventos en la caché local."""
+    return calendar_cache.stats()
+
+
+# -------- Lotes (batch HTTP de Google) --------
+# Google recomienda no más de 50 llamadas por lote; listas más largas se parten en varios lotes.
+BATCH_LIMIT = 50
+
+
+class GmailBatch(BaseModel):
+    messages: List[GmailMessage]
+
+
+class CalendarEventsBatch(BaseModel):
+    events: List[CalendarEvent]
+
+
+def _execute_batch(service, api: str, requests: list, on_success, http=None) -> List[Dict]:
+    """
+    Ejecuta los requests en lotes HTTP y devuelve un resultado por elemento, en orden.
+    `http` permite sustituir el transporte (p. ej. un HttpMockSequence en pruebas).
+    """
+    results: List[Optional[Dict]] = [None] * len(requests)
+
+    def callback(request_id, response, exception):
+        i = int(request_id)
+        if exception is not None:
+            results[i] = {"index": i, "ok": False, "error": str(exception)}
+        else:
+            results[i] = {"index": i, "ok": True, **on_success(response)}
+
+    for offset in range(0, len(requests), BATCH_LIMIT):
+        batch = service.new_batch_http_request(callback=callback)
+        for i, req in enumerate(requests[offset:offset + BATCH_LIMIT], start=offset):
+            batch.add(req, request_id=str(i))
+        with span("google", api=api, method="batch"):
+            batch.execute(http=http)
+    return [r or {"index": i, "ok": False, "error": "Sin respuesta"} for i, r in enumerate(results)]
+
+
+def send_gmail_batch(creds, batch: GmailBatch, http=None) -> Dict:
+    """Capa de servicio: envía varios correos en un solo intercambio batch."""
+    if any(m.attach_doc_ids for m in batch.messages):
+        raise ValueError("Los correos con adjuntos se envían de uno en uno con /gmail/send")
+    service = get_service("gmail", "v1", _require_creds(creds))
+    messages = service.users().messages()
+    requests = [messages.send(userId="me", body=_gmail_body(m)) for m in batch.messages]
+    results = _execute_batch(service, "gmail", requests, lambda sent: {"messageId": sent.get("id")}, http=http)
+    for item, msg in zip(results, batch.messages):
+        item["to"] = msg.to
+    return {"results": results}
+
+
+def create_calendar_events_batch(creds, batch: CalendarEventsBatch, http=None) -> Dict:
+    """Capa de servicio: crea varios eventos en un solo intercambio batch."""
+    service = get_service("calendar", "v3", _require_creds(creds))
+    events = service.events()
+    requests = [events.insert(calendarId="primary", body=_event_body(ev)) for ev in batch.events]
+    results = _execute_batch(
+        service,
+        "calendar",
+        requests,
+        lambda created: {"eventId": created.get("id"), "htmlLink": created.get("htmlLink")},
+        http=http,
+    )
+    for item, ev in zip(results, batch.events):
+        item["summary"] = ev.summary
+    calendar_cache.invalidate(_creds_identity(creds))
+    return {"results": results}
+
+
+@router.post("/gmail/send_batch")
+def gmail_send_batch(batch: GmailBatch, request: Request):
+    creds = _request_creds(request)
+    try:
+        return send_gmail_batch(creds, batch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post("/calendar/events_batch")
+def calendar_events_batch(batch: CalendarEventsBatch, request: Request):
+    return create_calendar_events_batch(_request_creds(request), batch)
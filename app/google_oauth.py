@@ -3,8 +3,8 @@
 import os
 from fastapi import APIRouter, Request
 from fastapi.responses import RedirectResponse
-from google_auth_oauthlib.flow import Flow
-from google.oauth2.credentials import Credentials
+
+from .credentials import TOKEN_URI, credential_manager
 
 router = APIRouter()
 
@@ -18,6 +18,16 @@ SCOPES = [
     "https://www.googleapis.com/auth/calendar",     # crear eventos
 ]
 
+# Credenciales actuales, compartidas con las tools del agente (modo direct).
+# Las persiste y refresca el gestor de credenciales (ver credentials.py).
+def get_credentials():
+    return credential_manager.get()
+
+
+def set_credentials(creds) -> None:
+    credential_manager.set(creds)
+
+
 def _client_config():
     # Formato esperado por google_auth_oauthlib
     return {
@@ -25,7 +35,7 @@ def _client_config():
             "client_id": CLIENT_ID,
             "project_id": "langchain-assistant",
             "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
+            "token_uri": TOKEN_URI,
             "client_secret": CLIENT_SECRET,
             "redirect_uris": [REDIRECT_URI],
             "javascript_origins": [],  # puedes agregar tu frontend
@@ -34,6 +44,7 @@ def _client_config():
 
 @router.get("/auth/google")
 def auth_google():
+    from google_auth_oauthlib.flow import Flow
     flow = Flow.from_client_config(_client_config(), scopes=SCOPES, redirect_uri=REDIRECT_URI)
     auth_url, state = flow.authorization_url(
         access_type="offline",
@@ -46,10 +57,11 @@ def auth_google():
 @router.get("/oauth2/callback")
 def oauth2_callback(request: Request):
     # Intercambia el código por tokens
+    from google_auth_oauthlib.flow import Flow
     flow = Flow.from_client_config(_client_config(), scopes=SCOPES, redirect_uri=REDIRECT_URI)
     flow.fetch_token(authorization_response=str(request.url))
     creds = flow.credentials
 
-    # Guarda tokens en memoria (demo) o DB; aquí como atributo global de app
-    request.app.state.google_creds = creds
+    # Guarda los tokens en el almacén compartido (visible para todos los workers)
+    set_credentials(creds)
     return RedirectResponse(url="https://ui.ponganos10.online/")
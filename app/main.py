@@ -1,17 +1,69 @@
 
 # app/main.py
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+from fastapi import FastAPI, Form, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from .agent import answer_sync  # usa la versión con session_id
+from . import agent
+from .agent import answer_async, answer_stream, get_cache_stats, get_context_stats  # usa la versión con session_id
 from .google_oauth import router as oauth_router
-from .google_actions import router as actions_router
-from .pdf_ingest import save_pdf_and_text
-from .agent_tools import pdf_storage  # Almacén compartido para PDFs
+from .google_actions import router as actions_router, warm_up as warm_up_google
+from . import pdf_cache
+from .pdf_ingest import (
+    complete_job, create_job, get_job, new_upload_path, run_ingest_job, shutdown_pool, stream_upload_to_disk,
+)
+from .agent_tools import aclose_http_clients
+from .credentials import credential_manager
+from .doc_store import doc_store  # Documentos por sesión
+from .metrics import render as render_metrics, request_context, span, summarize_timings
+from .pdf_summarize import summarize_document, summary_stats
+from .scheduler import Overloaded, scheduler
+
+logger = logging.getLogger("app.main")
+
+# Estado del calentamiento: /health responde desde el arranque, /health/ready cuando termina
+_readiness = {"ready": False, "warmup_ms": None, "errors": {}}
+
+
+def _pdf_warm_up() -> None:
+    import PyPDF2  # noqa: F401
+
+
+def _warm_up() -> None:
+    """Paga en segundo plano lo que si no pagaría el primer usuario: agente, tools, cliente de Google, PyPDF2."""
+    t0 = time.perf_counter()
+    for name, step in (("agent", agent.warm_up), ("google", warm_up_google), ("pdf", _pdf_warm_up)):
+        try:
+            step()
+        except Exception as e:
+            logger.warning("warm-up %s falló: %s", name, e)
+            _readiness["errors"][name] = str(e)
+    _readiness["warmup_ms"] = round((time.perf_counter() - t0) * 1000, 3)
+    _readiness["ready"] = "agent" not in _readiness["errors"]
 
-app = FastAPI(title="Agente Gemini + LangChain")
-app.state.google_creds = None  # guardaremos las credenciales aquí
-app.state.pdf_content = None   # contenido del PDF actual en memoria
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup = asyncio.create_task(asyncio.to_thread(_warm_up))
+    refresher = asyncio.create_task(credential_manager.run_refresher())  # token de Google siempre vigente
+    yield
+    refresher.cancel()
+    if not warmup.done():
+        warmup.cancel()
+    shutdown_pool()
+    await aclose_http_clients()
+
+
+app = FastAPI(title="Agente Gemini + LangChain", lifespan=lifespan)
+
+PDF_CONTENT_MAX_PAGES = 50  # páginas máximas por respuesta de /pdf/content
 
 origins = ["https://ui.ponganos10.online"]
 app.add_middleware(
@@ -25,68 +77,225 @@ app.add_middleware(
 class Query(BaseModel):
     session_id: str   # <--- NUEVO
     input: str
+    timings: bool = False  # incluir el desglose de tiempos en la respuesta
 
 @app.get("/health")
 def health():
-    return {"status": "ok"}
+    """Liveness: el proceso responde (aunque el calentamiento no haya terminado)."""
+    return {"status": "ok", "ready": _readiness["ready"]}
+
+
+@app.get("/health/ready")
+def health_ready():
+    """Readiness: 200 cuando el agente ya está construido, 503 mientras tanto."""
+    return JSONResponse(_readiness, status_code=200 if _readiness["ready"] else 503)
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
 
 @app.post("/agent/invoke")
-def invoke(q: Query):
+async def invoke(q: Query):
+    t0 = time.perf_counter()
     try:
-        output = answer_sync(q.session_id, q.input)  # <--- pasa session_id
-        return {"output": output}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        # Un turno a la vez por sesión; si la cola está llena, 429/503 con Retry-After
+        async with scheduler.session_turn(q.session_id):
+            with request_context(q.session_id, q.timings) as timings, span("agent", endpoint="invoke"):
+                try:
+                    output = await answer_async(q.session_id, q.input)  # <--- pasa session_id
+                except Exception as e:
+                    raise HTTPException(status_code=500, detail=str(e))
+    except Overloaded as e:
+        raise _overloaded(e)
+    response = {"output": output}
+    if timings is not None:
+        response["timings"] = summarize_timings(timings, time.perf_counter() - t0)
+    return response
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+@app.post("/agent/stream")
+async def invoke_stream(q: Query):
+    """Igual que /agent/invoke, pero emite tokens y eventos de tools como Server-Sent Events."""
+    # El rechazo tiene que ocurrir antes de abrir el stream para poder responder 429/503
+    try:
+        scheduler.check_admission(q.session_id)
+    except Overloaded as e:
+        raise _overloaded(e)
+
+    async def events():
+        try:
+            async with scheduler.session_turn(q.session_id):
+                with request_context(q.session_id), span("agent", endpoint="stream") as labels:
+                    try:
+                        async for ev in answer_stream(q.session_id, q.input):
+                            yield _sse(ev["event"], ev["data"])
+                    except Exception as e:
+                        labels["status"] = "error"
+                        yield _sse("error", {"detail": str(e)})
+        except Overloaded as e:
+            yield _sse("error", {"detail": e.detail, "retry_after": e.retry_after})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics")
+def metrics():
+    """Histogramas y contadores del camino caliente en formato Prometheus."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/agent/scheduler")
+def scheduler_stats():
+    """Turnos en espera y en ejecución del control de admisión."""
+    return scheduler.stats()
+
+
+@app.get("/agent/cache/stats")
+def cache_stats():
+    """Aciertos de la caché de respuestas (RESPONSE_CACHE=1) y de pdf_query."""
+    return get_cache_stats()
+
+
+@app.get("/agent/context_stats")
+def context_stats():
+    """Caracteres de prompt ahorrados por no reinyectar el PDF en cada turno."""
+    return get_context_stats()
 
 # --- PDF Upload ---
-@app.post("/pdf/upload")
-async def upload_pdf(file: UploadFile = File(...)):
-    """Sube un PDF y extrae su texto para que el agente pueda consultarlo."""
+_background_tasks = set()
+
+
+def _register_pdf(session_id: str, filename: str, result: dict) -> None:
+    """Asocia el PDF ya procesado a la sesión; el texto se queda en disco."""
+    doc_store.register(session_id, filename, result)
+
+
+@app.post("/pdf/upload", status_code=202)
+async def upload_pdf(session_id: str = Form(...), file: UploadFile = File(...)):
+    """
+    Sube un PDF y devuelve de inmediato un job_id; la extracción corre en segundo plano.
+    El progreso se consulta en /pdf/upload/{job_id}/status.
+    """
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Solo se permiten archivos PDF")
-    
+
+    filename = os.path.basename(file.filename)
+    # Los spans de la subida y de la ingesta en segundo plano (la tarea copia el contexto) llevan la sesión
+    with request_context(session_id):
+        return await _upload_pdf(session_id, filename, file)
+
+
+async def _upload_pdf(session_id: str, filename: str, file: UploadFile) -> dict:
     try:
-        contents = await file.read()
-        result = save_pdf_and_text(contents, file.filename)
-        
-        # Leer el texto extraído y guardarlo en memoria
-        with open(result["txt_path"], "r", encoding="utf-8") as f:
-            pdf_data = {
-                "filename": file.filename,
-                "text": f.read(),
-                "pages": result["pages"],
-            }
-            app.state.pdf_content = pdf_data
-            # También actualizar el almacén compartido para las tools
-            pdf_storage["content"] = pdf_data
-        
-        return {
-            "message": f"PDF '{file.filename}' procesado correctamente",
-            "pages": result["pages"],
-            "bytes": result["bytes"],
-        }
+        pdf_path = new_upload_path()
+        stored = await stream_upload_to_disk(file, pdf_path)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al procesar PDF: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al guardar PDF: {str(e)}")
 
+    job_id = create_job(filename)
+    response = {
+        "job_id": job_id,
+        "status_url": f"/pdf/upload/{job_id}/status",
+        "bytes": stored["bytes"],
+    }
 
-@app.get("/pdf/status")
-def pdf_status():
-    """Verifica si hay un PDF cargado."""
-    if app.state.pdf_content:
+    # Mismo contenido ya procesado: respuesta inmediata sin volver a extraer
+    cached = pdf_cache.lookup(stored["sha256"])
+    if cached:
+        os.remove(pdf_path)
+        _register_pdf(session_id, filename, cached)
+        complete_job(job_id, cached)
         return {
-            "loaded": True,
-            "filename": app.state.pdf_content["filename"],
-            "pages": app.state.pdf_content["pages"],
+            **response,
+            "message": f"PDF '{filename}' procesado correctamente (caché)",
+            "status": "done",
+            "doc_id": cached["doc_id"],
+            "pages": cached["pages"],
         }
-    return {"loaded": False}
+
+    task = asyncio.create_task(asyncio.to_thread(
+        run_ingest_job, job_id, pdf_path, filename,
+        sha256=stored["sha256"],
+        on_done=lambda result: _register_pdf(session_id, filename, result),
+        check_cache=False,
+    ))
+    _background_tasks.add(task)  # referencia fuerte hasta que termine
+    task.add_done_callback(_background_tasks.discard)
+    return {**response, "message": f"PDF '{filename}' recibido, procesando", "status": "queued"}
+
+
+@app.get("/pdf/upload/{job_id}/status")
+def upload_status(job_id: str):
+    """Progreso por página de un job de ingesta."""
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    result = job.pop("result")
+    if result:
+        job.update({"doc_id": result["doc_id"], "pages": result["pages"], "bytes": result["bytes"]})
+    return job
+
+
+@app.get("/pdf/status")
+def pdf_status(session_id: str):
+    """Documentos cargados en la sesión."""
+    docs = doc_store.list(session_id)
+    return {
+        "loaded": bool(docs),
+        "documents": [{"doc_id": d["doc_id"], "filename": d["filename"], "pages": d["pages"]} for d in docs],
+    }
+
+
+@app.get("/pdf/cache/stats")
+def pdf_cache_stats():
+    """Aciertos/fallos y desalojos del almacén de PDFs por contenido."""
+    return {**pdf_cache.stats(), "documents": doc_store.stats(), "summaries": summary_stats()}
 
 
 @app.get("/pdf/content")
-def pdf_content():
-    """Retorna el contenido del PDF para que el agente lo consulte."""
-    if not app.state.pdf_content:
+def pdf_content(session_id: str, doc_id: Optional[str] = None, start: int = 1, end: Optional[int] = None):
+    """Texto de un rango de páginas de un documento de la sesión (por defecto, del último subido)."""
+    doc = doc_store.get(session_id, doc_id)
+    if not doc:
+        raise HTTPException(status_code=404, detail="No hay PDF cargado")
+    end = min(end or doc["pages"], doc["pages"], start + PDF_CONTENT_MAX_PAGES - 1)
+    try:
+        pages = doc_store.read_pages(doc, start, end)
+    except FileNotFoundError:
+        raise HTTPException(status_code=410, detail="El PDF ya no está disponible, vuelve a subirlo")
+    return {
+        "doc_id": doc["doc_id"],
+        "filename": doc["filename"],
+        "pages": doc["pages"],
+        "content": [{"page": p, "text": t} for p, t in sorted(pages.items())],
+    }
+
+
+class SummarizeRequest(BaseModel):
+    session_id: str
+    doc_id: Optional[str] = None  # por defecto, el último subido
+
+
+@app.post("/pdf/summarize")
+async def pdf_summarize(req: SummarizeRequest):
+    """Resumen map-reduce del documento completo; los resúmenes parciales quedan en caché en disco."""
+    doc = doc_store.get(req.session_id, req.doc_id)
+    if not doc:
         raise HTTPException(status_code=404, detail="No hay PDF cargado")
-    return app.state.pdf_content
+    with request_context(req.session_id):
+        try:
+            return await summarize_document(doc)
+        except FileNotFoundError:
+            raise HTTPException(status_code=410, detail="El PDF ya no está disponible, vuelve a subirlo")
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 
 # OAuth + acciones
@@ -0,0 +1,292 @@
+# app/metrics.py
+"""
+Instrumentación del camino caliente.
+- Histogramas y contadores en memoria, exportados en formato Prometheus en /metrics.
+- span(): mide un bloque, lo registra en su histograma, lo emite como log estructurado
+  con el session_id actual y lo agrega al desglose por request si está activo.
+El session_id no se usa como etiqueta de Prometheus (cardinalidad): va en los logs y en el desglose.
+La espera por un cupo del límite de llamadas al modelo (scheduler) es su propio span ("llm_queue")
+y no cuenta en la duración de la llamada ("llm").
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger("app.metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Contexto del request en curso (se propaga a tareas e hilos lanzados con asyncio)
+current_session: ContextVar[Optional[str]] = ContextVar("current_session", default=None)
+_current_timings: ContextVar[Optional[List[Dict]]] = ContextVar("current_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+# ---------- Métricas ----------
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_fmt_labels(self.labels, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # {labels: [conteo por bucket..., suma, total]}
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labels)
+        with self._lock:
+            data = self._values.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, data in sorted(self._values.items()):
+                for i, bound in enumerate(self.buckets):
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {data[i]}")
+                le = 'le="+Inf"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {data[-1]}")
+                lines.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {data[-2]}")
+                lines.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {data[-1]}")
+        return lines
+
+
+_registry: List = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """Todas las métricas en formato de exposición de texto de Prometheus."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+LLM_DURATION = _register(Histogram("llm_call_duration_seconds", "Duración de cada llamada al modelo en el loop ReAct", ["model"]))
+LLM_QUEUE = _register(Histogram("llm_queue_wait_seconds", "Espera de un cupo del límite global antes de llamar al modelo", ["model"]))
+LLM_TOKENS = _register(Counter("llm_tokens_total", "Tokens consumidos por el modelo", ["model", "kind"]))
+LLM_ERRORS = _register(Counter("llm_call_errors_total", "Llamadas al modelo con error", ["model"]))
+TOOL_DURATION = _register(Histogram("tool_call_duration_seconds", "Duración de cada invocación de tool", ["tool", "status"]))
+GOOGLE_DURATION = _register(Histogram("google_api_duration_seconds", "Duración de cada llamada a APIs de Google", ["api", "method", "status"]))
+INGEST_DURATION = _register(Histogram("pdf_ingest_stage_duration_seconds", "Duración de cada etapa de ingesta de PDFs", ["stage"]))
+AGENT_DURATION = _register(Histogram("agent_request_duration_seconds", "Duración total de cada turno del agente", ["endpoint", "status"]))
+
+_SPAN_METRICS = {
+    "llm": LLM_DURATION,
+    "llm_queue": LLM_QUEUE,
+    "tool": TOOL_DURATION,
+    "google": GOOGLE_DURATION,
+    "ingest": INGEST_DURATION,
+    "agent": AGENT_DURATION,
+}
+
+
+# ---------- Spans ----------
+def record(kind: str, seconds: float, **labels) -> None:
+    """Registra una duración ya medida: histograma, log estructurado y desglose del request."""
+    metric = _SPAN_METRICS[kind]
+    metric.observe(seconds, **labels)
+    session_id = current_session.get()
+    entry = {"span": kind, "ms": round(seconds * 1000, 3), **labels}
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.append(entry)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps({**entry, "session_id": session_id}, ensure_ascii=False, default=str))
+
+
+@contextmanager
+def span(kind: str, **labels) -> Iterator[Dict]:
+    """
+    Mide el bloque. Las etiquetas pueden completarse dentro del bloque
+    (p. ej. labels["status"] = "error") a través del dict que se entrega.
+    """
+    if "status" in _SPAN_METRICS[kind].labels:
+        labels.setdefault("status", "ok")
+    t0 = time.perf_counter()
+    try:
+        yield labels
+    except Exception:
+        if "status" in labels:
+            labels["status"] = "error"
+        raise
+    finally:
+        record(kind, time.perf_counter() - t0, **labels)
+
+
+@contextmanager
+def request_context(session_id: str, collect_timings: bool = False) -> Iterator[Optional[List[Dict]]]:
+    """Fija el session_id (y opcionalmente una lista de desglose) para todo lo que ocurra dentro."""
+    timings: Optional[List[Dict]] = [] if collect_timings else None
+    session_token = current_session.set(session_id)
+    timings_token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        current_session.reset(session_token)
+        _current_timings.reset(timings_token)
+
+
+def current_timings() -> Optional[List[Dict]]:
+    return _current_timings.get()
+
+
+def summarize_timings(timings: List[Dict], total_seconds: float) -> Dict:
+    """Desglose por request: total, suma por tipo de span y la lista de spans."""
+    by_kind: Dict[str, float] = {}
+    for entry in timings:
+        by_kind[entry["span"]] = round(by_kind.get(entry["span"], 0.0) + entry["ms"], 3)
+    return {"total_ms": round(total_seconds * 1000, 3), "by_kind_ms": by_kind, "spans": timings}
+
+
+# ---------- Espera por cupo del modelo ----------
+# {run_id de la llamada: segundos esperando cupo}: la anota el scheduler y el callback la descuenta
+_llm_queue_waits: "OrderedDict" = OrderedDict()
+_llm_queue_lock = threading.Lock()
+LLM_QUEUE_WAITS_MAX = 4096  # llamadas sin callback de métricas no dejan entradas para siempre
+
+
+def record_llm_queue_wait(run_id, seconds: float, model: str) -> None:
+    record("llm_queue", seconds, model=model)
+    if run_id is None:
+        return
+    with _llm_queue_lock:
+        _llm_queue_waits[run_id] = seconds
+        while len(_llm_queue_waits) > LLM_QUEUE_WAITS_MAX:
+            _llm_queue_waits.popitem(last=False)
+
+
+def _pop_llm_queue_wait(run_id) -> float:
+    with _llm_queue_lock:
+        return _llm_queue_waits.pop(run_id, 0.0)
+
+
+# ---------- Callbacks de LangChain ----------
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """Mide cada llamada al modelo (con tokens) y cada tool invocada por el agente."""
+
+    def __init__(self, model_name: str, session_id: Optional[str] = None, timings: Optional[List[Dict]] = None):
+        self.model_name = model_name
+        self.session_id = session_id
+        self.timings = timings
+        self._starts: Dict = {}
+
+    def _record(self, kind: str, run_id, waited: float = 0.0, **labels) -> None:
+        t0 = self._starts.pop(run_id, None)
+        if t0 is None:
+            return
+        seconds = max(time.perf_counter() - t0 - waited, 0.0)
+        # Los callbacks pueden ejecutarse en otro hilo: se restaura el contexto del request
+        session_token = current_session.set(self.session_id)
+        timings_token = _current_timings.set(self.timings)
+        try:
+            record(kind, seconds, **labels)
+        finally:
+            current_session.reset(session_token)
+            _current_timings.reset(timings_token)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = {}
+        try:
+            usage = response.generations[0][0].message.usage_metadata or {}
+        except (AttributeError, IndexError):
+            pass
+        LLM_TOKENS.inc(usage.get("input_tokens", 0), model=self.model_name, kind="input")
+        LLM_TOKENS.inc(usage.get("output_tokens", 0), model=self.model_name, kind="output")
+        self._record(
+            "llm", run_id, _pop_llm_queue_wait(run_id), model=self.model_name,
+            input_tokens=usage.get("input_tokens", 0), output_tokens=usage.get("output_tokens", 0),
+        )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        LLM_ERRORS.inc(model=self.model_name)
+        self._record("llm", run_id, _pop_llm_queue_wait(run_id), model=self.model_name)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._starts[(run_id, "tool")] = time.perf_counter()
+        self._starts[("name", run_id)] = (serialized or {}).get("name") or kwargs.get("name", "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        name = self._starts.pop(("name", run_id), "tool")
+        text = getattr(output, "content", output)
+        status = "error" if isinstance(text, str) and text.startswith("❌") else "ok"
+        self._record("tool", (run_id, "tool"), tool=name, status=status)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        name = self._starts.pop(("name", run_id), "tool")
+        self._record("tool", (run_id, "tool"), tool=name, status="error")
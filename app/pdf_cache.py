@@ -0,0 +1,139 @@
+# app/pdf_cache.py
+"""
+Almacén direccionado por contenido para PDFs y sus artefactos derivados.
+Cada PDF vive en DATA_DIR/objects/<sha256>/ junto con su .txt, su índice y meta.json.
+El tamaño total está acotado y se desalojan los objetos menos usados (LRU por mtime de meta.json).
+"""
+import json
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+from .pdf_index import index_path_for
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+OBJECTS_DIR = os.path.join(DATA_DIR, "objects")
+TMP_DIR = os.path.join(DATA_DIR, "tmp")
+MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+PDF_NAME = "document.pdf"
+TXT_NAME = "document.txt"
+META_NAME = "meta.json"
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def object_dir(sha256: str) -> str:
+    return os.path.join(OBJECTS_DIR, sha256)
+
+
+def _paths(base: str) -> Dict[str, str]:
+    txt_path = os.path.join(base, TXT_NAME)
+    return {
+        "pdf_path": os.path.join(base, PDF_NAME),
+        "txt_path": txt_path,
+        "index_path": index_path_for(txt_path),
+    }
+
+
+def _result(sha256: str, meta: Dict, cached: bool) -> Dict:
+    return {
+        "doc_id": sha256[:16],
+        "sha256": sha256,
+        **_paths(object_dir(sha256)),
+        "pages": meta["pages"],
+        "bytes": meta["bytes"],
+        "cached": cached,
+    }
+
+
+# ---------- Consulta ----------
+def lookup(sha256: str) -> Optional[Dict]:
+    """Devuelve el resultado de ingesta si el PDF ya está en el almacén (y lo marca como usado)."""
+    meta_path = os.path.join(object_dir(sha256), META_NAME)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        os.utime(meta_path)  # LRU: marca de último uso
+    except (FileNotFoundError, json.JSONDecodeError):
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        _stats["hits"] += 1
+    return _result(sha256, meta, cached=True)
+
+
+def new_staging_dir() -> str:
+    """Directorio temporal donde se construyen los artefactos antes de publicarlos."""
+    path = os.path.join(TMP_DIR, f"{os.getpid()}-{threading.get_ident()}-{time.time_ns()}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def staging_paths(staging: str) -> Dict[str, str]:
+    return _paths(staging)
+
+
+def publish(sha256: str, staging: str, meta: Dict) -> Dict:
+    """Publica atómicamente un directorio de staging como objeto <sha256> y aplica el límite de tamaño."""
+    with open(os.path.join(staging, META_NAME), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+    try:
+        os.rename(staging, object_dir(sha256))
+    except OSError:
+        # Otro proceso publicó el mismo contenido primero: nos quedamos con el suyo
+        shutil.rmtree(staging, ignore_errors=True)
+    evict(keep=sha256)
+    return _result(sha256, meta, cached=False)
+
+
+# ---------- Desalojo LRU ----------
+def _dir_size(path: str) -> int:
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat().st_size
+    return total
+
+
+def evict(max_bytes: Optional[int] = None, keep: Optional[str] = None) -> int:
+    """Elimina los objetos menos usados hasta quedar bajo max_bytes. Devuelve cuántos eliminó."""
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(OBJECTS_DIR):
+        return 0
+    entries = []
+    total = 0
+    for entry in os.scandir(OBJECTS_DIR):
+        meta_path = os.path.join(entry.path, META_NAME)
+        if not entry.is_dir() or not os.path.exists(meta_path):
+            continue
+        size = _dir_size(entry.path)
+        total += size
+        entries.append((os.path.getmtime(meta_path), entry.name, size))
+
+    removed = 0
+    for _, name, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        shutil.rmtree(os.path.join(OBJECTS_DIR, name), ignore_errors=True)
+        total -= size
+        removed += 1
+    with _lock:
+        _stats["evictions"] += removed
+    return removed
+
+
+def stats() -> Dict:
+    with _lock:
+        data = dict(_stats)
+    lookups = data["hits"] + data["misses"]
+    data["hit_rate"] = (data["hits"] / lookups) if lookups else 0.0
+    data["max_bytes"] = MAX_BYTES
+    return data
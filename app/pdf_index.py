@@ -0,0 +1,237 @@
+# app/pdf_index.py
+"""
+Índice de recuperación para los PDFs subidos.
+Divide el texto en fragmentos por página, construye un índice léxico BM25
+y, opcionalmente, un índice vectorial FAISS. Se persiste junto al .txt en DATA_DIR.
+El índice guarda solo la posición de cada fragmento (página y offsets dentro de la página);
+el texto se lee del .txt bajo demanda (ver doc_store).
+"""
+import json
+import math
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional
+
+CHUNK_CHARS = int(os.getenv("PDF_CHUNK_CHARS", "1200"))
+CHUNK_OVERLAP = int(os.getenv("PDF_CHUNK_OVERLAP", "200"))
+TOP_K = int(os.getenv("PDF_TOP_K", "5"))
+# Índice vectorial opcional: requiere faiss-cpu y GOOGLE_API_KEY para los embeddings
+USE_VECTORS = os.getenv("PDF_INDEX_VECTORS", "0") == "1"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "models/text-embedding-004")
+
+INDEX_VERSION = 2
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_PAGE_RE = re.compile(r"^\[Página (\d+)\]\n", re.MULTILINE)
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_STOPWORDS = {
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los",
+    "o", "para", "por", "que", "se", "su", "un", "una", "y",
+    "and", "in", "is", "of", "on", "the", "to",
+}
+
+INDEX_CACHE_SIZE = int(os.getenv("PDF_INDEX_CACHE_SIZE", "32"))
+
+# Índices ya cargados (LRU): {index_path: (mtime, índice)}; las tools lo usan desde varios hilos
+_loaded: "OrderedDict[str, tuple]" = OrderedDict()
+_loaded_lock = threading.Lock()
+
+
+# ---------- Fragmentación ----------
+def _split_pages(text: str) -> List[tuple]:
+    """Separa el texto extraído en (número de página, texto) usando los marcadores [Página N]."""
+    matches = list(_PAGE_RE.finditer(text))
+    if not matches:
+        return [(1, text.strip())] if text.strip() else []
+    pages = []
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        pages.append((int(m.group(1)), text[m.end():end].strip()))
+    return pages
+
+
+def chunk_pages(text: str) -> List[Dict]:
+    """
+    Divide el texto en fragmentos que nunca cruzan de página.
+    Cada fragmento: {"page": int, "start": int, "end": int, "text": str};
+    start/end son offsets dentro del texto de la página (ya sin espacios en los extremos).
+    """
+    chunks = []
+    step = max(CHUNK_CHARS - CHUNK_OVERLAP, 1)
+    for page, page_text in _split_pages(text):
+        if not page_text:
+            continue
+        start = 0
+        while start < len(page_text):
+            end = min(start + CHUNK_CHARS, len(page_text))
+            # Cortar en un salto de línea o espacio cercano para no partir palabras
+            if end < len(page_text):
+                cut = page_text.rfind("\n", start + step // 2, end)
+                if cut == -1:
+                    cut = page_text.rfind(" ", start + step // 2, end)
+                if cut != -1:
+                    end = cut
+            chunks.append({"page": page, "start": start, "end": end, "text": page_text[start:end].strip()})
+            if end >= len(page_text):
+                break
+            start = max(end - CHUNK_OVERLAP, start + 1)
+            # El solape empieza al inicio de una palabra
+            while start < end and not page_text[start - 1].isspace():
+                start += 1
+    return [c for c in chunks if c["text"]]
+
+
+def tokenize(text: str) -> List[str]:
+    """Minúsculas, sin acentos y sin palabras vacías."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [t for t in _TOKEN_RE.findall(text) if t not in _STOPWORDS]
+
+
+# ---------- Construcción ----------
+def index_path_for(txt_path: str) -> str:
+    return os.path.splitext(txt_path)[0] + ".index.json"
+
+
+def _faiss_path_for(index_path: str) -> str:
+    return index_path[: -len(".index.json")] + ".faiss"
+
+
+def _get_embeddings():
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+
+
+def _build_faiss(chunks: List[Dict], faiss_path: str) -> bool:
+    """Construye el índice vectorial. Devuelve False si no está disponible."""
+    if not USE_VECTORS or not chunks or not os.getenv("GOOGLE_API_KEY"):
+        return False
+    try:
+        import faiss
+        import numpy as np
+    except ImportError:
+        return False
+
+    vectors = np.array(_get_embeddings().embed_documents([c["text"] for c in chunks]), dtype="float32")
+    faiss.normalize_L2(vectors)
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(vectors)
+    faiss.write_index(index, faiss_path)
+    return True
+
+
+def build_index(txt_path: str) -> str:
+    """Construye y persiste el índice del .txt indicado. Devuelve la ruta del índice."""
+    with open(txt_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    chunks = chunk_pages(text)
+    postings: Dict[str, List[List[int]]] = {}
+    lengths = []
+    for i, chunk in enumerate(chunks):
+        tokens = tokenize(chunk["text"])
+        lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append([i, tf])
+
+    index_path = index_path_for(txt_path)
+    has_vectors = _build_faiss(chunks, _faiss_path_for(index_path))
+    data = {
+        "version": INDEX_VERSION,
+        "chunks": [{"page": c["page"], "start": c["start"], "end": c["end"]} for c in chunks],
+        "lengths": lengths,
+        "avgdl": (sum(lengths) / len(lengths)) if lengths else 0.0,
+        "postings": postings,
+        "vectors": has_vectors,
+    }
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    return index_path
+
+
+# ---------- Consulta ----------
+def load_index(index_path: str) -> Dict:
+    """Carga el índice con caché por mtime."""
+    mtime = os.path.getmtime(index_path)
+    with _loaded_lock:
+        cached = _loaded.get(index_path)
+        if cached and cached[0] == mtime:
+            _loaded.move_to_end(index_path)
+            return cached[1]
+    # La lectura va fuera del lock: dos hilos pueden cargar el mismo índice, el resultado es igual
+    with open(index_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != INDEX_VERSION:
+        # Índice de una versión anterior: se reconstruye desde su .txt
+        build_index(index_path[: -len(".index.json")] + ".txt")
+        return load_index(index_path)
+    with _loaded_lock:
+        _loaded[index_path] = (mtime, data)
+        _loaded.move_to_end(index_path)
+        while len(_loaded) > INDEX_CACHE_SIZE:
+            _loaded.popitem(last=False)
+    return data
+
+
+def _bm25(data: Dict, question: str) -> Dict[int, float]:
+    n = len(data["chunks"])
+    avgdl = data["avgdl"] or 1.0
+    lengths = data["lengths"]
+    scores: Dict[int, float] = {}
+    for term in set(tokenize(question)):
+        posting = data["postings"].get(term)
+        if not posting:
+            continue
+        idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+        for i, tf in posting:
+            norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * lengths[i] / avgdl)
+            scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+    return scores
+
+
+def _vector_ranking(index_path: str, question: str, k: int) -> List[int]:
+    try:
+        import faiss
+        import numpy as np
+        index = faiss.read_index(_faiss_path_for(index_path))
+        query = np.array([_get_embeddings().embed_query(question)], dtype="float32")
+    except Exception:
+        return []
+    faiss.normalize_L2(query)
+    _, ids = index.search(query, k)
+    return [int(i) for i in ids[0] if i >= 0]
+
+
+def search(index_path: str, question: str, k: Optional[int] = None) -> List[Dict]:
+    """
+    Devuelve las posiciones de los k fragmentos más relevantes, en orden de relevancia.
+    Si hay índice vectorial, combina ambos rankings con Reciprocal Rank Fusion.
+    """
+    k = k or TOP_K
+    data = load_index(index_path)
+    scores = _bm25(data, question)
+    ranking = sorted(scores, key=lambda i: scores[i], reverse=True)
+
+    if data.get("vectors"):
+        fused: Dict[int, float] = {}
+        for rank_list in (ranking[: k * 4], _vector_ranking(index_path, question, k * 4)):
+            for rank, i in enumerate(rank_list):
+                fused[i] = fused.get(i, 0.0) + 1.0 / (60 + rank)
+        ranking = sorted(fused, key=lambda i: fused[i], reverse=True)
+
+    return [dict(data["chunks"][i], score=scores.get(i, 0.0)) for i in ranking[:k]]
+
+
+def head_chunks(index_path: str, k: Optional[int] = None) -> List[Dict]:
+    """Primeros k fragmentos del documento (para preguntas generales sin coincidencias)."""
+    return load_index(index_path)["chunks"][: k or TOP_K]
+
+
+def format_chunks(chunks: List[Dict]) -> str:
+    """Formatea los fragmentos (ya con "text") con su cita de página, en orden de documento."""
+    ordered = sorted(chunks, key=lambda c: c["page"])
+    return "\n\n".join(f"[Página {c['page']}]\n{c['text']}" for c in ordered)
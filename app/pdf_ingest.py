@@ -1,33 +1,249 @@
-
 # app/pdf_ingest.py
+"""
+Pipeline de ingesta de PDFs:
+1) el UploadFile se escribe a disco por bloques (sin cargarlo entero en memoria),
+2) los rangos de páginas se extraen en un pool de procesos,
+3) el .txt se escribe de forma incremental, en orden,
+4) se construye el índice de recuperación.
+Las subidas devuelven un job_id y el progreso se consulta por página; los jobs viven en el
+almacén de estado compartido, así el estado se puede consultar desde cualquier worker.
+Todo se guarda por SHA-256 del contenido (ver pdf_cache): una subida repetida no se vuelve a extraer.
+"""
+import hashlib
 import os
-from typing import Dict
-from PyPDF2 import PdfReader
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+from . import pdf_cache
+from .metrics import span
+from .pdf_index import build_index
+from .state_store import state_store
+
+DATA_DIR = pdf_cache.DATA_DIR
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "25"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "0")) or (os.cpu_count() or 1)
+JOB_TTL_SECONDS = 24 * 3600  # los jobs terminados se olvidan pasado este tiempo
+
+ProgressCallback = Callable[[int, int], None]  # (páginas hechas, páginas totales)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+# ---------- Escritura por bloques ----------
+async def stream_upload_to_disk(upload, path: str) -> Dict:
+    """Copia un UploadFile a disco por bloques calculando su SHA-256 al vuelo."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    with span("ingest", stage="upload"), open(path, "wb") as f:
+        while True:
+            block = await upload.read(UPLOAD_CHUNK_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            size += len(block)
+            f.write(block)
+    return {"bytes": size, "sha256": digest.hexdigest()}
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(UPLOAD_CHUNK_BYTES), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ---------- Extracción en paralelo ----------
+def _get_pool() -> ProcessPoolExecutor:
+    """Lazy init del pool de procesos compartido."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+        return _pool
+
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def _extract_range(pdf_path: str, start: int, end: int) -> List[str]:
+    """Extrae las páginas [start, end). Se ejecuta en un proceso del pool."""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(pdf_path)
+    parts = []
+    for i in range(start, end):
+        text = reader.pages[i].extract_text() or ""
+        parts.append(f"[Página {i+1}]\n{text}")
+    return parts
+
+
+def extract_to_text(pdf_path: str, txt_path: str, progress: Optional[ProgressCallback] = None) -> int:
+    """
+    Extrae el texto del PDF a txt_path y devuelve el número de páginas.
+    Los rangos se procesan en paralelo y se escriben en orden conforme terminan.
+    """
+    from PyPDF2 import PdfReader
+    pages = len(PdfReader(pdf_path).pages)
+    ranges = [(s, min(s + PAGES_PER_TASK, pages)) for s in range(0, pages, PAGES_PER_TASK)]
+    done_pages = 0
+    if progress:
+        progress(0, pages)
+
+    with open(txt_path, "w", encoding="utf-8") as out:
+        if pages == 0:
+            out.write("[PDF sin texto extraíble]")
+            return 0
+
+        def write_parts(parts: List[str], first: bool) -> None:
+            out.write(("" if first else "\n\n") + "\n\n".join(parts))
+
+        # PDFs pequeños: no vale la pena pagar el envío al pool
+        if len(ranges) == 1:
+            write_parts(_extract_range(pdf_path, 0, pages), True)
+            if progress:
+                progress(pages, pages)
+            return pages
+
+        pool = _get_pool()
+        futures = {pool.submit(_extract_range, pdf_path, s, e): idx for idx, (s, e) in enumerate(ranges)}
+        ready: Dict[int, List[str]] = {}
+        next_idx = 0
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                idx = futures[fut]
+                ready[idx] = fut.result()
+                done_pages += ranges[idx][1] - ranges[idx][0]
+            # Escribir en orden todo lo contiguo que ya esté listo
+            while next_idx in ready:
+                write_parts(ready.pop(next_idx), next_idx == 0)
+                next_idx += 1
+            if progress:
+                progress(done_pages, pages)
+    return pages
+
+
+def ingest_pdf(
+    pdf_path: str,
+    filename: str,
+    sha256: Optional[str] = None,
+    progress: Optional[ProgressCallback] = None,
+    check_cache: bool = True,
+) -> Dict:
+    """
+    Extrae texto e índice de un PDF ya guardado en disco.
+    El archivo en pdf_path pasa a ser propiedad del almacén (se mueve o se elimina).
+    check_cache=False cuando el llamador ya consultó el almacén.
+    """
+    if not sha256:
+        with span("ingest", stage="hash"):
+            sha256 = _file_sha256(pdf_path)
+    with span("ingest", stage="cache_lookup"):
+        cached = pdf_cache.lookup(sha256) if check_cache else None
+    if cached:
+        os.remove(pdf_path)
+        if progress:
+            progress(cached["pages"], cached["pages"])
+        return cached
+
+    staging = pdf_cache.new_staging_dir()
+    try:
+        paths = pdf_cache.staging_paths(staging)
+        os.replace(pdf_path, paths["pdf_path"])
+        with span("ingest", stage="extract"):
+            pages = extract_to_text(paths["pdf_path"], paths["txt_path"], progress)
+        # Índice de recuperación (BM25 + FAISS opcional) junto al .txt
+        with span("ingest", stage="index"):
+            build_index(paths["txt_path"])
+        meta = {"filename": filename, "pages": pages, "bytes": os.path.getsize(paths["pdf_path"])}
+        with span("ingest", stage="publish"):
+            return pdf_cache.publish(sha256, staging, meta)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def new_upload_path() -> str:
+    """Ruta temporal para recibir una subida antes de conocer su hash."""
+    os.makedirs(pdf_cache.TMP_DIR, exist_ok=True)
+    return os.path.join(pdf_cache.TMP_DIR, f"{uuid.uuid4().hex}.pdf")
 
-DATA_DIR = os.getenv("DATA_DIR", "data")
 
 def save_pdf_and_text(file_bytes: bytes, filename: str) -> Dict:
-    # 1) Guardar PDF
-    pdf_path = os.path.join(DATA_DIR, filename)
-    os.makedirs(DATA_DIR, exist_ok=True)
+    """Versión síncrona para bytes ya en memoria."""
+    sha256 = hashlib.sha256(file_bytes).hexdigest()
+    cached = pdf_cache.lookup(sha256)
+    if cached:
+        return cached
+    pdf_path = new_upload_path()
     with open(pdf_path, "wb") as f:
         f.write(file_bytes)
+    return ingest_pdf(pdf_path, filename, sha256=sha256, check_cache=False)
 
-    # 2) Extraer texto
-    reader = PdfReader(pdf_path)
-    pages = len(reader.pages)
-    text_parts = []
-    for i in range(pages):
-        page = reader.pages[i]
-        text = page.extract_text() or ""
-        text_parts.append(f"[Página {i+1}]\n{text}")
-
-    full_text = "\n\n".join(text_parts).strip()
-
-    # 3) Guardar como .txt para el índice
-    txt_name = os.path.splitext(filename)[0] + ".txt"
-    txt_path = os.path.join(DATA_DIR, txt_name)
-    with open(txt_path, "w", encoding="utf-8") as f:
-        f.write(full_text or "[PDF sin texto extraíble]")
-
-    return {"pdf_path": pdf_path, "txt_path": txt_path, "pages": pages, "bytes": len(file_bytes)}
\ No newline at end of file
+
+# ---------- Jobs de ingesta ----------
+JOBS_NAMESPACE = "ingest_jobs"
+
+
+def create_job(filename: str) -> str:
+    job_id = uuid.uuid4().hex
+    state_store.prune(JOBS_NAMESPACE, time.time() - JOB_TTL_SECONDS)
+    state_store.put(JOBS_NAMESPACE, job_id, {
+        "job_id": job_id,
+        "filename": filename,
+        "status": "queued",  # queued | processing | done | error
+        "pages_done": 0,
+        "pages_total": None,
+        "result": None,
+        "error": None,
+    })
+    return job_id
+
+
+def get_job(job_id: str) -> Optional[Dict]:
+    return state_store.get(JOBS_NAMESPACE, job_id)
+
+
+def _update_job(job_id: str, **fields) -> None:
+    state_store.update(JOBS_NAMESPACE, job_id, lambda job: {**(job or {"job_id": job_id}), **fields})
+
+
+def complete_job(job_id: str, result: Dict) -> None:
+    """Marca un job como terminado sin extracción (p. ej. acierto de caché)."""
+    _update_job(job_id, status="done", pages_done=result["pages"], pages_total=result["pages"], result=result)
+
+
+def run_ingest_job(
+    job_id: str,
+    pdf_path: str,
+    filename: str,
+    sha256: Optional[str] = None,
+    on_done: Optional[Callable[[Dict], None]] = None,
+    check_cache: bool = True,
+) -> None:
+    """Ejecuta la ingesta de un job (pensado para correr en un hilo aparte)."""
+    _update_job(job_id, status="processing")
+
+    def progress(done: int, total: int) -> None:
+        _update_job(job_id, pages_done=done, pages_total=total)
+
+    try:
+        result = ingest_pdf(pdf_path, filename, sha256=sha256, progress=progress, check_cache=check_cache)
+        if on_done:
+            on_done(result)
+        _update_job(job_id, status="done", result=result)
+    except Exception as e:
+        _update_job(job_id, status="error", error=str(e))
@@ -0,0 +1,349 @@
+# app/pdf_summarize.py
+"""
+Resumen map-reduce de documentos largos.
+1) map: el texto extraído se parte en rangos de páginas y cada rango se resume por separado,
+   varios a la vez (SUMMARY_MAX_CONCURRENCY, además del límite global de llamadas al modelo);
+   un rango que no cabe en SUMMARY_CHUNK_TOKENS se subdivide, nunca se recorta,
+2) reduce: los resúmenes se combinan en grupos de hasta SUMMARY_CHUNK_TOKENS (y
+   SUMMARY_REDUCE_FANIN resúmenes), nivel por nivel, hasta quedar uno.
+Cada resumen (de un rango o de una combinación) se guarda en disco por SHA-256 de su entrada,
+del prompt y del modelo (DATA_DIR/summaries): volver a resumir el mismo documento, u otro que
+comparta páginas, no vuelve a llamar al modelo. El directorio está acotado
+(SUMMARIES_MAX_BYTES, LRU por mtime).
+summarize_document es la versión async; summarize_document_sync, la del camino síncrono de
+las tools (un pool de hilos y el límite síncrono de GatedChatModel, sin crear un event loop).
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from . import pdf_cache
+from .context_budget import estimate_tokens
+from .doc_store import doc_store
+from .metrics import MetricsCallbackHandler, current_session, current_timings
+from .response_cache import CACHE_REQUESTS
+
+SUMMARY_CHUNK_PAGES = int(os.getenv("SUMMARY_CHUNK_PAGES", "10"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "6000"))  # entrada máxima de cada llamada
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "4"))
+SUMMARY_REDUCE_FANIN = max(int(os.getenv("SUMMARY_REDUCE_FANIN", "8")), 2)
+SUMMARIES_DIR = os.path.join(pdf_cache.DATA_DIR, "summaries")
+SUMMARIES_MAX_BYTES = int(os.getenv("SUMMARIES_MAX_BYTES", str(256 * 1024 ** 2)))
+SUMMARIES_SWEEP_EVERY = 64  # resúmenes guardados entre barridos del límite de tamaño
+
+MAP_PROMPT = (
+    "Resume el siguiente fragmento de un documento en español, en un párrafo breve. "
+    "Conserva cifras, fechas, plazos, nombres y obligaciones, y cita las páginas entre corchetes."
+)
+REDUCE_PROMPT = (
+    "Combina los siguientes resúmenes parciales de un mismo documento, en orden, en un único "
+    "resumen en español. Elimina repeticiones y conserva cifras, fechas, plazos y páginas citadas."
+)
+
+_stats_lock = threading.Lock()
+_stats = {"summaries": 0, "llm_calls": 0, "cached_parts": 0, "evictions": 0}
+_stores_since_sweep = 0
+
+
+# ---------- Caché en disco ----------
+def _summary_key(prompt: str, model_name: str, text: str) -> str:
+    return hashlib.sha256("\x1f".join((prompt, model_name, text)).encode("utf-8")).hexdigest()
+
+
+def _summary_path(key: str) -> str:
+    return os.path.join(SUMMARIES_DIR, key[:2], f"{key}.json")
+
+
+def _load_summary(key: str) -> Optional[str]:
+    path = _summary_path(key)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            summary = json.load(f)["summary"]
+        os.utime(path)  # LRU: marca de último uso
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        CACHE_REQUESTS.inc(cache="pdf_summary", result="miss")
+        return None
+    CACHE_REQUESTS.inc(cache="pdf_summary", result="hit")
+    return summary
+
+
+def _store_summary(key: str, summary: str) -> None:
+    path = _summary_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"summary": summary}, f, ensure_ascii=False)
+    os.replace(tmp, path)  # atómico: otro worker nunca lee un archivo a medias
+
+    global _stores_since_sweep
+    with _stats_lock:
+        _stores_since_sweep += 1
+        sweep = _stores_since_sweep >= SUMMARIES_SWEEP_EVERY
+        if sweep:
+            _stores_since_sweep = 0
+    if sweep:
+        evict_summaries()
+
+
+def evict_summaries(max_bytes: Optional[int] = None) -> int:
+    """Elimina los resúmenes menos usados hasta quedar bajo max_bytes. Devuelve cuántos eliminó."""
+    max_bytes = SUMMARIES_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(SUMMARIES_DIR):
+        return 0
+    entries = []
+    total = 0
+    for shard in os.scandir(SUMMARIES_DIR):
+        if not shard.is_dir():
+            continue
+        for entry in os.scandir(shard.path):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue  # lo eliminó otro worker
+            total += st.st_size
+            entries.append((st.st_mtime, entry.path, st.st_size))
+
+    removed = 0
+    for _, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    with _stats_lock:
+        _stats["evictions"] += removed
+    return removed
+
+
+# ---------- Map-reduce ----------
+def page_ranges(pages: int, per_chunk: int = SUMMARY_CHUNK_PAGES) -> List[tuple]:
+    """[(1, 10), (11, 20), ...] rangos 1-based inclusivos que cubren el documento."""
+    per_chunk = max(per_chunk, 1)
+    return [(start, min(start + per_chunk - 1, pages)) for start in range(1, pages + 1, per_chunk)]
+
+
+def _split_text(text: str, max_tokens: int) -> List[str]:
+    """Parte el texto en trozos de hasta max_tokens, por líneas (o por palabras si una línea no cabe)."""
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+    pieces: List[str] = []
+    current, used = "", 0
+    for line in text.split("\n"):
+        units = [line] if estimate_tokens(line) <= max_tokens else line.split(" ")
+        for i, unit in enumerate(units):
+            tokens = estimate_tokens(unit) + 1
+            if current and used + tokens > max_tokens:
+                pieces.append(current)
+                current, used = "", 0
+            joiner = " " if i else "\n"  # palabras de una línea larga, o líneas
+            current = f"{current}{joiner}{unit}" if current else unit
+            used += tokens
+    if current:
+        pieces.append(current)
+    return [p for p in pieces if p.strip()]
+
+
+def _range_texts(doc: Dict, start: int, end: int) -> List[str]:
+    """
+    Entradas de la fase map para un rango de páginas, cada una dentro de SUMMARY_CHUNK_TOKENS:
+    el rango se subdivide por páginas y una página que no cabe sola, en trozos. Nada se recorta.
+    """
+    pages = doc_store.read_pages(doc, start, end)
+    texts: List[str] = []
+    current: List[str] = []
+    used = 0
+    for page, text in sorted(pages.items()):
+        if not text:
+            continue
+        header = f"[Página {page}]\n"
+        for piece in _split_text(text, SUMMARY_CHUNK_TOKENS - estimate_tokens(header) - 2):
+            block = header + piece
+            tokens = estimate_tokens(block) + 2  # separador entre páginas
+            if current and used + tokens > SUMMARY_CHUNK_TOKENS:
+                texts.append("\n\n".join(current))
+                current, used = [], 0
+            current.append(block)
+            used += tokens
+    if current:
+        texts.append("\n\n".join(current))
+    return texts
+
+
+class _Summarizer:
+    """Una corrida de resumen: modelo, límite de concurrencia y contadores."""
+
+    def __init__(self, llm, model_name: str, max_concurrency: int):
+        self.llm = llm
+        self.model_name = model_name
+        self.max_concurrency = max(max_concurrency, 1)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)  # solo la versión async
+        self.llm_calls = 0
+        self.cached = 0
+        self._lock = threading.Lock()
+
+    def _cached(self, key: str) -> Optional[str]:
+        cached = _load_summary(key)
+        if cached is not None:
+            with self._lock:
+                self.cached += 1
+        return cached
+
+    def _request(self, prompt: str, text: str) -> tuple:
+        with self._lock:
+            self.llm_calls += 1
+        config = {"callbacks": [MetricsCallbackHandler(self.model_name, current_session.get(), current_timings())]}
+        return [SystemMessage(content=prompt), HumanMessage(content=text)], config
+
+    @staticmethod
+    def _store(key: str, message) -> str:
+        from .agent import _content_text  # import diferido: agent importa las tools
+
+        summary = _content_text(message.content).strip()
+        if summary:
+            _store_summary(key, summary)
+        return summary
+
+    async def summarize(self, prompt: str, text: str) -> str:
+        if not text.strip():
+            return ""
+        key = _summary_key(prompt, self.model_name, text)
+        cached = await asyncio.to_thread(self._cached, key)
+        if cached is not None:
+            return cached
+        async with self.semaphore:
+            messages, config = self._request(prompt, text)
+            message = await self.llm.ainvoke(messages, config=config)
+        return await asyncio.to_thread(self._store, key, message)
+
+    def summarize_sync(self, prompt: str, text: str) -> str:
+        if not text.strip():
+            return ""
+        key = _summary_key(prompt, self.model_name, text)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        messages, config = self._request(prompt, text)
+        return self._store(key, self.llm.invoke(messages, config=config))
+
+    def result(self, doc: Dict, chunks: int, parts: List[str], levels: int) -> Dict:
+        with _stats_lock:
+            _stats["summaries"] += 1
+            _stats["llm_calls"] += self.llm_calls
+            _stats["cached_parts"] += self.cached
+        return {
+            "doc_id": doc["doc_id"],
+            "filename": doc["filename"],
+            "pages": doc["pages"],
+            "summary": REDUCE_SEPARATOR.join(parts),
+            "chunks": chunks,
+            "reduce_levels": levels,
+            "llm_calls": self.llm_calls,
+            "cached_parts": self.cached,
+        }
+
+
+def _summarizer(llm, max_concurrency: int) -> _Summarizer:
+    """llm por defecto es el modelo de chat del agente, detrás del límite global de llamadas (GatedChatModel)."""
+    if llm is None:
+        from .agent import _model_name, get_chat_model  # import diferido: agent importa las tools
+        from .scheduler import GatedChatModel
+        inner = get_chat_model()
+        llm, model_name = GatedChatModel(inner=inner), _model_name(inner)
+    else:
+        model_name = getattr(llm, "model", None) or llm._llm_type
+    return _Summarizer(llm, model_name, max_concurrency)
+
+
+REDUCE_SEPARATOR = "\n\n---\n\n"
+
+
+def _reduce_inputs(parts: List[str]) -> List[str]:
+    """
+    Entradas del siguiente nivel de reduce: resúmenes consecutivos agrupados hasta
+    SUMMARY_CHUNK_TOKENS (y como mucho SUMMARY_REDUCE_FANIN por grupo); uno que no cabe
+    solo se parte en trozos. Nada se recorta.
+    """
+    budget = SUMMARY_CHUNK_TOKENS - estimate_tokens(REDUCE_SEPARATOR)
+    groups: List[List[str]] = []
+    used = 0
+    for part in parts:
+        for piece in _split_text(part, budget):
+            tokens = estimate_tokens(piece) + estimate_tokens(REDUCE_SEPARATOR)
+            if not groups or len(groups[-1]) >= SUMMARY_REDUCE_FANIN or used + tokens > SUMMARY_CHUNK_TOKENS:
+                groups.append([])
+                used = 0
+            groups[-1].append(piece)
+            used += tokens
+    return [REDUCE_SEPARATOR.join(group) for group in groups]
+
+
+def _reduced(before: List[str], after: List[str]) -> bool:
+    """Si un nivel de reduce no achicó la lista (el modelo no resume), se corta ahí."""
+    return len(after) < len(before)
+
+
+async def summarize_document(doc: Dict, llm=None, max_concurrency: int = SUMMARY_MAX_CONCURRENCY) -> Dict:
+    """Resume el documento completo (ver _summarizer para el llm por defecto)."""
+    run = _summarizer(llm, max_concurrency)
+    ranges = page_ranges(doc["pages"])
+    per_range = await asyncio.gather(*(asyncio.to_thread(_range_texts, doc, s, e) for s, e in ranges))
+    texts = [text for texts in per_range for text in texts]
+    parts = await asyncio.gather(*(run.summarize(MAP_PROMPT, text) for text in texts))
+    parts = [p for p in parts if p]
+    levels = 0
+    while len(parts) > 1:
+        levels += 1
+        reduced = await asyncio.gather(*(run.summarize(REDUCE_PROMPT, text) for text in _reduce_inputs(parts)))
+        reduced = [p for p in reduced if p]
+        if not _reduced(parts, reduced):
+            break
+        parts = reduced
+    return run.result(doc, len(texts), parts, levels)
+
+
+def summarize_document_sync(doc: Dict, llm=None, max_concurrency: int = SUMMARY_MAX_CONCURRENCY) -> Dict:
+    """
+    Como summarize_document, desde código síncrono: los fragmentos se resumen en un pool de
+    max_concurrency hilos y cada llamada pasa por llm.invoke.
+    """
+    run = _summarizer(llm, max_concurrency)
+    ranges = page_ranges(doc["pages"])
+    with ThreadPoolExecutor(run.max_concurrency, thread_name_prefix="summary") as pool:
+
+        def gather(fn: Callable, calls: List[tuple]) -> List:
+            # Cada hilo con una copia del contexto: sesión y tiempos del request en métricas
+            futures = [pool.submit(contextvars.copy_context().run, fn, *args) for args in calls]
+            return [f.result() for f in futures]
+
+        texts = [text for texts in gather(_range_texts, [(doc, s, e) for s, e in ranges]) for text in texts]
+        parts = [p for p in gather(run.summarize_sync, [(MAP_PROMPT, t) for t in texts]) if p]
+        levels = 0
+        while len(parts) > 1:
+            levels += 1
+            reduced = [p for p in gather(run.summarize_sync, [(REDUCE_PROMPT, t) for t in _reduce_inputs(parts)]) if p]
+            if not _reduced(parts, reduced):
+                break
+            parts = reduced
+    return run.result(doc, len(texts), parts, levels)
+
+
+def summary_stats() -> Dict:
+    with _stats_lock:
+        return {
+            **_stats,
+            "max_concurrency": SUMMARY_MAX_CONCURRENCY,
+            "chunk_pages": SUMMARY_CHUNK_PAGES,
+            "max_bytes": SUMMARIES_MAX_BYTES,
+        }
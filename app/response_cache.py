@@ -0,0 +1,81 @@
+# app/response_cache.py
+"""
+Cachés en memoria con TTL y desalojo LRU para consultas repetidas de solo lectura:
+respuestas completas del agente (opt-in, ver agent.py) y resultados de pdf_query.
+Los aciertos y fallos se exportan en /metrics (cache_requests_total).
+"""
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .metrics import Counter, _register
+
+CACHE_REQUESTS = _register(Counter("cache_requests_total", "Consultas a las cachés de respuestas", ["cache", "result"]))
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin acentos, sin puntuación y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(_PUNCT_RE.sub(" ", text).split())
+
+
+def cache_key(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+
+class TTLCache:
+    def __init__(self, name: str, max_entries: int, ttl_seconds: float):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # {key: (expira_en, valor)} en orden de uso
+        self._items: "OrderedDict[str, tuple]" = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._items[key]
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+            else:
+                self._items.move_to_end(key)
+                self._stats["hits"] += 1
+        CACHE_REQUESTS.inc(cache=self.name, result="miss" if entry is None else "hit")
+        return None if entry is None else entry[1]
+
+    def put(self, key: str, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._items),
+                "hit_rate": (self._stats["hits"] / lookups) if lookups else 0.0,
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+            }
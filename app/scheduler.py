@@ -0,0 +1,368 @@
+# app/scheduler.py
+"""
+Control de admisión delante del agente.
+- Serialización FIFO por sesión: los turnos de un mismo session_id se ejecutan de a uno.
+  Con varios workers (STATE_BACKEND=sqlite), además un lease por sesión en el almacén
+  compartido: un worker no empieza un turno mientras otro ejecuta uno de la misma sesión.
+- Cola de espera acotada, global y por sesión: si está llena se rechaza con 503/429 y Retry-After.
+  La global cuenta todos los turnos que esperan: su sesión o un cupo del modelo.
+- Límite global de llamadas al modelo en vuelo (GatedChatModel), uno solo por proceso para
+  llamadas síncronas y async, para no disparar 429 del proveedor.
+"""
+import asyncio
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from .metrics import Counter, Gauge, _register, record_llm_queue_wait
+from .state_store import STATE_BACKEND, state_store
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+GLOBAL_QUEUE_MAX = int(os.getenv("AGENT_QUEUE_MAX", "64"))          # turnos esperando, en total
+SESSION_QUEUE_MAX = int(os.getenv("AGENT_SESSION_QUEUE_MAX", "2"))  # turnos esperando, por sesión
+DEFAULT_TURN_SECONDS = 5.0  # estimación inicial para Retry-After
+# Lease de sesión entre procesos; se renueva mientras dura el turno (un worker caído lo libera al vencer)
+SESSION_LEASE_NAMESPACE = "session_leases"
+SESSION_LEASE_SECONDS = float(os.getenv("SESSION_LEASE_SECONDS", "60"))
+SESSION_LEASE_POLL_SECONDS = 0.05
+
+QUEUE_WAITING = _register(Gauge("scheduler_waiting_turns", "Turnos del agente esperando su turno de sesión"))
+QUEUE_ACTIVE = _register(Gauge("scheduler_active_turns", "Turnos del agente en ejecución"))
+QUEUE_REJECTED = _register(Counter("scheduler_rejected_total", "Turnos rechazados por cola llena", ["reason"]))
+LLM_INFLIGHT = _register(Gauge("llm_inflight_calls", "Llamadas al modelo en vuelo"))
+LLM_WAITING = _register(Gauge("llm_waiting_calls", "Llamadas al modelo esperando un cupo"))
+
+
+class Overloaded(Exception):
+    """Cola llena: el llamador debe reintentar después de retry_after segundos."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Scheduler:
+    def __init__(
+        self,
+        global_queue_max: int = GLOBAL_QUEUE_MAX,
+        session_queue_max: int = SESSION_QUEUE_MAX,
+        leases: Optional[bool] = None,
+    ):
+        self.global_queue_max = global_queue_max
+        self.session_queue_max = session_queue_max
+        # Con el almacén en memoria no hay otros procesos con los que coordinarse
+        self.leases = STATE_BACKEND != "memory" if leases is None else leases
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        # {session_id: [lock, turnos pendientes (esperando + en ejecución)]}
+        self._sessions: Dict[str, list] = {}
+        self._waiting = 0
+        self._active = 0
+        self._turn_seconds = DEFAULT_TURN_SECONDS  # media móvil de la duración de un turno
+
+    def _retry_after(self, queued: int) -> int:
+        slots = max(LLM_MAX_CONCURRENCY, 1)
+        return max(1, math.ceil(self._turn_seconds * (queued / slots + 1)))
+
+    def queued(self) -> int:
+        """
+        Turnos en cola en el proceso: los que esperan el turno de su sesión más los admitidos
+        que no caben en los cupos del modelo (o las llamadas que esperan cupo, si son más).
+        """
+        return self._waiting + max(self._active - LLM_MAX_CONCURRENCY, _slots.stats()["waiting"], 0)
+
+    def check_admission(self, session_id: str) -> None:
+        """Rechaza de inmediato si la cola de la sesión o la global están llenas."""
+        entry = self._sessions.get(session_id)
+        pending = entry[1] if entry else 0
+        if pending > self.session_queue_max:
+            QUEUE_REJECTED.inc(reason="session")
+            raise Overloaded(
+                429, "Hay demasiados mensajes en curso para esta sesión", self._retry_after(pending)
+            )
+        queued = self.queued()
+        if queued >= self.global_queue_max:
+            QUEUE_REJECTED.inc(reason="global")
+            raise Overloaded(503, "El servidor está saturado, intenta de nuevo", self._retry_after(queued))
+
+    # ---------- Lease de sesión entre procesos ----------
+    def _take_lease(self, session_id: str) -> bool:
+        """Toma el lease (o lo renueva si ya es nuestro). False si lo tiene otro proceso."""
+        now = time.time()
+
+        def take(lease):
+            if lease and lease["owner"] != self._owner and lease["until"] > now:
+                return lease
+            return {"owner": self._owner, "until": now + SESSION_LEASE_SECONDS}
+
+        return state_store.update(SESSION_LEASE_NAMESPACE, session_id, take)["owner"] == self._owner
+
+    def _release_lease(self, session_id: str) -> None:
+        """Lo borra solo si sigue siendo nuestro (pudo vencer y tomarlo otro worker)."""
+        state_store.update(
+            SESSION_LEASE_NAMESPACE,
+            session_id,
+            lambda lease: lease if lease and lease["owner"] != self._owner else None,
+        )
+
+    @staticmethod
+    def prune_leases() -> int:
+        """Elimina los leases vencidos (de workers que cayeron a mitad de un turno)."""
+        return state_store.prune(SESSION_LEASE_NAMESPACE, time.time() - SESSION_LEASE_SECONDS)
+
+    async def _acquire_lease(self, session_id: str) -> None:
+        delay = SESSION_LEASE_POLL_SECONDS
+        while not await asyncio.to_thread(self._take_lease, session_id):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    async def _keep_lease(self, session_id: str) -> None:
+        while True:
+            await asyncio.sleep(SESSION_LEASE_SECONDS / 3)
+            await asyncio.to_thread(self._take_lease, session_id)
+
+    @asynccontextmanager
+    async def _session_lease(self, session_id: str) -> AsyncIterator[None]:
+        if not self.leases:
+            yield
+            return
+        try:
+            await self._acquire_lease(session_id)
+            renewer = asyncio.create_task(self._keep_lease(session_id))
+            try:
+                yield
+            finally:
+                renewer.cancel()
+        finally:
+            # También si se canceló mientras esperaba: el lease pudo quedar tomado
+            await asyncio.shield(asyncio.to_thread(self._release_lease, session_id))
+
+    @asynccontextmanager
+    async def session_turn(self, session_id: str) -> AsyncIterator[None]:
+        """Espera (FIFO) el turno de la sesión dentro de la cola acotada."""
+        self.check_admission(session_id)
+        entry = self._sessions.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        self._waiting += 1
+        QUEUE_WAITING.set(self._waiting)
+        waiting = True
+        try:
+            # asyncio.Lock atiende a los que esperan en orden de llegada; el lease, a los de otros workers
+            async with entry[0], self._session_lease(session_id):
+                self._waiting -= 1
+                waiting = False
+                self._active += 1
+                QUEUE_WAITING.set(self._waiting)
+                QUEUE_ACTIVE.set(self._active)
+                loop = asyncio.get_running_loop()
+                t0 = loop.time()
+                try:
+                    yield
+                finally:
+                    self._turn_seconds = 0.9 * self._turn_seconds + 0.1 * (loop.time() - t0)
+                    self._active -= 1
+                    QUEUE_ACTIVE.set(self._active)
+        finally:
+            if waiting:
+                self._waiting -= 1
+                QUEUE_WAITING.set(self._waiting)
+            entry[1] -= 1
+            if entry[1] == 0 and self._sessions.get(session_id) is entry:
+                del self._sessions[session_id]
+
+    def stats(self) -> Dict:
+        return {
+            "waiting": self._waiting,
+            "active": self._active,
+            "queued": self.queued(),
+            "sessions": len(self._sessions),
+            "turn_seconds_avg": round(self._turn_seconds, 3),
+            "llm_max_concurrency": LLM_MAX_CONCURRENCY,
+            "llm_slots": _slots.stats(),
+            "session_leases": self.leases,
+        }
+
+
+scheduler = Scheduler()
+
+
+# ---------- Límite de llamadas al modelo ----------
+class _ModelSlots:
+    """
+    Cupos de llamadas al modelo para todo el proceso: los comparten los hilos (invoke) y
+    cualquier event loop (ainvoke). Quien libera un cupo se lo pasa al primero que espera,
+    en orden de llegada, sea un hilo o una corrutina.
+    """
+
+    class _Waiter:
+        __slots__ = ("loop", "signal", "granted")
+
+        def __init__(self, loop, signal):
+            self.loop = loop      # None: hilo que espera en un threading.Event
+            self.signal = signal  # threading.Event o asyncio.Future
+            self.granted = False
+
+    def __init__(self, size: int):
+        self.size = max(size, 1)
+        self._lock = threading.Lock()
+        self._free = self.size
+        self._waiters: Deque["_ModelSlots._Waiter"] = deque()
+        self.peak = 0
+
+    def _take(self, waiter: "_ModelSlots._Waiter") -> bool:
+        with self._lock:
+            if self._free > 0 and not self._waiters:
+                self._free -= 1
+                self.peak = max(self.peak, self.size - self._free)
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def acquire(self) -> None:
+        waiter = self._Waiter(None, threading.Event())
+        if not self._take(waiter):
+            waiter.signal.wait()
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        waiter = self._Waiter(loop, loop.create_future())
+        if self._take(waiter):
+            return
+        try:
+            await waiter.signal
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self.release()  # el cupo ya era nuestro: pasa al siguiente
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self._free += 1
+                return
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+        if waiter.loop is None:
+            waiter.signal.set()
+            return
+        try:
+            waiter.loop.call_soon_threadsafe(_grant, waiter.signal)
+        except RuntimeError:
+            self.release()  # su event loop ya se cerró: nadie va a usar el cupo
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"max": self.size, "in_use": self.size - self._free, "waiting": len(self._waiters), "peak": self.peak}
+
+
+def _grant(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+_slots = _ModelSlots(LLM_MAX_CONCURRENCY)
+
+
+def _run_id(run_manager):
+    return getattr(run_manager, "run_id", None)
+
+
+@contextmanager
+def _llm_slot_sync(model: str, run_id=None) -> Iterator[None]:
+    LLM_WAITING.inc()
+    t0 = time.perf_counter()
+    try:
+        _slots.acquire()
+    finally:
+        LLM_WAITING.dec()
+    record_llm_queue_wait(run_id, time.perf_counter() - t0, model)
+    LLM_INFLIGHT.inc()
+    try:
+        yield
+    finally:
+        LLM_INFLIGHT.dec()
+        _slots.release()
+
+
+@asynccontextmanager
+async def _llm_slot(model: str, run_id=None) -> AsyncIterator[None]:
+    """Cupo del límite global; la espera se registra aparte (span llm_queue) y no cuenta como latencia del modelo."""
+    LLM_WAITING.inc()
+    t0 = time.perf_counter()
+    try:
+        await _slots.aacquire()
+    finally:
+        LLM_WAITING.dec()
+    record_llm_queue_wait(run_id, time.perf_counter() - t0, model)
+    LLM_INFLIGHT.inc()
+    try:
+        yield
+    finally:
+        LLM_INFLIGHT.dec()
+        _slots.release()
+
+
+class GatedChatModel(BaseChatModel):
+    """
+    Envoltorio de un modelo de chat que limita las llamadas en vuelo con un semáforo global.
+    Las tools se enlazan sobre el modelo interno y sus kwargs se reenvían en cada llamada.
+    """
+
+    inner: BaseChatModel
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def model(self) -> str:
+        return getattr(self.inner, "model", None) or self.inner._llm_type
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        binding = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(binding, "kwargs", {}))
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        with _llm_slot_sync(self.model, _run_id(run_manager)):
+            return self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        async with _llm_slot(self.model, _run_id(run_manager)):
+            return await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    def _inner_streams(self) -> bool:
+        cls = type(self.inner)
+        return cls._astream is not BaseChatModel._astream or cls._stream is not BaseChatModel._stream
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        async with _llm_slot(self.model, _run_id(run_manager)):
+            if not self._inner_streams():
+                # El modelo interno no hace streaming: un solo chunk con la respuesta completa
+                result = await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                msg = result.generations[0].message
+                yield ChatGenerationChunk(message=AIMessageChunk(
+                    content=msg.content,
+                    tool_call_chunks=[
+                        {"name": c["name"], "args": json.dumps(c["args"]), "id": c["id"], "index": i}
+                        for i, c in enumerate(getattr(msg, "tool_calls", None) or [])
+                    ],
+                    usage_metadata=getattr(msg, "usage_metadata", None),
+                ))
+                return
+            async for chunk in self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
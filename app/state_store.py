@@ -0,0 +1,176 @@
+# app/state_store.py
+"""
+Estado compartido entre procesos, para correr varios workers de uvicorn (o réplicas
+con el mismo volumen de DATA_DIR).
+- STATE_BACKEND=sqlite (por defecto): DATA_DIR/state.sqlite en modo WAL; cada proceso
+  abre sus conexiones y SQLite serializa las escrituras entre procesos.
+- STATE_BACKEND=memory: en proceso (un solo worker, desarrollo).
+Es un almacén clave-valor de JSON por espacio de nombres; los valores de un mismo grupo
+(p. ej. los documentos de una sesión) se listan en orden de escritura.
+Lo usan el registro de documentos, las credenciales de Google, los jobs de ingesta y
+los anuncios de documentos del agente. El checkpointer sigue el mismo criterio (ver checkpointer).
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite")
+STATE_DB = os.getenv("STATE_DB", os.path.join(os.getenv("DATA_DIR", "data"), "state.sqlite"))
+
+
+class MemoryStateStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {namespace: OrderedDict[key, (group, value, updated)]} en orden de escritura
+        self._data: Dict[str, "OrderedDict[str, tuple]"] = {}
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(namespace, {}).get(key)
+            return json.loads(entry[1]) if entry else None
+
+    def put(self, namespace: str, key: str, value: Any, group: str = "") -> None:
+        raw = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            items = self._data.setdefault(namespace, OrderedDict())
+            items.pop(key, None)
+            items[key] = (group, raw, time.time())
+
+    def update(self, namespace: str, key: str, fn: Callable[[Optional[Any]], Any], group: str = "") -> Any:
+        """Lectura-modificación-escritura atómica: guarda y devuelve fn(valor actual); None elimina la entrada."""
+        with self._lock:
+            items = self._data.setdefault(namespace, OrderedDict())
+            entry = items.pop(key, None)
+            value = fn(json.loads(entry[1]) if entry else None)
+            if value is not None:
+                items[key] = (entry[0] if entry else group, json.dumps(value, ensure_ascii=False), time.time())
+            return value
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._lock:
+            self._data.get(namespace, {}).pop(key, None)
+
+    def items(self, namespace: str, group: str) -> List[Tuple[str, Any]]:
+        with self._lock:
+            entries = list(self._data.get(namespace, {}).items())
+        return [(k, json.loads(raw)) for k, (g, raw, _) in entries if g == group]
+
+    def delete_group(self, namespace: str, group: str) -> None:
+        with self._lock:
+            items = self._data.get(namespace, {})
+            for key in [k for k, (g, _, _) in items.items() if g == group]:
+                del items[key]
+
+    def prune(self, namespace: str, older_than: float) -> int:
+        """Elimina las entradas escritas antes de older_than (epoch). Devuelve cuántas."""
+        with self._lock:
+            items = self._data.get(namespace, {})
+            old = [k for k, (_, _, updated) in items.items() if updated < older_than]
+            for key in old:
+                del items[key]
+        return len(old)
+
+    def count(self, namespace: str) -> Dict[str, int]:
+        with self._lock:
+            entries = list(self._data.get(namespace, {}).values())
+        return {"groups": len({g for g, _, _ in entries}), "entries": len(entries)}
+
+
+class SqliteStateStore:
+    """Mismo contrato que MemoryStateStore sobre un archivo SQLite compartido (una conexión por hilo)."""
+
+    def __init__(self, path: str = STATE_DB):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, grp TEXT NOT NULL, value TEXT NOT NULL, "
+                "updated REAL NOT NULL, PRIMARY KEY (namespace, key))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS state_group ON state (namespace, grp)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # timeout: espera (en vez de fallar) mientras otro proceso escribe
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, namespace: str, key: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, namespace: str, key: str, value: Any, group: str = "") -> None:
+        # REPLACE borra y reinserta: el rowid nuevo deja la entrada al final del grupo
+        self._conn().execute(
+            "INSERT OR REPLACE INTO state (namespace, key, grp, value, updated) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, group, json.dumps(value, ensure_ascii=False), time.time()),
+        )
+
+    def update(self, namespace: str, key: str, fn: Callable[[Optional[Any]], Any], group: str = "") -> Any:
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # toma el lock de escritura antes de leer
+        try:
+            row = conn.execute(
+                "SELECT grp, value FROM state WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            value = fn(json.loads(row[1]) if row else None)
+            if value is None:
+                conn.execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (namespace, key, grp, value, updated) VALUES (?, ?, ?, ?, ?)",
+                    (namespace, key, row[0] if row else group, json.dumps(value, ensure_ascii=False), time.time()),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._conn().execute("DELETE FROM state WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace: str, group: str) -> List[Tuple[str, Any]]:
+        rows = self._conn().execute(
+            "SELECT key, value FROM state WHERE namespace = ? AND grp = ? ORDER BY rowid", (namespace, group)
+        ).fetchall()
+        return [(k, json.loads(v)) for k, v in rows]
+
+    def delete_group(self, namespace: str, group: str) -> None:
+        self._conn().execute("DELETE FROM state WHERE namespace = ? AND grp = ?", (namespace, group))
+
+    def prune(self, namespace: str, older_than: float) -> int:
+        cur = self._conn().execute("DELETE FROM state WHERE namespace = ? AND updated < ?", (namespace, older_than))
+        return cur.rowcount
+
+    def count(self, namespace: str) -> Dict[str, int]:
+        groups, entries = self._conn().execute(
+            "SELECT COUNT(DISTINCT grp), COUNT(*) FROM state WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return {"groups": groups, "entries": entries}
+
+
+def create_state_store(kind: Optional[str] = None):
+    """Fábrica del almacén según STATE_BACKEND (sqlite | memory)."""
+    kind = kind or STATE_BACKEND
+    if kind == "memory":
+        return MemoryStateStore()
+    if kind == "sqlite":
+        return SqliteStateStore(STATE_DB)
+    raise ValueError(f"STATE_BACKEND desconocido: {kind}")
+
+
+# Instancia compartida por el proceso
+state_store = create_state_store()
@@ -0,0 +1,186 @@
+# bench/bench_calendar.py
+"""
+Capa de lectura de Calendar contra el Calendar simulado de bench.fakes (sin red):
+- first_query: la primera consulta lista la ventana del calendario (lo que antes costaría cada consulta)
+- window: una serie semanal sin fin solo aporta las instancias de la ventana
+  (CALENDAR_HORIZON_DAYS desde la consulta), no años de ellas
+- local: consultas de disponibilidad y de eventos servidas desde el índice, sin requests a Google
+- correctness: el índice de intervalos coincide con una búsqueda lineal en rangos aleatorios
+- incremental: tras crear un evento desde la app y borrar otro "desde fuera", la sincronización
+  (updatedMin) trae solo esos cambios
+- expired_update: si Google rechaza el updatedMin (410) se vuelve a listar la ventana
+- outside_window: una consulta fuera de la ventana vuelve a listar con una ventana que la cubre
+
+Uso: python -m bench.bench_calendar [--events 3000] [--latency-ms 80]
+Sale con código 1 si alguna comprobación falla.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-calendar-")
+os.environ.setdefault("STATE_BACKEND", "memory")
+os.environ["CALENDAR_SYNC_SECONDS"] = "3600"  # las sincronizaciones de la prueba se fuerzan con invalidate()
+
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+from app import calendar_cache  # noqa: E402
+from app.google_actions import (  # noqa: E402
+    CalendarEvent, CalendarRange, FreeSlotsQuery, _creds_identity, create_calendar_event,
+    find_free_slots, list_calendar_events, set_http_factory,
+)
+from app.google_oauth import get_credentials, set_credentials  # noqa: E402
+
+from .fakes import StubGoogleHttp  # noqa: E402
+
+START = datetime(2030, 1, 7, tzinfo=calendar_cache._tz())  # lunes
+HORIZON_WEEKS = int(calendar_cache.CALENDAR_HORIZON_DAYS // 7) + 1  # instancias semanales en la ventana
+
+
+def _seed(stub: StubGoogleHttp, events: int, days: int = 90) -> None:
+    rng = random.Random(7)
+    for i in range(events):
+        day = START + timedelta(days=rng.randrange(days))
+        begin = day + timedelta(hours=rng.randrange(8, 19), minutes=rng.choice((0, 15, 30, 45)))
+        if i % 50 == 0:  # algunos de todo el día y algunos marcados como disponibles
+            stub.add_event({"summary": f"Día {i}", "start": {"date": day.date().isoformat()},
+                            "end": {"date": (day + timedelta(days=1)).date().isoformat()}, "transparency": "transparent"})
+            continue
+        end = begin + timedelta(minutes=rng.choice((15, 30, 45, 60, 90)))
+        stub.add_event({"summary": f"Evento {i}", "start": {"dateTime": begin.isoformat()},
+                        "end": {"dateTime": end.isoformat()}})
+
+
+def _ms(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return (time.perf_counter() - t0) * 1000
+
+
+def _week(offset_days: int) -> dict:
+    t0 = START + timedelta(days=offset_days)
+    return {"time_min": t0.isoformat(), "time_max": (t0 + timedelta(days=7)).isoformat()}
+
+
+def run(events: int, latency_ms: float) -> dict:
+    stub = StubGoogleHttp(latency_ms=latency_ms)
+    _seed(stub, events)
+    series = stub.add_event({"summary": "Standup", "recurrence": ["RRULE:FREQ=WEEKLY"],
+                             "start": {"dateTime": (START + timedelta(hours=9)).isoformat()},
+                             "end": {"dateTime": (START + timedelta(hours=9, minutes=30)).isoformat()}})
+    set_http_factory(lambda creds: stub)
+    set_credentials(Credentials(token="bench-token", refresh_token="bench-refresh", client_id="bench"))
+    creds = get_credentials()
+    cache = calendar_cache.cache_for(_creds_identity(creds))
+    report = {"events": events, "latency_ms": latency_ms}
+
+    report["first_query_ms"] = round(_ms(lambda: find_free_slots(creds, FreeSlotsQuery(**_week(0)))), 3)
+    report["full_list_requests"] = stub.list_calls
+    index = cache.index(lambda: None, START.timestamp(), START.timestamp() + 86400)
+    report["window"] = {
+        "listed_items": stub.listed_items,
+        "series_instances": sum(ev.get("recurringEventId") == series["id"] for ev in index.events),
+        "expected_instances": HORIZON_WEEKS,
+    }
+
+    # Consultas locales: disponibilidad y eventos de semanas distintas
+    before = stub.requests
+    samples = {"free_slots": [], "list_events": []}
+    for i in range(2000):
+        week = _week(i % 80)
+        if i % 2:
+            samples["free_slots"].append(_ms(lambda: find_free_slots(creds, FreeSlotsQuery(**week, duration_minutes=45))))
+        else:
+            samples["list_events"].append(_ms(lambda: list_calendar_events(creds, CalendarRange(**week))))
+    report["local"] = {"google_requests": stub.requests - before}
+    for name, values in samples.items():
+        values.sort()
+        report["local"][name] = {
+            "queries": len(values),
+            "p50_us": round(statistics.median(values) * 1000, 1),
+            "p99_us": round(values[int(len(values) * 0.99)] * 1000, 1),
+        }
+
+    # El índice frente a una búsqueda lineal
+    rng = random.Random(11)
+    index = cache.index(lambda: None, START.timestamp(), START.timestamp() + 86400)
+    mismatches = 0
+    for _ in range(500):
+        t0 = START.timestamp() + rng.uniform(0, 90 * 86400)
+        t1 = t0 + rng.uniform(60, 3 * 86400)
+        fast = {ev["id"] for _, ev in index.overlapping(t0, t1)}
+        slow = {ev["id"] for s, e, ev in zip(index.starts, index.ends, index.events) if s < t1 and e > t0}
+        mismatches += fast != slow
+    # Ningún hueco libre se superpone con un evento que ocupa el horario
+    overlaps = 0
+    for i in range(80):
+        for slot in find_free_slots(creds, FreeSlotsQuery(**_week(i), duration_minutes=15, max_slots=100))["slots"]:
+            s0 = calendar_cache.parse_datetime(slot["start"]).timestamp()
+            s1 = calendar_cache.parse_datetime(slot["end"]).timestamp()
+            overlaps += any(calendar_cache.blocks_time(ev) for _, ev in index.overlapping(s0, s1))
+    report["correctness"] = {"ranges": 500, "mismatches": mismatches, "busy_free_slots": overlaps}
+
+    # Cambios: uno creado por la app (invalida la caché) y uno borrado en Google
+    victim = next(
+        ev["id"] for ev in list_calendar_events(creds, CalendarRange(**_week(1)))["events"]
+        if not ev["id"].startswith(series["id"])
+    )
+    listed_before = stub.listed_items
+    created = create_calendar_event(creds, CalendarEvent(
+        summary="Nuevo", start_datetime=(START + timedelta(hours=10)).isoformat(),
+        end_datetime=(START + timedelta(hours=11)).isoformat(),
+    ))
+    stub.delete_event(victim)
+    ids = {ev["id"] for ev in list_calendar_events(creds, CalendarRange(**_week(0)))["events"]}
+    ids |= {ev["id"] for ev in list_calendar_events(creds, CalendarRange(**_week(1)))["events"]}
+    report["incremental"] = {
+        "items_fetched": stub.listed_items - listed_before,
+        "created_visible": created["eventId"] in ids,
+        "deleted_gone": victim not in ids,
+    }
+
+    # updatedMin vencido: 410 y listado completo de la ventana
+    stub.expire_updates()
+    cache.invalidate()
+    list_calendar_events(creds, CalendarRange(**_week(0)))
+    report["expired_update"] = {**cache.stats(), "expected_events": events + HORIZON_WEEKS}
+
+    # Fuera de la ventana: se lista una nueva que cubre la consulta
+    far = list_calendar_events(creds, CalendarRange(**_week(400)))["events"]
+    report["outside_window"] = {**cache.stats(), "standups": sum(ev["summary"] == "Standup" for ev in far)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=3000, help="Eventos en el calendario simulado")
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="Latencia de cada request a Google")
+    args = parser.parse_args()
+    report = run(args.events, args.latency_ms)
+    print(json.dumps(report, indent=2))
+    expired, window, outside = report["expired_update"], report["window"], report["outside_window"]
+    ok = (
+        window["series_instances"] == window["expected_instances"]
+        and window["listed_items"] == args.events + window["expected_instances"]
+        and report["local"]["google_requests"] == 0
+        and report["correctness"]["mismatches"] == 0
+        and report["correctness"]["busy_free_slots"] == 0
+        and report["incremental"] == {"items_fetched": 2, "created_visible": True, "deleted_gone": True}
+        and expired["expired_updates"] == 1
+        and expired["full_syncs"] == 2
+        and expired["events"] == expired["expected_events"]  # +1 creado, -1 borrado
+        and outside["full_syncs"] == 3
+        and outside["standups"] == 1
+        and outside["events"] == HORIZON_WEEKS
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# bench/bench_credentials.py
+"""
+Gestor de credenciales contra un token endpoint local (sin red):
+- stampede: N hilos piden credenciales con el token vencido -> un solo refresco
+- background: con tokens de vida corta, el refresco en segundo plano los renueva antes de que
+  expiren; get() no espera al endpoint (latencia en µs) y nunca devuelve un token vencido
+- restart: un gestor nuevo sobre el mismo almacén recupera el refresh token
+- lease: un worker que espera el lease de otro no refresca si las credenciales se borran, y
+  nadie libera un lease que no es suyo (p. ej. el propio venció y lo tomó otro worker)
+
+Uso: python -m bench.bench_credentials
+Sale con código 1 si alguna comprobación falla.
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-creds-")
+
+from google.auth import _helpers as google_auth_helpers  # noqa: E402
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+from app.credentials import LEASE_KEY, NAMESPACE, CredentialManager  # noqa: E402
+from app.state_store import SqliteStateStore  # noqa: E402
+
+
+class FakeTokenEndpoint:
+    """Token endpoint OAuth2 mínimo: responde grant_type=refresh_token con tokens numerados."""
+
+    def __init__(self, expires_in: int, latency_ms: float = 50.0):
+        self.expires_in = expires_in
+        self.latency_ms = latency_ms
+        self.hits = 0
+        endpoint = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                form = parse_qs(self.rfile.read(int(self.headers["Content-Length"])).decode())
+                time.sleep(endpoint.latency_ms / 1000)
+                endpoint.hits += 1
+                if form.get("refresh_token") != ["fake-refresh"]:
+                    self._reply(400, {"error": "invalid_grant"})
+                    return
+                self._reply(200, {
+                    "access_token": f"tok-{endpoint.hits}",
+                    "expires_in": endpoint.expires_in,
+                    "token_type": "Bearer",
+                })
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.uri = f"http://127.0.0.1:{self.server.server_address[1]}/token"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def _creds(token_uri: str, expires_in: float) -> Credentials:
+    creds = Credentials(
+        token="expired" if expires_in <= 0 else "initial",
+        refresh_token="fake-refresh",
+        token_uri=token_uri,
+        client_id="bench-client",
+        client_secret="bench-secret",
+    )
+    creds.expiry = datetime.utcnow() + timedelta(seconds=expires_in)
+    return creds
+
+
+def bench_stampede(endpoint: FakeTokenEndpoint, store, threads: int = 32) -> dict:
+    manager = CredentialManager(state=store)
+    manager.set(_creds(endpoint.uri, -10))
+    before = endpoint.hits
+    barrier = threading.Barrier(threads)
+    tokens = []
+
+    def worker():
+        barrier.wait()
+        tokens.append(manager.get().token)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return {"threads": threads, "refreshes": endpoint.hits - before, "distinct_tokens": len(set(tokens))}
+
+
+async def bench_background(endpoint: FakeTokenEndpoint, store, seconds: float) -> dict:
+    manager = CredentialManager(state=store, margin=2)
+    manager.set(_creds(endpoint.uri, endpoint.expires_in))
+    before = endpoint.hits
+    refresher = asyncio.create_task(manager.run_refresher())
+    samples, invalid = [], 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter()
+        creds = manager.get()
+        samples.append((time.perf_counter() - t0) * 1000)
+        invalid += not creds.valid
+        await asyncio.sleep(0.01)
+    refresher.cancel()
+    samples.sort()
+    return {
+        "refreshes": endpoint.hits - before,
+        "invalid_reads": invalid,
+        "get_calls": len(samples),
+        "get_p50_ms": round(statistics.median(samples), 4),
+        "get_max_ms": round(samples[-1], 4),
+    }
+
+
+def bench_lease(endpoint: FakeTokenEndpoint, store) -> dict:
+    me, other = CredentialManager(state=store), CredentialManager(state=store)
+    me.set(_creds(endpoint.uri, -10))
+    before = endpoint.hits
+
+    # Otro worker está refrescando; mientras esperamos, se borran las credenciales (logout)
+    assert other._take_lease()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(me.refresh()))
+    waiter.start()
+    time.sleep(0.2)
+    other.set(None)
+    waiter.join()
+    deleted = {
+        "refresh_result": result[0],
+        "endpoint_hits": endpoint.hits - before,
+        "other_lease_kept": (store.get(NAMESPACE, LEASE_KEY) or {}).get("owner") == other._owner,
+    }
+
+    # Nuestro lease venció y lo tomó otro worker: al terminar no se lo borramos
+    store.put(NAMESPACE, LEASE_KEY, {"owner": other._owner, "until": time.time() + 60})
+    me._release_lease()
+    foreign_kept = (store.get(NAMESPACE, LEASE_KEY) or {}).get("owner") == other._owner
+    other._release_lease()
+    return {
+        "creds_deleted_while_waiting": deleted,
+        "foreign_lease_kept_on_release": foreign_kept,
+        "own_lease_released": store.get(NAMESPACE, LEASE_KEY) is None,
+    }
+
+
+def main():
+    # Tokens de pocos segundos: se acorta el margen con el que google-auth los da por vencidos
+    # (3 min 45 s) para que el escenario background dure segundos en lugar de minutos
+    google_auth_helpers.REFRESH_THRESHOLD = timedelta(seconds=1)
+    store = SqliteStateStore(os.path.join(os.environ["DATA_DIR"], "state.sqlite"))
+    stampede = bench_stampede(FakeTokenEndpoint(expires_in=3600), store)
+    background = asyncio.run(bench_background(FakeTokenEndpoint(expires_in=4), store, seconds=9))
+    restarted = CredentialManager(state=SqliteStateStore(store.path)).get()
+    lease = bench_lease(FakeTokenEndpoint(expires_in=3600), store)
+    report = {
+        "stampede": stampede,
+        "background": background,
+        "restart": {"refresh_token_persisted": bool(restarted and restarted.refresh_token == "fake-refresh")},
+        "lease": lease,
+    }
+    print(json.dumps(report, indent=2))
+    ok = (
+        stampede["refreshes"] == 1
+        and stampede["distinct_tokens"] == 1
+        and background["refreshes"] >= 2
+        and background["invalid_reads"] == 0
+        and report["restart"]["refresh_token_persisted"]
+        and lease["creds_deleted_while_waiting"] == {"refresh_result": None, "endpoint_hits": 0, "other_lease_kept": True}
+        and lease["foreign_lease_kept_on_release"] and lease["own_lease_released"]
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
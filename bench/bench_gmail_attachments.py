@@ -0,0 +1,121 @@
+# bench/bench_gmail_attachments.py
+"""
+Envío de correos con un PDF subido como adjunto, contra Gmail simulado (bench.fakes):
+- por tamaño de adjunto: vía usada (raw en JSON o subida reanudable), bloques subidos,
+  pico de memoria de Python durante el envío (tracemalloc) y tiempo
+- el mensaje recibido se vuelve a parsear: encabezados UTF-8 y el adjunto idéntico al original
+Con subida reanudable el pico de memoria es del orden de un bloque, sin importar el tamaño.
+
+Uso: python -m bench.bench_gmail_attachments [--sizes-mb 1 8 24]
+Sale con código 1 si alguna comprobación falla.
+"""
+import argparse
+import email
+import email.policy
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-gmail-")
+os.environ.setdefault("STATE_BACKEND", "memory")
+
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+from app import google_actions  # noqa: E402
+from app.doc_store import doc_store  # noqa: E402
+from app.google_actions import GmailMessage, send_gmail, set_http_factory  # noqa: E402
+from app.google_oauth import get_credentials, set_credentials  # noqa: E402
+
+from .fakes import StubGoogleHttp  # noqa: E402
+
+SESSION = "bench-gmail"
+
+
+def _register_blob(size_mb: float) -> dict:
+    """Un 'PDF' de bytes aleatorios registrado en la sesión, como lo dejaría la ingesta."""
+    base = tempfile.mkdtemp(dir=os.environ["DATA_DIR"])
+    pdf_path, txt_path = os.path.join(base, "document.pdf"), os.path.join(base, "document.txt")
+    digest = hashlib.sha256()
+    with open(pdf_path, "wb") as f:
+        for _ in range(int(size_mb * 16)):
+            block = os.urandom(64 * 1024)
+            digest.update(block)
+            f.write(block)
+    open(txt_path, "w").close()
+    doc_id = digest.hexdigest()[:16]
+    doc_store.register(SESSION, f"contrato {size_mb:g} MB – año.pdf", {
+        "doc_id": doc_id, "pages": 1, "txt_path": txt_path, "index_path": txt_path + ".idx", "pdf_path": pdf_path,
+    })
+    return {"doc_id": doc_id, "sha256": digest.hexdigest()}
+
+
+def _check_message(path: str, expected_sha256: str) -> dict:
+    with open(path, "rb") as f:
+        parsed = email.message_from_binary_file(f, policy=email.policy.default)
+    attachment = next(parsed.iter_attachments())
+    return {
+        "subject_ok": parsed["subject"] == "Contrato firmado – revisión ñ",
+        "filename_ok": attachment.get_filename().endswith("año.pdf"),
+        "attachment_ok": hashlib.sha256(attachment.get_content()).hexdigest() == expected_sha256,
+    }
+
+
+def run(sizes_mb) -> list:
+    stub = StubGoogleHttp(keep_messages=True)
+    set_http_factory(lambda creds: stub)
+    set_credentials(Credentials(token="bench-token", refresh_token="bench-refresh", client_id="bench"))
+    creds = get_credentials()
+    results = []
+    for size_mb in sizes_mb:
+        blob = _register_blob(size_mb)
+        msg = GmailMessage(
+            to="bench@example.com", subject="Contrato firmado – revisión ñ", body="Adjunto el contrato.",
+            attach_doc_ids=[blob["doc_id"]], session_id=SESSION,
+        )
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        send_gmail(creds, msg)
+        seconds = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        sent = stub.sent[-1]
+        results.append({
+            "attachment_mb": size_mb,
+            "message_mb": round(sent["bytes"] / 2 ** 20, 2),
+            "via": sent["via"],
+            "peak_python_mb": round(peak / 2 ** 20, 2),
+            "seconds": round(seconds, 3),
+            **_check_message(sent["path"], blob["sha256"]),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 8, 24], help="Tamaños de adjunto")
+    args = parser.parse_args()
+    results = run(args.sizes_mb)
+    print(json.dumps({
+        "resumable_threshold_mb": google_actions.GMAIL_RESUMABLE_THRESHOLD / 2 ** 20,
+        "upload_chunk_mb": google_actions.GMAIL_UPLOAD_CHUNK_BYTES / 2 ** 20,
+        "sends": results,
+    }, indent=2))
+    # raw: copias del mensaje (base64, JSON del request y lo que decodifica el stub), acotadas por
+    # el umbral; reanudable: un bloque en vuelo, sin importar el tamaño del adjunto
+    threshold_mb = google_actions.GMAIL_RESUMABLE_THRESHOLD / 2 ** 20
+    bounds_mb = {"raw": threshold_mb * 8, "resumable": google_actions.GMAIL_UPLOAD_CHUNK_BYTES * 2 / 2 ** 20}
+    ok = all(
+        r["subject_ok"] and r["filename_ok"] and r["attachment_ok"]
+        and r["via"] == ("resumable" if r["message_mb"] > threshold_mb else "raw")
+        and r["peak_python_mb"] < bounds_mb[r["via"]]
+        for r in results
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
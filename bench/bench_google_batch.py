@@ -0,0 +1,124 @@
+# bench/bench_google_batch.py
+"""
+Lotes de Gmail y Calendar contra el transporte simulado (bench.fakes), que entiende
+multipart/mixed como el endpoint /batch de Google:
+- gmail: N correos en un solo intercambio; uno de ellos lo rechaza el servidor (400)
+- calendar: más eventos que BATCH_LIMIT (varios lotes); uno inválido
+- tools: gmail_send_batch / calendar_create_events_batch informan cada fallo por elemento
+Comprueba que cada resultado corresponde a su elemento, en orden, y que los fallos parciales
+no afectan al resto.
+
+Uso: python -m bench.bench_google_batch [--messages 5] [--events 60]
+Sale con código 1 si alguna comprobación falla.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-batch-")
+os.environ.setdefault("STATE_BACKEND", "memory")
+os.environ["TOOLS_DISPATCH"] = "direct"
+
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+from app.agent_tools import calendar_events_batch_impl, gmail_send_batch_impl  # noqa: E402
+from app.google_actions import (  # noqa: E402
+    BATCH_LIMIT, CalendarEvent, CalendarEventsBatch, GmailBatch, GmailMessage,
+    create_calendar_events_batch, send_gmail_batch, set_http_factory,
+)
+from app.google_oauth import get_credentials, set_credentials  # noqa: E402
+
+from .fakes import StubGoogleHttp  # noqa: E402
+
+REJECT = "rechazado"  # el stub responde 400 a lo que contenga este texto
+
+
+def _event(i: int, bad: bool) -> CalendarEvent:
+    return CalendarEvent(
+        summary=f"{REJECT} {i}" if bad else f"Reunión {i}",
+        start_datetime=f"2030-02-{1 + i % 28:02d}T10:00:00-07:00",
+        end_datetime=f"2030-02-{1 + i % 28:02d}T11:00:00-07:00",
+    )
+
+
+def run(messages: int, events: int) -> dict:
+    stub = StubGoogleHttp(reject_marker=REJECT)
+    set_http_factory(lambda creds: stub)
+    set_credentials(Credentials(token="bench-token", refresh_token="bench-refresh", client_id="bench"))
+    creds = get_credentials()
+    report = {}
+
+    # Gmail: el correo del medio falla
+    bad_mail = messages // 2
+    batch = GmailBatch(messages=[
+        GmailMessage(to=f"{REJECT}@example.com" if i == bad_mail else f"user{i}@example.com", subject=f"Lote {i}", body="hola")
+        for i in range(messages)
+    ])
+    before = stub.requests
+    results = send_gmail_batch(creds, batch)["results"]
+    report["gmail"] = {
+        "http_requests": stub.requests - before,
+        "in_order": [r["index"] for r in results] == list(range(messages)),
+        "recipients_match": [r["to"] for r in results] == [m.to for m in batch.messages],
+        "failed": [r["index"] for r in results if not r["ok"]],
+        "message_ids": len({r["messageId"] for r in results if r["ok"]}),
+        "delivered": len(stub.sent),
+        "error": next((r["error"] for r in results if not r["ok"]), None),
+    }
+
+    # Calendar: más de un lote, el último evento falla
+    bad_event = events - 1
+    batch_calls = stub.batch_calls
+    cal = CalendarEventsBatch(events=[_event(i, i == bad_event) for i in range(events)])
+    results = create_calendar_events_batch(creds, cal)["results"]
+    created = {r["eventId"] for r in results if r["ok"]}
+    report["calendar"] = {
+        "batches": stub.batch_calls - batch_calls,
+        "expected_batches": -(-events // BATCH_LIMIT),
+        "in_order": [r["summary"] for r in results] == [e.summary for e in cal.events],
+        "failed": [r["index"] for r in results if not r["ok"]],
+        "created_in_calendar": len(created & set(stub._events)),
+    }
+
+    # Tools: el mensaje al modelo enumera el fallo con su número de elemento
+    report["tools"] = {
+        "gmail_send_batch": gmail_send_batch_impl([m.model_dump() for m in batch.messages]),
+        "calendar_create_events_batch": calendar_events_batch_impl(
+            [{"summary": e.summary, "start_datetime": e.start_datetime, "end_datetime": e.end_datetime}
+             for e in cal.events[:3] + cal.events[-1:]]
+        ),
+    }
+    report["expected"] = {"bad_mail": bad_mail, "bad_event": bad_event}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5, help="Correos en el lote")
+    parser.add_argument("--events", type=int, default=60, help="Eventos (más de BATCH_LIMIT: varios lotes)")
+    args = parser.parse_args()
+    report = run(max(args.messages, 2), max(args.events, 2))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    gmail, cal, tools = report["gmail"], report["calendar"], report["tools"]
+    ok = (
+        gmail["http_requests"] == 1
+        and gmail["in_order"] and gmail["recipients_match"]
+        and gmail["failed"] == [report["expected"]["bad_mail"]]
+        and gmail["message_ids"] == gmail["delivered"] == args.messages - 1
+        and "400" in (gmail["error"] or "")
+        and cal["batches"] == cal["expected_batches"]
+        and cal["in_order"]
+        and cal["failed"] == [report["expected"]["bad_event"]]
+        and cal["created_in_calendar"] == args.events - 1
+        and tools["gmail_send_batch"].startswith(f"✅ {args.messages - 1}/{args.messages} ")
+        and f"❌ #{report['expected']['bad_mail'] + 1} " in tools["gmail_send_batch"]
+        and tools["calendar_create_events_batch"].startswith("✅ 3/4 ")
+        and "❌ #4 " in tools["calendar_create_events_batch"]
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# bench/bench_google_services.py
+"""
+Micro-benchmark: costo por request de obtener el servicio de Gmail/Calendar
+con build() en cada llamada (antes) vs. la caché de google_actions (después).
+Además, desde varios hilos: un solo servicio por credencial con un transporte por hilo,
+y la caché acotada a SERVICE_CACHE_MAX aunque roten las credenciales.
+No hace llamadas de red: build() usa el discovery empaquetado y nunca se ejecuta un request.
+
+Uso: python -m bench.bench_google_services --iterations 200
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from app import google_actions
+from app.google_actions import get_service, invalidate_services
+
+
+def _measure(fn, iterations: int) -> dict:
+    samples = []
+    tracemalloc.start()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    samples.sort()
+    return {
+        "mean_ms": round(statistics.mean(samples), 4),
+        "p50_ms": round(samples[len(samples) // 2], 4),
+        "p95_ms": round(samples[int(len(samples) * 0.95) - 1], 4),
+        "peak_alloc_kb": round(peak / 1024, 1),
+    }
+
+
+def run(iterations: int) -> dict:
+    creds = Credentials(token="bench-token", refresh_token="bench-refresh", client_id="bench")
+    results = {}
+    for api, version in (("gmail", "v1"), ("calendar", "v3")):
+        invalidate_services()
+        results[f"{api}_{version}"] = {
+            "build_per_request": _measure(
+                lambda: build(api, version, credentials=creds, static_discovery=True, cache_discovery=False),
+                iterations,
+            ),
+            "cached_service": _measure(lambda: get_service(api, version, creds), iterations),
+        }
+    results["threads"] = _threads(creds)
+    return results
+
+
+def _threads(creds, threads: int = 16) -> dict:
+    """Servicios construidos y transportes creados al usar la caché desde un pool de hilos."""
+    invalidate_services()
+    transports = []
+    google_actions.set_http_factory(lambda c: transports.append(threading.get_ident()) or object())
+
+    def use(_):
+        service = get_service("gmail", "v1", creds)
+        service._http._http()  # lo que hace cada request: toma el transporte del hilo
+        return id(service)
+
+    with ThreadPoolExecutor(threads) as pool:
+        services = set(pool.map(use, range(threads * 20)))
+    pool_transports = list(transports)
+    # Credenciales que rotan (otro refresh token cada vez): la caché no pasa del máximo
+    for i in range(google_actions.SERVICE_CACHE_MAX * 2):
+        get_service("gmail", "v1", Credentials(token="t", refresh_token=f"r{i}", client_id="bench"))
+    report = {
+        "threads": threads,
+        "services_built": len(services),
+        "transports": len(pool_transports),
+        "distinct_transport_threads": len(set(pool_transports)),
+        "cache_entries_after_rotation": len(google_actions._services),
+        "cache_max": google_actions.SERVICE_CACHE_MAX,
+    }
+    google_actions.set_http_factory(None)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps(run(args.iterations), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# bench/bench_history.py
+"""
+Almacenamiento por sesión a lo largo de una conversación larga, con el modelo con guion:
+- sqlite y memory: filas/entradas y bytes del thread a los 20 y a los N turnos; con la poda
+  de checkpoints (CHECKPOINT_KEEP) no deben crecer con los turnos
+- el anuncio del documento ([DOCUMENTO ADJUNTO id=...]) sigue en el historial aunque el
+  resumen de turnos anteriores se haya recortado
+- si la sesión se desaloja (TTL/LRU), el siguiente turno vuelve a anunciar el documento
+- el desalojo por TTL borra también el estado compartido de la sesión (documentos y anuncios)
+  y los leases de sesión vencidos
+
+Uso: python -m bench.bench_history [--turns 80]
+Sale con código 1 si alguna comprobación falla.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-history-")
+os.environ.setdefault("STATE_BACKEND", "memory")
+os.environ["TOOLS_DISPATCH"] = "direct"
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from app import agent, checkpointer, scheduler  # noqa: E402
+from app.checkpointer import CHECKPOINT_KEEP, SUMMARY_MAX_CHARS, create_checkpointer  # noqa: E402
+from app.doc_store import doc_store  # noqa: E402
+from app.pdf_ingest import save_pdf_and_text, shutdown_pool  # noqa: E402
+from app.state_store import state_store  # noqa: E402
+
+from .fakes import ScriptedChatModel, make_pdf  # noqa: E402
+
+CHECKPOINTS_AT = 20
+ANNOUNCEMENT = "[DOCUMENTO ADJUNTO"
+
+
+def _sqlite_size(saver, thread_id: str) -> dict:
+    with saver.lock:
+        rows, size = saver.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(checkpoint) + LENGTH(metadata)), 0) FROM checkpoints WHERE thread_id = ?",
+            (thread_id,),
+        ).fetchone()
+        wrows, wsize = saver.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM writes WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+    return {"rows": rows + wrows, "bytes": size + wsize}
+
+
+def _memory_size(saver, thread_id: str) -> dict:
+    checkpoints = [c for ns in saver.storage.get(thread_id, {}).values() for c in ns.values()]
+    blobs = [v for k, v in saver.blobs.items() if k[0] == thread_id]
+    writes = [w for k, ws in saver.writes.items() if k[0] == thread_id for w in ws.values()]
+    size = sum(len(c[0][1]) + len(c[1][1]) for c in checkpoints)
+    size += sum(len(b[1]) for b in blobs) + sum(len(w[2][1]) for w in writes)
+    return {"rows": len(checkpoints) + len(blobs) + len(writes), "bytes": size}
+
+
+def _messages(session_id: str) -> list:
+    saved = agent._memory.get_tuple({"configurable": {"thread_id": session_id, "checkpoint_ns": ""}})
+    return saved.checkpoint["channel_values"]["messages"] if saved else []
+
+
+async def _conversation(kind: str, turns: int, doc: dict) -> dict:
+    agent._memory = create_checkpointer(kind, on_evict=agent._drop_sessions)
+    agent.set_chat_model(ScriptedChatModel(tool_plan="pdf_query"))
+    measure = _sqlite_size if kind == "sqlite" else _memory_size
+    session = f"history-{kind}"
+    doc_store.register(session, "contrato.pdf", doc)
+    report = {}
+    for turn in range(1, turns + 1):
+        question = f"turno {turn}: ¿qué dice el contrato sobre el plazo de entrega y la penalización? " * 3
+        await agent.answer_async(session, question)
+        if turn in (CHECKPOINTS_AT, turns):
+            report[f"turn_{turn}"] = measure(agent._memory, session)
+    history = " ".join(str(m.content) for m in _messages(session))
+    report["announcement_kept"] = ANNOUNCEMENT in history
+
+    # Sesión desalojada: el siguiente turno empieza de cero y vuelve a anunciar el documento
+    agent._memory.delete_thread(session)
+    await agent.answer_async(session, "¿y el monto?")
+    first = next((m for m in _messages(session) if isinstance(m, HumanMessage)), None)
+    report["reannounced_after_eviction"] = bool(first) and ANNOUNCEMENT in str(first.content)
+
+    # Desalojo por TTL: con la sesión vencida se va también su estado compartido
+    stale_lease = f"{session}-lease"
+    state_store.put(scheduler.SESSION_LEASE_NAMESPACE, stale_lease, {"owner": "caído", "until": 0})
+    ttl, lease_seconds = checkpointer.SESSION_TTL_SECONDS, scheduler.SESSION_LEASE_SECONDS
+    checkpointer.SESSION_TTL_SECONDS = scheduler.SESSION_LEASE_SECONDS = -1  # todo cuenta como vencido
+    try:
+        evicted = agent._memory.evict()
+    finally:
+        checkpointer.SESSION_TTL_SECONDS, scheduler.SESSION_LEASE_SECONDS = ttl, lease_seconds
+    report["ttl_eviction"] = {
+        "evicted": evicted,
+        "history_left": len(_messages(session)),
+        "documents_left": len(doc_store.list(session)),
+        "announced_left": state_store.get(agent.ANNOUNCED_NAMESPACE, session) is not None,
+        "stale_lease_left": state_store.get(scheduler.SESSION_LEASE_NAMESPACE, stale_lease) is not None,
+    }
+    return report
+
+
+async def run(turns: int) -> dict:
+    doc = save_pdf_and_text(make_pdf(12), "contrato.pdf")
+    report = {"turns": turns, "checkpoint_keep": CHECKPOINT_KEEP, "summary_max_chars": SUMMARY_MAX_CHARS}
+    for kind in ("sqlite", "memory"):
+        report[kind] = await _conversation(kind, turns, doc)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=80, help="Turnos de la conversación")
+    args = parser.parse_args()
+    turns = max(args.turns, CHECKPOINTS_AT + 1)
+    try:
+        report = asyncio.run(run(turns))
+    finally:
+        shutdown_pool()
+    print(json.dumps(report, indent=2))
+    ok = True
+    for kind in ("sqlite", "memory"):
+        r = report[kind]
+        early, late = r[f"turn_{CHECKPOINTS_AT}"], r[f"turn_{turns}"]
+        # Acotado: el último checkpoint lleva el resumen (tope fijo) y los últimos turnos
+        ok &= late["rows"] <= early["rows"] and late["bytes"] <= early["bytes"] * 1.25
+        ok &= r["announcement_kept"] and r["reannounced_after_eviction"]
+        ok &= r["ttl_eviction"] == {
+            "evicted": 1, "history_left": 0, "documents_left": 0, "announced_left": False, "stale_lease_left": False,
+        }
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# bench/bench_response_cache.py
+"""
+Caché de respuestas (RESPONSE_CACHE=1) con el modelo con guion y varias sesiones sobre
+el mismo documento:
+- primer turno: la misma pregunta en otra sesión se sirve desde la caché
+- seguimiento que depende de la conversación ("¿y eso?"): solo acierta en una sesión con los
+  mismos turnos anteriores, nunca en una que habló de otra cosa
+- RESPONSE_CACHE_HISTORY_TURNS=0: los turnos con historial no se cachean
+
+Uso: python -m bench.bench_response_cache
+Sale con código 1 si alguna comprobación falla.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-response-cache-")
+os.environ.setdefault("STATE_BACKEND", "memory")
+os.environ["TOOLS_DISPATCH"] = "direct"
+os.environ["RESPONSE_CACHE"] = "1"
+
+from app import agent  # noqa: E402
+from app.doc_store import doc_store  # noqa: E402
+from app.pdf_ingest import save_pdf_and_text, shutdown_pool  # noqa: E402
+
+from .fakes import ScriptedChatModel, make_pdf  # noqa: E402
+
+FOLLOW_UP = "¿y eso desde cuándo aplica?"
+
+
+async def _turns(session: str, doc: dict, questions: list) -> list:
+    """Hace los turnos y devuelve, por cada uno, si se sirvió desde la caché."""
+    doc_store.register(session, "contrato.pdf", doc)
+    served = []
+    for question in questions:
+        hits = agent._response_cache.stats()["hits"]
+        await agent.answer_async(session, question)
+        served.append(agent._response_cache.stats()["hits"] > hits)
+    return served
+
+
+async def run() -> dict:
+    doc = save_pdf_and_text(make_pdf(12), "contrato.pdf")
+    agent.set_chat_model(ScriptedChatModel(tool_plan="pdf_query"))
+    plazo, monto = "¿qué dice sobre el plazo de entrega?", "¿cuál es el monto total?"
+    report = {"history_turns": agent.RESPONSE_CACHE_HISTORY_TURNS}
+    report["a"] = await _turns("rc-a", doc, [plazo, FOLLOW_UP])
+    report["same_history"] = await _turns("rc-b", doc, [plazo, FOLLOW_UP])
+    report["other_history"] = await _turns("rc-c", doc, [monto, FOLLOW_UP])
+
+    agent.RESPONSE_CACHE_HISTORY_TURNS = 0
+    agent._response_cache.clear()
+    report["no_history_a"] = await _turns("rc-d", doc, [plazo, FOLLOW_UP])
+    report["no_history_b"] = await _turns("rc-e", doc, [plazo, FOLLOW_UP])
+    report["stats"] = agent._response_cache.stats()
+    return report
+
+
+def main():
+    try:
+        report = asyncio.run(run())
+    finally:
+        shutdown_pool()
+    print(json.dumps(report, indent=2))
+    ok = (
+        report["a"] == [False, False]
+        and report["same_history"] == [True, True]
+        and report["other_history"] == [False, False]
+        and report["no_history_a"] == [False, False]
+        and report["no_history_b"] == [True, False]
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+# bench/bench_scheduler.py
+"""
+Límite de llamadas al modelo (GatedChatModel) con el modelo con guion (latencia fija):
+- hilos con invoke y dos event loops con ainvoke a la vez: nunca más de LLM_MAX_CONCURRENCY
+  llamadas en vuelo en el proceso
+- muchos event loops sucesivos (asyncio.run) y esperas canceladas: no quedan cupos tomados
+- admisión: una ráfaga de turnos de sesiones distintas con una cola global chica; solo entran
+  LLM_MAX_CONCURRENCY + AGENT_QUEUE_MAX, el resto se rechaza con 503 y Retry-After
+
+Uso: python -m bench.bench_scheduler [--calls 48] [--latency-ms 50]
+Sale con código 1 si alguna comprobación falla.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-scheduler-")
+os.environ.setdefault("STATE_BACKEND", "memory")
+
+from langchain_core.messages import HumanMessage  # noqa: E402
+
+from app import scheduler  # noqa: E402
+from app.scheduler import LLM_MAX_CONCURRENCY, GatedChatModel, Overloaded, Scheduler  # noqa: E402
+
+from .fakes import ScriptedChatModel  # noqa: E402
+
+MESSAGES = [HumanMessage(content="hola")]
+
+
+def _mixed(llm, calls: int) -> dict:
+    """Un tercio de las llamadas desde hilos (invoke) y el resto desde dos event loops (ainvoke)."""
+    per_part = max(calls // 3, 1)
+
+    async def many():
+        await asyncio.gather(*(llm.ainvoke(MESSAGES) for _ in range(per_part)))
+
+    threads = [threading.Thread(target=llm.invoke, args=(MESSAGES,)) for _ in range(per_part)]
+    threads += [threading.Thread(target=asyncio.run, args=(many(),)) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return scheduler._slots.stats()
+
+
+def _loops_and_cancel(llm, loops: int) -> dict:
+    """Cada asyncio.run es un event loop nuevo; en cada uno se cancela una espera a medias."""
+
+    async def one():
+        calls = [asyncio.ensure_future(llm.ainvoke(MESSAGES)) for _ in range(LLM_MAX_CONCURRENCY + 2)]
+        await asyncio.sleep(0.01)
+        calls[-1].cancel()  # todavía esperando cupo
+        await asyncio.gather(*calls, return_exceptions=True)
+
+    for _ in range(loops):
+        asyncio.run(one())
+    return scheduler._slots.stats()
+
+
+async def _burst(llm, turns: int, queue_max: int) -> dict:
+    """Un turno por sesión, todos a la vez, como una ráfaga de requests de usuarios distintos."""
+    sched = Scheduler(global_queue_max=queue_max, session_queue_max=1, leases=False)
+    rejected = []
+    peak = {"admitted": 0}
+
+    async def turn(i: int) -> None:
+        try:
+            async with sched.session_turn(f"burst-{i}"):
+                stats = sched.stats()
+                peak["admitted"] = max(peak["admitted"], stats["active"] + stats["waiting"])
+                await llm.ainvoke(MESSAGES)
+        except Overloaded as e:
+            rejected.append((e.status_code, e.retry_after))
+
+    await asyncio.gather(*(turn(i) for i in range(turns)))
+    return {
+        "turns": turns,
+        "queue_max": queue_max,
+        "max_admitted_at_once": peak["admitted"],
+        "rejected": len(rejected),
+        "rejected_503_with_retry_after": sum(1 for code, after in rejected if code == 503 and after > 0),
+        "after": sched.stats(),
+    }
+
+
+def run(calls: int, latency_ms: float) -> dict:
+    llm = GatedChatModel(inner=ScriptedChatModel(tool_plan="", latency_ms=latency_ms))
+    return {
+        "llm_max_concurrency": LLM_MAX_CONCURRENCY,
+        "mixed": _mixed(llm, calls),
+        "loops_and_cancel": _loops_and_cancel(llm, 20),
+        "burst": asyncio.run(_burst(llm, 200, 2)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=48, help="Llamadas al modelo a la vez (hilos + event loops)")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Latencia de cada llamada al modelo")
+    args = parser.parse_args()
+    report = run(max(args.calls, 3 * LLM_MAX_CONCURRENCY), args.latency_ms)
+    print(json.dumps(report, indent=2))
+    mixed, loops, burst = report["mixed"], report["loops_and_cancel"], report["burst"]
+    ok = (
+        mixed["peak"] == LLM_MAX_CONCURRENCY
+        and loops["peak"] == LLM_MAX_CONCURRENCY
+        and loops["in_use"] == 0 and loops["waiting"] == 0
+        and burst["max_admitted_at_once"] <= LLM_MAX_CONCURRENCY + burst["queue_max"]
+        and burst["rejected"] == burst["rejected_503_with_retry_after"] > 0
+        and burst["after"]["active"] == burst["after"]["queued"] == 0
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# bench/bench_startup.py
+"""
+Arranque en frío: cada medición corre en un proceso nuevo.
+- import_s: tiempo de `import app.main`
+- ready_s: desde el import hasta que el calentamiento del lifespan termina (/health/ready)
+- first_invoke_ms: primer POST /agent/invoke, con el lifespan ("warm") o sin él ("lazy":
+  el primer usuario paga la construcción del agente)
+Usa el modelo con guion de bench.fakes; no requiere red ni GOOGLE_API_KEY.
+
+Uso: python -m bench.bench_startup [--runs 5] [--out startup.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def _child(mode: str) -> dict:
+    t0 = time.perf_counter()
+    import app.main as main  # noqa: E402
+    import_s = time.perf_counter() - t0
+
+    import httpx
+    from app import agent
+    from .fakes import ScriptedChatModel
+
+    agent.set_chat_model(ScriptedChatModel(tool_plan=""))
+
+    async def run() -> dict:
+        out = {"import_s": round(import_s, 4)}
+        transport = httpx.ASGITransport(app=main.app)  # no ejecuta el lifespan: se entra a mano
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            if mode == "warm":
+                async with main.app.router.lifespan_context(main.app):
+                    while not (await client.get("/health")).json()["ready"]:
+                        await asyncio.sleep(0.005)
+                    out["ready_s"] = round(time.perf_counter() - t0, 4)
+                    out["first_invoke_ms"] = await _invoke(client)
+            else:
+                out["first_invoke_ms"] = await _invoke(client)
+            out["second_invoke_ms"] = await _invoke(client)
+        return out
+
+    return asyncio.run(run())
+
+
+async def _invoke(client) -> float:
+    t0 = time.perf_counter()
+    res = await client.post("/agent/invoke", json={"session_id": "startup", "input": "hola"})
+    res.raise_for_status()
+    return round((time.perf_counter() - t0) * 1000, 3)
+
+
+def _spawn(mode: str) -> dict:
+    env = dict(os.environ, DATA_DIR=tempfile.mkdtemp(prefix="bench-startup-"), CHECKPOINTER="memory")
+    out = subprocess.run(
+        [sys.executable, "-m", "bench.bench_startup", "--child", mode],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _summary(samples: list) -> dict:
+    keys = samples[0].keys()
+    return {k: round(statistics.median(s[k] for s in samples), 4) for k in keys}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Procesos por modo")
+    parser.add_argument("--out", help="Ruta del JSON de resultados")
+    parser.add_argument("--child", choices=["warm", "lazy"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(_child(args.child)))
+        return
+
+    report = {mode: _summary([_spawn(mode) for _ in range(args.runs)]) for mode in ("warm", "lazy")}
+    report["runs"] = args.runs
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
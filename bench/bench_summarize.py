@@ -0,0 +1,170 @@
+# bench/bench_summarize.py
+"""
+Resumen map-reduce de un PDF sintético largo con el modelo con guion (latencia fija por llamada):
+- cold: sin caché en disco, con 1, 4 y 8 resúmenes parciales a la vez
+- warm: el mismo documento otra vez; todos los resúmenes salen de la caché (0 llamadas al modelo)
+- sync: summarize_document_sync (pool de hilos) con el mismo resultado y paralelismo que la
+  versión async; la tool síncrona pdf_summarize comparte los cupos del modelo con la async
+- disco: el barrido deja DATA_DIR/summaries bajo el límite, desalojando lo menos usado
+- denso: con un presupuesto por llamada menor que una página, cada entrada del map y del
+  reduce cabe en el presupuesto y entre todas contienen todo el texto (nada se recorta)
+Cada llamada pasa por GatedChatModel, igual que en el agente.
+
+Uso: python -m bench.bench_summarize [--pages 200] [--latency-ms 200]
+Sale con código 1 si alguna comprobación falla.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-summary-")
+os.environ.setdefault("STATE_BACKEND", "memory")
+
+from langchain_core.messages import AIMessage  # noqa: E402
+
+from app import agent, pdf_summarize, scheduler  # noqa: E402
+from app.agent_tools import pdf_summarize_impl  # noqa: E402
+from app.context_budget import TRIM_MARKER, estimate_tokens  # noqa: E402
+from app.doc_store import doc_store  # noqa: E402
+from app.pdf_ingest import save_pdf_and_text, shutdown_pool  # noqa: E402
+from app.scheduler import GatedChatModel  # noqa: E402
+
+from .fakes import ScriptedChatModel, make_pdf  # noqa: E402
+
+
+async def _timed(doc: dict, llm, concurrency: int, sync: bool = False) -> dict:
+    t0 = time.perf_counter()
+    if sync:
+        result = await asyncio.to_thread(pdf_summarize.summarize_document_sync, doc, llm, concurrency)
+    else:
+        result = await pdf_summarize.summarize_document(doc, llm=llm, max_concurrency=concurrency)
+    return {
+        "concurrency": concurrency,
+        "seconds": round(time.perf_counter() - t0, 3),
+        "chunks": result["chunks"],
+        "reduce_levels": result["reduce_levels"],
+        "llm_calls": result["llm_calls"],
+        "cached_parts": result["cached_parts"],
+        "summary": result["summary"],
+    }
+
+
+def _disk_bytes() -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, files in os.walk(pdf_summarize.SUMMARIES_DIR) for name in files
+    )
+
+
+def _tool_sync(session: str, latency_ms: float) -> dict:
+    """La tool síncrona, con el modelo del agente, desde un hilo sin event loop."""
+    agent.set_chat_model(ScriptedChatModel(tool_plan="", latency_ms=latency_ms))
+    shutil.rmtree(pdf_summarize.SUMMARIES_DIR, ignore_errors=True)
+    out = pdf_summarize_impl(config={"configurable": {"thread_id": session}})
+    return {"ok": out.startswith("📄 Resumen"), "llm_slots": scheduler._slots.stats()}
+
+
+def _disk() -> dict:
+    before = _disk_bytes()
+    removed = pdf_summarize.evict_summaries(max_bytes=before // 2)
+    return {"bytes_before": before, "bytes_after": _disk_bytes(), "max_bytes": before // 2, "removed": removed}
+
+
+def _words(texts: list) -> Counter:
+    """Palabras del texto, sin los encabezados de página ni los separadores que agrega el map-reduce."""
+    lines = (line for text in texts for line in text.split("\n") if not line.startswith("[Página ") and line != "---")
+    return Counter(word for line in lines for word in line.split())
+
+
+async def _dense(doc: dict, llm) -> dict:
+    """Presupuesto por llamada de media página: ningún rango ni grupo de resúmenes cabe entero."""
+    page_text = doc_store.read_pages(doc, 1)[1]
+    budget = pdf_summarize.SUMMARY_CHUNK_TOKENS
+    pdf_summarize.SUMMARY_CHUNK_TOKENS = max(estimate_tokens(page_text) // 2, 16)
+    try:
+        limit = pdf_summarize.SUMMARY_CHUNK_TOKENS
+        texts = [t for s, e in pdf_summarize.page_ranges(doc["pages"]) for t in pdf_summarize._range_texts(doc, s, e)]
+        pages = doc_store.read_pages(doc, 1, doc["pages"])
+        # Resúmenes parciales chicos (se agrupan) y alguno más largo que el presupuesto (se parte)
+        flat = " ".join(page_text.split())
+        partials = [flat[: limit * (6 if i % 4 == 0 else 1)] + f" fin-{i}" for i in range(12)]
+        groups = pdf_summarize._reduce_inputs(partials)
+        shutil.rmtree(pdf_summarize.SUMMARIES_DIR, ignore_errors=True)
+        result = await pdf_summarize.summarize_document(doc, llm=llm, max_concurrency=8)
+    finally:
+        pdf_summarize.SUMMARY_CHUNK_TOKENS = budget
+    return {
+        "budget_tokens": limit,
+        "map_inputs": len(texts),
+        "map_max_tokens": max(estimate_tokens(t) for t in texts),
+        "map_covers_text": _words(texts) == _words(list(pages.values())),
+        "reduce_groups": len(groups),
+        "reduce_max_tokens": max(estimate_tokens(g) for g in groups),
+        "reduce_covers_parts": _words(groups) == _words(partials),
+        "trimmed": any(TRIM_MARKER in t for t in texts + groups),
+        "chunks": result["chunks"],
+        "summary": bool(result["summary"]),
+    }
+
+
+async def run(pages: int, latency_ms: float) -> dict:
+    doc = doc_store.register("bench-summary", "largo.pdf", save_pdf_and_text(make_pdf(pages), "largo.pdf"))
+    llm = GatedChatModel(inner=ScriptedChatModel(tool_plan="", latency_ms=latency_ms))
+    cold = []
+    for concurrency in (1, 4, 8):
+        shutil.rmtree(pdf_summarize.SUMMARIES_DIR, ignore_errors=True)
+        cold.append(await _timed(doc, llm, concurrency))
+    warm = await _timed(doc, llm, 4)
+    shutil.rmtree(pdf_summarize.SUMMARIES_DIR, ignore_errors=True)
+    sync = await _timed(doc, llm, 4, sync=True)
+    tool_sync = await asyncio.to_thread(_tool_sync, "bench-summary", latency_ms)
+    # Contenido en partes (lista): se guarda el texto, no la repr de la lista
+    parts_text = pdf_summarize._Summarizer._store("0" * 64, AIMessage(content=[{"type": "text", "text": "Resumen."}]))
+    return {
+        "pages": pages, "latency_ms": latency_ms, "cold": cold, "warm": warm, "sync": sync,
+        "tool_sync": tool_sync, "parts_text": parts_text, "disk": _disk(), "dense": await _dense(doc, llm),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=200, help="Páginas del PDF sintético")
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Latencia de cada llamada al modelo")
+    args = parser.parse_args()
+    try:
+        report = asyncio.run(run(args.pages, args.latency_ms))
+    finally:
+        shutdown_pool()
+    for r in report["cold"] + [report["warm"], report["sync"]]:
+        r["summary"] = r["summary"][:60]
+    summaries = {r["summary"] for r in report["cold"] + [report["sync"]]}
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    serial, parallel, sync, disk = report["cold"][0], report["cold"][1], report["sync"], report["disk"]
+    dense = report["dense"]
+    ok = (
+        serial["llm_calls"] == parallel["llm_calls"] == sync["llm_calls"] > 0
+        and parallel["seconds"] < serial["seconds"] / 2
+        and sync["seconds"] < serial["seconds"] / 2
+        and len(summaries) == 1
+        and report["warm"]["llm_calls"] == 0
+        and report["tool_sync"]["ok"]
+        and report["tool_sync"]["llm_slots"]["peak"] <= scheduler.LLM_MAX_CONCURRENCY
+        and report["parts_text"] == "Resumen."
+        and disk["removed"] > 0 and disk["bytes_after"] <= disk["max_bytes"]
+        and dense["map_inputs"] >= 2 * report["pages"] and dense["chunks"] == dense["map_inputs"]
+        and dense["map_max_tokens"] <= dense["budget_tokens"]
+        and dense["reduce_max_tokens"] <= dense["budget_tokens"]
+        and dense["map_covers_text"] and dense["reduce_covers_parts"]
+        and not dense["trimmed"] and dense["summary"]
+    )
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+# bench/fakes.py
+"""
+Dobles locales para los benchmarks (sin red):
+- ScriptedChatModel: modelo de chat con guion determinista en lugar de Gemini.
+- StubGoogleHttp: transporte tipo httplib2 que responde como Gmail/Calendar.
+- make_pdf: genera PDFs sintéticos de N páginas con texto extraíble.
+"""
+import asyncio
+import base64
+import email.parser
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs
+
+import httplib2
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from app import calendar_cache
+
+
+# ---------- Modelo de chat ----------
+class ScriptedChatModel(BaseChatModel):
+    """
+    Sin estado entre llamadas (seguro con concurrencia):
+    - si el último mensaje es del usuario, pide la tool `tool_plan` `fanout` veces en un mismo
+      paso (o responde si está vacío);
+    - si es el resultado de una tool, responde con texto final.
+    """
+
+    tool_plan: str = "pdf_query"
+    latency_ms: float = 0.0
+    fanout: int = 1  # llamadas independientes a la tool en un mismo AIMessage
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-fake"
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ScriptedChatModel":
+        return self
+
+    def _tool_args(self, text: str) -> dict:
+        if self.tool_plan == "gmail_send":
+            return {"to": "bench@example.com", "subject": "Bench", "body": text[:200]}
+        if self.tool_plan == "calendar_create_event":
+            return {
+                "summary": "Bench",
+                "start_datetime": "2030-01-01T10:00:00-07:00",
+                "end_datetime": "2030-01-01T11:00:00-07:00",
+            }
+        return {"question": text[-200:]}
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1]
+        text = last.content if isinstance(last.content, str) else str(last.content)
+        prompt_chars = sum(len(str(m.content)) for m in messages)
+        usage = {"input_tokens": prompt_chars // 4, "output_tokens": 16, "total_tokens": prompt_chars // 4 + 16}
+        if isinstance(last, HumanMessage) and self.tool_plan:
+            return AIMessage(
+                content="",
+                tool_calls=[
+                    {"name": self.tool_plan, "args": self._tool_args(text), "id": f"call_{uuid.uuid4().hex[:8]}"}
+                    for _ in range(max(self.fanout, 1))
+                ],
+                usage_metadata=usage,
+            )
+        return AIMessage(content=f"Listo. {text[:80]}", usage_metadata=usage)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+
+# ---------- Transporte de Google ----------
+class StubGoogleHttp:
+    """
+    Responde a las rutas de Gmail/Calendar que usa google_actions, con latencia opcional.
+    Calendar guarda los eventos insertados con un reloj lógico de cambios ("updated"): events.list
+    filtra por timeMin/timeMax, con updatedMin devuelve solo lo que cambió desde entonces (410 si es
+    anterior a expire_updates) y pagina con maxResults. Las series ("recurrence") se tratan como
+    semanales sin fin: con singleEvents se expanden hasta timeMax, o 10 años si no lo hay.
+Los lotes (POST /batch/..., multipart/mixed) se resuelven parte por parte con las mismas rutas.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, keep_messages: bool = False, reject_marker: Optional[str] = None):
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self.batch_calls = 0
+        # Correos o eventos que contienen este texto se rechazan con 400 (fallos parciales en lotes)
+        self.reject_marker = reject_marker
+        # Gmail: mensajes recibidos (tamaño, vía de subida y, con keep_messages, su archivo .eml)
+        self.keep_messages = keep_messages
+        self.sent: List[dict] = []
+        self._uploads: Dict[str, dict] = {}
+        self._spool = tempfile.mkdtemp(prefix="stub-gmail-") if keep_messages else None
+        self.list_calls = 0
+        self.listed_items = 0
+        self._lock = threading.Lock()
+        self._events: Dict[str, dict] = {}
+        self._updated_at: Dict[str, int] = {}  # id -> tick del reloj lógico en que cambió
+        self._clock = 0
+        self._oldest_update = 0  # expire_updates: un updatedMin anterior responde 410
+
+    # ---------- Gmail simulado ----------
+    def _record_sent(self, via: str, size: int, path: Optional[str]) -> dict:
+        with self._lock:
+            sent = {"id": f"msg-{len(self.sent) + 1}", "via": via, "bytes": size, "path": path}
+            self.sent.append(sent)
+        return {"id": sent["id"], "threadId": f"thr-{sent['id']}"}
+
+    def _send_raw(self, raw: bytes) -> dict:
+        path = None
+        if self.keep_messages:
+            path = os.path.join(self._spool, f"{uuid.uuid4().hex}.eml")
+            with open(path, "wb") as f:
+                f.write(raw)
+        return self._record_sent("raw", len(raw), path)
+
+    def _start_upload(self, headers) -> httplib2.Response:
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self._spool, f"{upload_id}.eml") if self.keep_messages else None
+        total = int((headers or {}).get("X-Upload-Content-Length", 0))
+        with self._lock:
+            self._uploads[upload_id] = {"received": 0, "total": total, "path": path, "chunks": 0}
+        return httplib2.Response({"status": 200, "location": f"https://upload.stub/{upload_id}"})
+
+    def _upload_chunk(self, uri: str, body, headers):
+        upload = self._uploads[uri.rsplit("/", 1)[1]]
+        data = body.read() if hasattr(body, "read") else (body or b"")
+        if upload["path"]:
+            with open(upload["path"], "ab") as f:
+                f.write(data)
+        upload["received"] += len(data)
+        upload["chunks"] += 1
+        total = int(headers["Content-Range"].rsplit("/", 1)[1])
+        if upload["received"] < total:
+            return httplib2.Response({"status": 308, "range": f"bytes=0-{upload['received'] - 1}"}), b""
+        payload = self._record_sent("resumable", upload["received"], upload["path"])
+        payload["chunks"] = upload["chunks"]
+        return httplib2.Response({"status": 200, "content-type": "application/json"}), json.dumps(payload).encode()
+
+    # ---------- Calendar simulado ----------
+    @staticmethod
+    def _stamp(tick: int) -> str:
+        return datetime.fromtimestamp(tick, timezone.utc).isoformat()
+
+    def _touch(self, event: dict) -> dict:
+        self._clock += 1
+        event["updated"] = self._stamp(self._clock)
+        self._events[event["id"]] = event
+        self._updated_at[event["id"]] = self._clock
+        return event
+
+    def add_event(self, body: dict) -> dict:
+        with self._lock:
+            event_id = body.get("id") or f"evt-{uuid.uuid4().hex[:12]}"
+            event = {**body, "id": event_id, "status": "confirmed", "htmlLink": f"https://calendar.example/{event_id}"}
+            return self._touch(event)
+
+    def delete_event(self, event_id: str) -> None:
+        with self._lock:
+            self._touch({**self._events.get(event_id, {"id": event_id}), "status": "cancelled"})
+
+    def expire_updates(self) -> None:
+        """Cualquier updatedMin dado hasta ahora responde 410."""
+        with self._lock:
+            self._clock += 1
+            self._oldest_update = self._clock
+
+    @staticmethod
+    def _instances(series: dict, t0: float, t1: float) -> List[dict]:
+        """Instancias semanales de la serie que se superponen con [t0, t1)."""
+        start = calendar_cache.parse_datetime(series["start"]["dateTime"])
+        length = calendar_cache.parse_datetime(series["end"]["dateTime"]) - start
+        out = []
+        while start.timestamp() < t1:
+            if (start + length).timestamp() > t0:
+                stamp = start.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+                instance = {k: v for k, v in series.items() if k != "recurrence"}
+                out.append({
+                    **instance,
+                    "id": f"{series['id']}_{stamp}",
+                    "recurringEventId": series["id"],
+                    "originalStartTime": {"dateTime": start.isoformat()},
+                    "start": {"dateTime": start.isoformat()},
+                    "end": {"dateTime": (start + length).isoformat()},
+                })
+            start += timedelta(weeks=1)
+        return out
+
+    def _list_events(self, query: dict):
+        with self._lock:
+            self.list_calls += 1
+            t0 = calendar_cache.parse_datetime(query["timeMin"]).timestamp() if "timeMin" in query else float("-inf")
+            t1 = calendar_cache.parse_datetime(query["timeMax"]).timestamp() if "timeMax" in query else float("inf")
+            events = list(self._events.values())
+            if "updatedMin" in query:
+                since = int(datetime.fromisoformat(query["updatedMin"]).timestamp())
+                if since < self._oldest_update:
+                    return 410, {"error": {"code": 410, "message": "updatedMin is too old"}}
+                events = [e for e in events if self._updated_at[e["id"]] > since]
+            if query.get("showDeleted") != "true":
+                events = [e for e in events if e["status"] != "cancelled"]
+            items = []
+            for event in events:
+                if event.get("recurrence") and query.get("singleEvents") == "true":
+                    end = min(t1, calendar_cache.parse_datetime(event["start"]["dateTime"]).timestamp() + 10 * 365 * 86400)
+                    items += self._instances(event, t0, end)
+                elif (bounds := calendar_cache._event_bounds(event)) is None or (bounds[1] > t0 and bounds[0] < t1):
+                    items.append(event)
+            offset = int(query.get("pageToken", 0))
+            size = int(query.get("maxResults", 250))
+            page = items[offset:offset + size]
+            self.listed_items += len(page)
+            payload = {"items": page, "updated": self._stamp(self._clock)}
+        if offset + size < len(items):
+            payload["nextPageToken"] = str(offset + size)
+        return 200, payload
+
+    # ---------- Lotes (multipart/mixed) ----------
+    def _batch(self, body, headers) -> tuple:
+        """Ejecuta cada parte application/http del lote y responde un multipart con el mismo Content-ID."""
+        content_type = {k.lower(): v for k, v in (headers or {}).items()}["content-type"]
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+        parsed = email.parser.Parser().parsestr(f"content-type: {content_type}\r\n\r\n{body}")
+        boundary = f"batch_{uuid.uuid4().hex}"
+        out = []
+        with self._lock:
+            self.batch_calls += 1
+        for part in parsed.get_payload():
+            inner = part.get_payload()
+            request_line, _, rest = inner.partition("\n")
+            method, target, _ = request_line.split(" ", 2)
+            inner_headers, _, inner_body = rest.replace("\r\n", "\n").partition("\n\n")
+            path, _, query = target.partition("?")
+            status, payload = self._route(method, path, query, inner_body or None)
+            content_id = part["Content-ID"].replace("<", "<response-", 1)
+            out.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: {content_id}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n"
+            )
+        out.append(f"--{boundary}--\r\n")
+        response = httplib2.Response({"status": 200, "content-type": f"multipart/mixed; boundary={boundary}"})
+        return response, "".join(out).encode("utf-8")
+
+    def _rejected(self, content) -> bool:
+        return bool(self.reject_marker) and self.reject_marker in content
+
+    def _route(self, method: str, path: str, query: str, body) -> tuple:
+        """(status, payload JSON) de una llamada a Gmail/Calendar, directa o dentro de un lote."""
+        if "/gmail/" in path and path.endswith("/messages/send"):
+            raw = base64.urlsafe_b64decode(json.loads(body)["raw"])
+            if self._rejected(raw.decode("utf-8", "replace")):
+                return 400, {"error": {"code": 400, "message": "Invalid To header"}}
+            return 200, self._send_raw(raw)
+        if "/calendar/" in path and method == "POST":
+            event = json.loads(body)
+            if self._rejected(json.dumps(event, ensure_ascii=False)):
+                return 400, {"error": {"code": 400, "message": "Bad Request: invalid event"}}
+            return 200, self.add_event(event)
+        if "/calendar/" in path and path.endswith("/events"):
+            return self._list_events({k: v[0] for k, v in parse_qs(query).items()})
+        return 404, {"error": {"code": 404, "message": "stub"}}
+
+    def request(self, uri, method="GET", body=None, headers=None, redirections=5, connection_type=None):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        with self._lock:
+            self.requests += 1
+        path, _, query = uri.partition("?")
+        if uri.startswith("https://upload.stub/"):
+            return self._upload_chunk(uri, body, headers)
+        if "/upload/gmail/" in uri and "uploadType=resumable" in query:
+            return self._start_upload(headers), b""
+        if path.endswith("/batch") or "/batch/" in path:
+            return self._batch(body, headers)
+        status, payload = self._route(method, path, query, body)
+        response = httplib2.Response({"status": status, "content-type": "application/json"})
+        return response, json.dumps(payload).encode()
+
+
+# ---------- PDFs sintéticos ----------
+_WORDS = (
+    "contrato cliente proveedor plazo entrega pago factura clausula penalizacion vigencia "
+    "servicio garantia confidencialidad anexo firma fecha monto obligacion rescision"
+).split()
+
+
+def _page_lines(page: int, lines: int = 40, words_per_line: int = 10) -> List[str]:
+    out = [f"Seccion {page}"]
+    for i in range(lines):
+        words = [_WORDS[(page * 31 + i * 7 + j) % len(_WORDS)] for j in range(words_per_line)]
+        out.append(" ".join(words))
+    return out
+
+
+def make_pdf(pages: int) -> bytes:
+    """PDF mínimo válido con `pages` páginas de texto (Helvetica, ASCII)."""
+    objects: List[bytes] = []
+    # 1: catálogo, 2: árbol de páginas, 3: fuente; luego (página, contenido) por cada página
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(pages))
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i in range(pages):
+        stream = "BT /F1 10 Tf 50 790 Td 14 TL " + " ".join(
+            f"({line}) Tj T*" for line in _page_lines(i + 1)
+        ) + " ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{off:010d} 00000 n \n".encode() for off in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
@@ -0,0 +1,164 @@
+# bench/multiprocess_session.py
+"""
+Verificación de estado compartido entre procesos: una misma sesión atendida por
+varios workers (como con `uvicorn --workers N`) sobre el mismo DATA_DIR.
+Cada worker es un proceso con su propio uvicorn, el modelo con guion y Google simulado;
+los requests de la sesión se reparten entre ellos:
+- el PDF se sube a un worker y su job se consulta en otro,
+- pdf_query lo encuentra desde otro worker,
+- la conversación continúa en otro worker (checkpointer compartido) y el documento
+  se anuncia una sola vez,
+- turnos simultáneos de la sesión en workers distintos se ejecutan de a uno (lease de
+  sesión): ninguno se pierde y el historial no queda intercalado,
+- las credenciales guardadas por un worker las usa otro.
+
+Uso: python -m bench.multiprocess_session [--workers 3]
+Sale con código 1 si alguna comprobación falla.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(port: int, data_dir: str, set_creds: bool) -> None:
+    os.environ.update(DATA_DIR=data_dir, STATE_BACKEND="sqlite", TOOLS_DISPATCH="direct")
+    import uvicorn
+    from google.oauth2.credentials import Credentials
+
+    from app import agent
+    from app.google_actions import set_http_factory
+    from app.google_oauth import set_credentials
+    from app.main import app
+
+    from .fakes import ScriptedChatModel, StubGoogleHttp
+
+    # Con latencia, para que los turnos simultáneos de la sesión se solapen
+    agent.set_chat_model(ScriptedChatModel(tool_plan="pdf_query", latency_ms=150))
+    set_http_factory(lambda creds: StubGoogleHttp())
+    if set_creds:
+        set_credentials(Credentials(token="mp-token", refresh_token="mp-refresh", client_id="mp"))
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def _wait_ready(client: httpx.Client, base: str, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if client.get(f"{base}/health/ready").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{base} no quedó listo")
+
+
+def run(workers: int) -> bool:
+    from .fakes import make_pdf
+
+    data_dir = tempfile.mkdtemp(prefix="bench-mp-")
+    ports = [_free_port() for _ in range(workers)]
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_serve, args=(p, data_dir, i == 0), daemon=True) for i, p in enumerate(ports)]
+    for proc in procs:
+        proc.start()
+    bases = [f"http://127.0.0.1:{p}" for p in ports]
+    worker = lambda i: bases[i % workers]  # noqa: E731
+    session = "mp-session"
+    checks = []
+
+    def check(name: str, ok: bool, detail="") -> None:
+        checks.append(ok)
+        print(f"{'OK ' if ok else 'FAIL'} {name} {' '.join(str(detail).split())}")
+
+    try:
+        with httpx.Client(timeout=60) as client:
+            # Las credenciales las guarda el worker 0 al arrancar: se espera a que esté listo primero
+            for base in bases:
+                _wait_ready(client, base)
+
+            res = client.post(
+                f"{worker(0)}/pdf/upload",
+                data={"session_id": session},
+                files={"file": ("contrato.pdf", make_pdf(12), "application/pdf")},
+            )
+            job = res.json()
+            status = {}
+            for _ in range(600):
+                status = client.get(f"{worker(1)}{job['status_url']}").json()
+                if status.get("status") in ("done", "error"):
+                    break
+                time.sleep(0.05)
+            check("job visible desde otro worker", status.get("status") == "done", status.get("status"))
+
+            docs = client.get(f"{worker(2)}/pdf/status", params={"session_id": session}).json()
+            check("documento registrado para la sesión", docs["loaded"], [d["doc_id"] for d in docs["documents"]])
+
+            for turn in range(workers):
+                out = client.post(
+                    f"{worker(turn + 1)}/agent/invoke",
+                    json={"session_id": session, "input": f"plazo de entrega, turno {turn}"},
+                ).json()["output"]
+                check(f"turno {turn} en worker {(turn + 1) % workers} consulta el PDF", "❌" not in out, out[:60])
+
+            # Un turno por worker, todos a la vez
+            def concurrent_turn(i: int) -> int:
+                return client.post(
+                    f"{worker(i)}/agent/invoke",
+                    json={"session_id": session, "input": f"penalización, turno simultáneo {i}"},
+                ).status_code
+
+            with ThreadPoolExecutor(workers) as pool:
+                codes = list(pool.map(concurrent_turn, range(workers)))
+            check("turnos simultáneos en varios workers", codes == [200] * workers, codes)
+
+            sent = client.post(f"{worker(1)}/gmail/send", json={"to": "mp@example.com", "subject": "mp", "body": "hola"})
+            check("credenciales compartidas", sent.status_code == 200, sent.text[:80])
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.join(5)
+
+    # Historial: todos los turnos en un solo thread y el documento anunciado una vez
+    os.environ.update(DATA_DIR=data_dir)
+    from app.checkpointer import create_checkpointer
+    from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+    saved = create_checkpointer("sqlite").get_tuple({"configurable": {"thread_id": session}})
+    messages = saved.checkpoint["channel_values"]["messages"] if saved else []
+    humans = [m for m in messages if isinstance(m, HumanMessage)]
+    announced = sum("[DOCUMENTO ADJUNTO" in str(m.content) for m in humans)
+    # Cada turno: humano, llamada a la tool, su resultado y la respuesta, sin mezclarse con otro
+    interleaved = sum(
+        1 for i, m in enumerate(messages)
+        if isinstance(m, AIMessage) and m.tool_calls
+        and not (i + 1 < len(messages) and isinstance(messages[i + 1], ToolMessage)
+                 and messages[i + 1].tool_call_id == m.tool_calls[0]["id"])
+    )
+    check("conversación continua entre workers", len(humans) == 2 * workers, f"{len(humans)} turnos")
+    check("turnos sin intercalar", interleaved == 0, f"{interleaved} llamadas sin su resultado")
+    check("documento anunciado una sola vez", announced == 1, f"{announced} anuncios")
+    return all(checks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=3, help="Procesos que atienden la sesión")
+    args = parser.parse_args()
+    sys.exit(0 if run(max(args.workers, 2)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# bench/run_bench.py
+"""
+Suite de benchmarks offline: agente, tools e ingesta de PDFs, sin acceso a red.
+- /agent/invoke con un modelo de chat con guion (ScriptedChatModel) a varios niveles de concurrencia
+- overhead de las tools con Gmail/Calendar sobre un transporte local (StubGoogleHttp)
+- un paso del agente con N llamadas independientes a tools (fan-out en paralelo)
+- ingesta de PDFs sintéticos de 10 a 1000 páginas con save_pdf_and_text
+Escribe un JSON con percentiles de latencia, throughput, páginas/s y RSS máximo para comparar corridas.
+
+Uso: python -m bench.run_bench --out bench_results.json [--quick]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+# La configuración de la app se lee al importar: se fija antes de importar app.*
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-data-")
+os.environ.setdefault("CHECKPOINTER", "memory")
+os.environ.setdefault("TOOLS_DISPATCH", "direct")
+
+import httpx  # noqa: E402
+from google.oauth2.credentials import Credentials  # noqa: E402
+
+from app import agent  # noqa: E402
+from app.agent_tools import calendar_event_impl, gmail_send_impl, pdf_query_impl  # noqa: E402
+from app.doc_store import doc_store  # noqa: E402
+from app.google_actions import set_http_factory  # noqa: E402
+from app.google_oauth import set_credentials  # noqa: E402
+from app.main import app  # noqa: E402
+from app.pdf_ingest import save_pdf_and_text, shutdown_pool  # noqa: E402
+
+from .fakes import ScriptedChatModel, StubGoogleHttp, make_pdf  # noqa: E402
+
+
+# ---------- Utilidades ----------
+def percentiles(samples_ms: List[float]) -> Dict:
+    if not samples_ms:
+        return {}
+    data = sorted(samples_ms)
+
+    def pct(p: float) -> float:
+        return round(data[min(int(len(data) * p), len(data) - 1)], 3)
+
+    return {
+        "count": len(data),
+        "mean_ms": round(statistics.mean(data), 3),
+        "p50_ms": pct(0.50),
+        "p90_ms": pct(0.90),
+        "p99_ms": pct(0.99),
+        "max_ms": round(data[-1], 3),
+    }
+
+
+def peak_rss_mb() -> Dict:
+    """RSS máximo del proceso y de sus hijos (pool de extracción), en MiB."""
+    div = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss: bytes en macOS, KiB en Linux
+    return {
+        "self_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / div, 1),
+        "children_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / div, 1),
+    }
+
+
+def _timed(fn, *args, **kwargs) -> float:
+    t0 = time.perf_counter()
+    fn(*args, **kwargs)
+    return (time.perf_counter() - t0) * 1000
+
+
+# ---------- Escenarios ----------
+async def bench_agent(levels: List[int], requests_per_level: int, llm_latency_ms: float, doc_result: Dict) -> Dict:
+    """Latencia y throughput de POST /agent/invoke (ASGI en proceso) por nivel de concurrencia."""
+    agent.set_chat_model(ScriptedChatModel(tool_plan="pdf_query", latency_ms=llm_latency_ms))
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        for level in levels:
+            sem = asyncio.Semaphore(level)
+            samples: List[float] = []
+            errors = 0
+
+            async def one(i: int) -> None:
+                nonlocal errors
+                session_id = f"bench-{level}-{i % max(level, 1)}"
+                doc_store.register(session_id, "bench.pdf", doc_result)
+                async with sem:
+                    t0 = time.perf_counter()
+                    res = await client.post("/agent/invoke", json={"session_id": session_id, "input": "plazo de entrega y pago"})
+                    samples.append((time.perf_counter() - t0) * 1000)
+                    if res.status_code != 200:
+                        errors += 1
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(requests_per_level)))
+            elapsed = time.perf_counter() - t0
+            results[f"concurrency_{level}"] = {
+                **percentiles(samples),
+                "errors": errors,
+                "throughput_rps": round(requests_per_level / elapsed, 2),
+            }
+    return results
+
+
+def bench_tools(iterations: int, google_latency_ms: float, doc_result: Dict) -> Dict:
+    """Overhead por llamada de cada tool (Google sobre transporte local)."""
+    stub = StubGoogleHttp(latency_ms=google_latency_ms)
+    set_http_factory(lambda creds: stub)
+    set_credentials(Credentials(token="bench-token", refresh_token="bench-refresh", client_id="bench"))
+    doc_store.register("bench-tools", "bench.pdf", doc_result)
+    config = {"configurable": {"thread_id": "bench-tools"}}
+
+    calls = {
+        "gmail_send": lambda: gmail_send_impl("bench@example.com", "Bench", "Hola"),
+        "calendar_create_event": lambda: calendar_event_impl(
+            "Bench", "2030-01-01T10:00:00-07:00", "2030-01-01T11:00:00-07:00"
+        ),
+        "pdf_query": lambda: pdf_query_impl("clausula de penalizacion", config=config),
+    }
+    results = {name: percentiles([_timed(fn) for _ in range(iterations)]) for name, fn in calls.items()}
+    results["google_stub_latency_ms"] = google_latency_ms
+    return results
+
+
+async def bench_fanout(fanouts: List[int], google_latency_ms: float) -> Dict:
+    """Latencia de un turno cuyo único paso pide N tools independientes (Calendar con latencia)."""
+    stub = StubGoogleHttp(latency_ms=google_latency_ms)
+    set_http_factory(lambda creds: stub)
+    set_credentials(Credentials(token="bench-token", refresh_token="bench-refresh", client_id="bench"))
+    results = {}
+    for n in fanouts:
+        agent.set_chat_model(ScriptedChatModel(tool_plan="calendar_create_event", fanout=n))
+        samples = []
+        for i in range(5):
+            t0 = time.perf_counter()
+            await agent.answer_async(f"bench-fanout-{n}-{i}", "agenda reuniones")
+            samples.append((time.perf_counter() - t0) * 1000)
+        results[f"tools_{n}"] = percentiles(samples)
+    results["google_stub_latency_ms"] = google_latency_ms
+    return results
+
+
+def bench_ingest(page_counts: List[int]) -> Dict:
+    """Páginas por segundo de save_pdf_and_text (extracción + índice), en frío y con caché."""
+    results = {}
+    for pages in page_counts:
+        pdf = make_pdf(pages)
+        t0 = time.perf_counter()
+        res = save_pdf_and_text(pdf, f"bench-{pages}.pdf")
+        cold = time.perf_counter() - t0
+        warm_ms = _timed(save_pdf_and_text, pdf, f"bench-{pages}.pdf")
+        results[f"pages_{pages}"] = {
+            "bytes": res["bytes"],
+            "cold_s": round(cold, 3),
+            "pages_per_s": round(pages / cold, 1),
+            "repeat_upload_ms": round(warm_ms, 3),
+        }
+    return results
+
+
+def run(quick: bool) -> Dict:
+    levels = [1, 4, 16] if quick else [1, 4, 16, 64]
+    page_counts = [10, 100] if quick else [10, 100, 1000]
+    requests_per_level = 20 if quick else 200
+    iterations = 20 if quick else 200
+
+    doc_result = save_pdf_and_text(make_pdf(50), "bench-agent.pdf")
+    started = time.time()
+    report = {
+        "meta": {
+            "timestamp": started,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "quick": quick,
+        },
+        "ingest": bench_ingest(page_counts),
+        "tools": bench_tools(iterations, google_latency_ms=0.0, doc_result=doc_result),
+        "agent_invoke": asyncio.run(bench_agent(levels, requests_per_level, 5.0, doc_result)),
+        "tool_fanout": asyncio.run(bench_fanout([1, 4, 8], google_latency_ms=50.0)),
+    }
+    report["peak_rss"] = peak_rss_mb()
+    report["meta"]["duration_s"] = round(time.time() - started, 2)
+    shutdown_pool()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="bench_results.json", help="Ruta del JSON de resultados")
+    parser.add_argument("--quick", action="store_true", help="Corrida corta (menos páginas y requests)")
+    args = parser.parse_args()
+
+    report = run(args.quick)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()